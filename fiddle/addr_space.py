@@ -47,6 +47,7 @@ var_perms = tables.Enum(vlist)
 perms = tables.Enum(vlist + ["rwx", "x", "rx"])
 
 
+@pytable_utils.indexes('startaddr', 'endaddr')
 class MemMapEntry(tables.IsDescription):
     name = tables.StringCol(512)
     startaddr = tables.UInt32Col()
@@ -58,6 +59,7 @@ class MemMapEntry(tables.IsDescription):
 #    in_process = tables.BoolCol()
 
 
+@pytable_utils.indexes('startaddr', 'endaddr', 'substage')
 class VarEntry(tables.IsDescription):
     name = tables.StringCol(512)
     startaddr = tables.UInt32Col()
@@ -68,6 +70,7 @@ class VarEntry(tables.IsDescription):
     rawkind = tables.StringCol(128)
 
 
+@pytable_utils.indexes('address')
 class RegEntry(tables.IsDescription):
     name = tables.StringCol(512)
     address = tables.UInt32Col()
@@ -109,10 +112,12 @@ class AddrSpaceInfo():
         self.h5file = tables.open_file(dbloc, mode="w",
                                        title="addr space info")
         self.h5group = self.h5file.create_group("/", self.grpname, "")
-        self.memmap_table = self.h5file.create_table(self.h5group, self.mem_tablename,
-                                                     MemMapEntry, "")
-        self.reg_table = self.h5file.create_table(self.h5group, self.reg_tablename,
-                                                  RegEntry, "")
+        self.memmap_table = pytable_utils.create_table(self.h5file, self.h5group,
+                                                       self.mem_tablename,
+                                                       MemMapEntry, "")
+        self.reg_table = pytable_utils.create_table(self.h5file, self.h5group,
+                                                    self.reg_tablename,
+                                                    RegEntry, "")
         self._create_memmap_table()
         self._create_reg_table()
 
@@ -136,8 +141,6 @@ class AddrSpaceInfo():
                         r[f] = entry[f]
                     #r['substage'] = substage
                     r.append()
-        self.memmap_table.cols.startaddr.create_index(kind='full')
-        self.memmap_table.cols.endaddr.create_index(kind='full')
         self.memmap_table.flush()
 
     def _create_memmap_table(self):
@@ -180,7 +183,6 @@ class AddrSpaceInfo():
 
                 row.append()
             f.close()
-        self.reg_table.cols.address.create_index(kind='full')
         self.reg_table.flush()
 
     def _open_tables(self, loc):
@@ -191,6 +193,7 @@ class AddrSpaceInfo():
 
     def close_dbs(self, flush_only=False):
         if self.h5file:
+            pytable_utils.build_file_indexes(self.h5file)
             self.h5file.flush()
             if not flush_only:
                 self.h5file.close()
@@ -0,0 +1,246 @@
+# MIT License
+
+# Copyright (c) 2017 Rebecca ".bx" Shapiro
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Times each static analysis phase on synthetic builds (see
+# synthetic_elf) and compares the results with saved baselines. Runs
+# offline with whatever fiddle config is in use, nothing outside of the
+# generated builds gets touched:
+#
+#   python fiddle/benchmark.py -s 64 -s 1024 -b bench-baseline.json
+
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import resource
+import tempfile
+import traceback
+import tables
+from munch import munchify
+from config import Main
+import staticanalysis
+import labeltool
+import synthetic_elf
+
+# (name, WriteSearch method, table it fills), run in this order, each in
+# a process of its own
+phases = [
+    ("writes", "create_writes_table", "writestable"),
+    ("longwrites", "create_longwrites_table", "longwritestable"),
+    ("skips", "create_skip_table", "skipstable"),
+    ("relocs", "create_relocs_table", "relocstable"),
+]
+nodes = {"relocstable": "relocs", "stageexits": "stageexits", "writestable": "writes",
+         "smcstable": "smcs", "srcstable": "srcs", "funcstable": "funcs",
+         "provenancetable": "provenance", "rangestable": "ranges",
+         "longwritestable": "longwrites", "skipstable": "skips"}
+measures = ["wall", "maxrss", "forks"]
+
+
+# the parts of a TargetStage that static analysis looks at
+class SyntheticStage():
+    def __init__(self, build, elf):
+        self.stagename = build.stagename
+        self.elf = elf
+        self.reloc_descrs = []
+        self.longwrites = [munchify({'name': n, 'dregs': [], 'calcregs': ['r2'],
+                                     'subreg': '', 'writetype': 'count',
+                                     'interval': 1, 'inplace': False})
+                           for n in build.longwrites]
+
+
+def _configure(stage, db, srcdir, jobs):
+    Main._plain_update_raw("static_analysis.db.%s" % stage.stagename, db)
+    Main._plain_update_raw("runtime.temp_target_src_dir", srcdir)
+    Main._plain_update_raw("runtime.static_analysis_jobs", jobs)
+    Main._plain_update_raw("runtime.static_analysis_base", "")
+    Main._plain_update_raw("runtime.labels", lambda: labeltool.get_all_labels(srcdir))
+
+
+def _attach(ws):
+    # the tables earlier phases made
+    for (attr, node) in nodes.iteritems():
+        try:
+            setattr(ws, attr, ws.h5file.get_node(ws.group, node))
+        except tables.NoSuchNodeError:
+            pass
+
+
+def _count_forks():
+    # every subprocess, r2 and worker pools included, starts with one of these
+    counts = {'forks': 0}
+    (fork, system) = (os.fork, os.system)
+
+    def counted_fork():
+        counts['forks'] += 1
+        return fork()
+
+    def counted_system(cmd):
+        counts['forks'] += 1
+        return system(cmd)
+    os.fork = counted_fork
+    os.system = counted_system
+    return counts
+
+
+def run_phase(stage, method, table, create):
+    # {measure: value} of running method in a child process, so that
+    # peak RSS is that of this phase alone
+    (rfd, wfd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        try:
+            counts = _count_forks()
+            start = time.time()
+            ws = staticanalysis.WriteSearch(create, stage)
+            _attach(ws)
+            getattr(ws, method)()
+            rows = getattr(ws, table).nrows
+            ws.closedb(False)
+            res = {'wall': time.time() - start,
+                   'maxrss': max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                 resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+                   'forks': counts['forks'],
+                   'rows': rows}
+        except Exception:
+            res = {'error': traceback.format_exc()}
+        with os.fdopen(wfd, "w") as f:
+            json.dump(res, f)
+        os._exit(0)
+    os.close(wfd)
+    with os.fdopen(rfd) as f:
+        out = f.read()
+    os.waitpid(pid, 0)
+    return json.loads(out) if out else {'error': "phase exited without results"}
+
+
+def run_build(build, root, jobs):
+    # {phase: results} for build, generated under root
+    elf = os.path.join(root, "bench.elf")
+    srcdir = os.path.join(root, "src")
+    db = os.path.join(root, "static-analysis.h5")
+    build.write_elf(elf)
+    build.write_source(srcdir)
+    stage = SyntheticStage(build, elf)
+    _configure(stage, db, srcdir, jobs)
+    results = {}
+    for (i, (name, method, table)) in enumerate(phases):
+        results[name] = run_phase(stage, method, table, i == 0)
+        if 'error' in results[name]:
+            break
+    return results
+
+
+def build_name(args, size):
+    return "%dk-s%g-t%g-l%d-j%d" % (size, args.store_density, args.thumb_fraction,
+                                    args.labels, args.jobs)
+
+
+def compare(results, baseline, tolerance):
+    # a description of each measure that is worse than baseline by more
+    # than tolerance (a fraction)
+    worse = []
+    for (build, phaseresults) in sorted(results.iteritems()):
+        for (phase, res) in sorted(phaseresults.iteritems()):
+            old = baseline.get(build, {}).get(phase)
+            if (not old) or ('error' in res):
+                continue
+            for m in measures:
+                if (m in old) and (res[m] > old[m] * (1 + tolerance)):
+                    worse.append("%s %s: %s %g, baseline %g" % (build, phase, m, res[m], old[m]))
+    return worse
+
+
+def report(results, baseline):
+    for (build, phaseresults) in sorted(results.iteritems()):
+        for (name, method, table) in phases:
+            if name not in phaseresults:
+                continue
+            res = phaseresults[name]
+            if 'error' in res:
+                print "%s %-10s failed:\n%s" % (build, name, res['error'])
+                continue
+            line = "%s %-10s %8.2fs %8dKB %4d forks %8d rows" % \
+                (build, name, res['wall'], res['maxrss'], res['forks'], res['rows'])
+            old = baseline.get(build, {}).get(name)
+            if old:
+                line += " (baseline %.2fs %dKB %d forks)" % (old['wall'], old['maxrss'],
+                                                            old['forks'])
+            print line
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("static analysis benchmarks")
+    parser.add_argument('-s', '--size', action='append', type=int,
+                        help='KiB of code in each synthetic build (default 64 and 512)')
+    parser.add_argument('-d', '--store-density', type=float, default=0.2,
+                        help='fraction of instructions that are stores')
+    parser.add_argument('-t', '--thumb-fraction', type=float, default=0.5,
+                        help='fraction of functions in Thumb')
+    parser.add_argument('-l', '--labels', type=int, default=32,
+                        help='number of source labels')
+    parser.add_argument('-r', '--seed', type=int, default=0)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='static_analysis_jobs to use')
+    parser.add_argument('-b', '--baseline', action='store',
+                        help='json file of results to compare with')
+    parser.add_argument('-S', '--save-baseline', action='store_true', default=False,
+                        help='save the results to the baseline file')
+    parser.add_argument('-T', '--tolerance', type=float, default=0.25,
+                        help='slowdown (a fraction) to allow before failing')
+    parser.add_argument('-k', '--keep', action='store',
+                        help='generate builds in this directory and leave them there')
+    args = parser.parse_args()
+    sizes = args.size if args.size else [64, 512]
+    baseline = {}
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    root = args.keep if args.keep else tempfile.mkdtemp(prefix="fiddle-bench")
+    results = {}
+    failed = False
+    try:
+        for size in sizes:
+            name = build_name(args, size)
+            build = synthetic_elf.SyntheticBuild(size * 1024, args.store_density,
+                                                 args.thumb_fraction, args.labels,
+                                                 args.seed)
+            d = os.path.join(root, name)
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            results[name] = run_build(build, d, args.jobs)
+            failed = failed or any('error' in r for r in results[name].itervalues())
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, True)
+    report(results, baseline)
+    worse = compare(results, baseline, args.tolerance)
+    for w in worse:
+        print "slower than baseline: %s" % w
+    if args.save_baseline and args.baseline and not failed:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+    sys.exit(1 if (worse or failed) else 0)
@@ -0,0 +1,116 @@
+# MIT License
+
+# Copyright (c) 2017 Rebecca ".bx" Shapiro
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+
+# directory of files named by a hash of whatever they were built from,
+# shared between test instances.  Least recently used entries are
+# evicted once the directory grows past max_size bytes
+class ContentCache():
+    default_max_size = 10 * 1024 * 1024 * 1024
+
+    def __init__(self, root, max_size=None):
+        self.root = root
+        self.max_size = self.default_max_size if max_size is None else max_size
+        if not os.path.isdir(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError:  # someone else made it first
+                pass
+
+    @classmethod
+    def key(cls, *parts):
+        m = hashlib.md5()
+        for p in parts:
+            m.update(repr(p))
+        return m.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.root, key)
+
+    def lookup(self, key):
+        path = self.entry(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            os.utime(path, None)  # mark as recently used
+        except OSError:
+            pass
+        return path
+
+    def fetch(self, key, dst):
+        src = self.lookup(key)
+        if src is None:
+            return False
+        self._copy(src, dst)
+        return True
+
+    def store(self, key, src):
+        self._copy(src, self.entry(key))
+        self.evict(keep=key)
+
+    def _copy(self, src, dst):
+        # copy next to the destination and rename so readers never see
+        # a partially written file
+        (fd, tmp) = tempfile.mkstemp(prefix=".tmp", dir=os.path.dirname(dst))
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp)
+            os.rename(tmp, dst)
+        except:
+            os.remove(tmp)
+            raise
+
+    def entries(self):
+        es = []
+        for name in os.listdir(self.root):
+            if name.startswith("."):  # copy in progress
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            es.append((st.st_mtime, st.st_size, name))
+        return sorted(es)
+
+    def size(self):
+        return sum([s for (t, s, n) in self.entries()])
+
+    def evict(self, keep=None):
+        es = self.entries()
+        total = sum([s for (t, s, n) in es])
+        for (t, s, name) in es:
+            if total <= self.max_size:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.root, name))
+                total -= s
+            except OSError:
+                pass
@@ -35,12 +35,14 @@ import staticanalysis
 import traceback
 import pytable_utils
 import intervaltree
+import range_map
 import db_info
 import substage
 import sys
 import pure_utils
 from capstone import *
 import os
+import numpy
 l = logging.getLogger("")
 
 
@@ -51,9 +53,11 @@ def int_repr(self):
 intervaltree.Interval.__str__ = int_repr
 intervaltree.Interval.__repr__ = int_repr
 
+@pytable_utils.indexes('line', 'writepc', 'substage')
+@pytable_utils.interned('line', 'lvalue')
 class FramaCDstEntry(tables.IsDescription):
-    line = tables.StringCol(512)  # file/lineno
-    lvalue = tables.StringCol(512)  # lvalue as reported by framac
+    line = tables.UInt32Col()  # file/lineno
+    lvalue = tables.UInt32Col()  # lvalue as reported by framac
     dstlo = tables.UInt32Col()  # low value of write dst range
     dsthi = tables.UInt32Col()  # high value of write dst range
     dst_not_in_ram = tables.BoolCol()  # true if range is not RAM
@@ -119,21 +123,15 @@ class WriteDstTable():
             self.tables[num] = None
 
         if self.tables[num] is None:
-            self.tables[num] = self.h5file.create_table(self.group, self.name(num),
-                                                        FramaCDstEntry, self.desc)
-            self.tables[num].cols.line.create_index(kind='full')
-            self.tables[num].cols.writepc.create_index(kind='full')
-            self.tables[num].cols.substage.create_index(kind='full')
+            self.tables[num] = pytable_utils.create_table(self.h5file, self.group,
+                                                          self.name(num),
+                                                          FramaCDstEntry, self.desc)
             self.tables[num].flush()
             self.h5file.flush()
 
     def flush_table(self):
         for t in self.tables.itervalues():
-            try:
-                t.reindex_dirty()
-            except:
-                pass
-            t.flush()
+            pytable_utils.build_indexes(t)
         self.h5file.flush()
 
     def _addr_inter_is_not_ram(self, i):
@@ -194,8 +192,26 @@ class WriteDstTable():
         num = dstinfo.substage
         if num not in self.tables.iterkeys():
             self._init_table(num)
-        r = self.tables[num].row
+        t = self.tables[num]
+        r = t.row
+        for row in self._dsts_rows(dstinfo):
+            for (k, v) in pytable_utils.encode_row(t, row).iteritems():
+                r[k] = v
+            r.append()
+
+    def add_dsts_entries(self, dstinfos):
+        # one append per substage table for all of dstinfos
+        rows = {}
+        for dstinfo in dstinfos:
+            rows.setdefault(dstinfo.substage, []).extend(self._dsts_rows(dstinfo))
+        for (num, rs) in rows.iteritems():
+            if num not in self.tables.iterkeys():
+                self._init_table(num)
+            pytable_utils.append_rows(self.tables[num], rs)
+
+    def _dsts_rows(self, dstinfo):
         for v in dstinfo.values:
+            r = {}
             r['dstlo'] = v.begin
             r['dsthi'] = v.end
             r['dst_not_in_ram'] = self._addr_inter_is_not_ram(v)
@@ -213,7 +229,7 @@ class WriteDstTable():
                 continue
             r['writepc'] = dstinfo.pc
             r['origpc'] = dstinfo.origpc if dstinfo.origpc else r['writepc']
-            r.append()
+            yield r
 
     def print_dsts_info(self):
         self.flush_table()
@@ -225,6 +241,7 @@ class WriteDstTable():
                                     num_writes)
         for t in self.tables.itervalues():
             for r in t.iterrows():
+                r = pytable_utils.row_dict(t, r)
                 print "%s (%x) -> (%x,%x). substage: %s" % \
                     (r['line'], r['writepc'], r['dstlo'], r['dsthi'], r['substage'])
 
@@ -321,6 +338,7 @@ class WriteDstResult():
         return "%s %s" % (self.key(), self.values)
 
 
+@pytable_utils.indexes('relocatedpc', 'pc', 'index', 'dest')
 class TraceWriteEntry(tables.IsDescription):
     index = tables.UInt32Col()
     pid = tables.UInt32Col()
@@ -335,6 +353,7 @@ class TraceWriteEntry(tables.IsDescription):
     substage = tables.UInt8Col()
 
 
+@pytable_utils.indexes('index')
 class TraceWriteRange(tables.IsDescription):
     index = tables.UInt32Col()
     destlo = tables.UInt32Col()
@@ -367,29 +386,33 @@ class TraceTable():
         self.create = create
         if create:
             m = "a"
-        self.writestable = None
+        self._writestable = None
+        # writes not in the table yet, see add_write_entries
+        self._rows = []
+        self._pending = []
+        self._npending = 0
+        self.write_batch_size = self._runtime_setting("trace_write_batch_size", 65536)
+        self.write_flush = self._runtime_setting("trace_write_flush", "batch")
         if not create:
             self.h5file = tables.open_file(self.outname, mode="a",
                                            title="QEMU tracing information")
             try:
-                self.writestable = self.get_group().writes
+                self._writestable = self.get_group().writes
             except tables.exceptions.NoSuchNodeError:
                 # go ahead and create table
                 m = "a"
                 self.h5file.close()
 
-        if self.writestable is None:
+        if self._writestable is None:
             self.h5file = tables.open_file(self.outname, mode=m,
                                            title="QEMU tracing information")
             group = self.h5file.create_group("/", self.stagename,
                                              "Memory write information")
-            self.writestable = self.h5file.create_table(group, TraceTable.h5tablename,
-                                                        TraceWriteEntry,
-                                                        "memory write information")
-            self.writestable.cols.relocatedpc.create_index(kind='full')
-            self.writestable.cols.pc.create_index(kind='full')
-            self.writestable.cols.index.create_index(kind='full')
-            self.writestable.cols.dest.create_index(kind='full')
+            self._writestable = pytable_utils.create_table(self.h5file, group,
+                                                           TraceTable.h5tablename,
+                                                           TraceWriteEntry,
+                                                           "memory write information",
+                                                           "scan", 10000000)
 
             self.writestable.flush()
 
@@ -401,6 +424,19 @@ class TraceTable():
         self._rinfos = None
         self._pcmax = None
 
+    @classmethod
+    def _runtime_setting(cls, key, default):
+        try:
+            return Main.get_runtime_config(key)
+        except AttributeError:
+            return default
+
+    @property
+    def writestable(self):
+        # anything that looks at the table sees every write added so far
+        self.flush_writes()
+        return self._writestable
+
     @property
     def pcmax(self):
         if self._pcmax is None:
@@ -455,6 +491,8 @@ class TraceTable():
 
     def close(self, flush_only=False):
         db_info.get(self.stage).flush_staticdb()
+        self.flush_writes()
+        pytable_utils.build_file_indexes(self.h5file)
         self.h5file.flush()
         if not flush_only:
             self.h5file.close()
@@ -487,7 +525,7 @@ class TraceTable():
             csvfile = open(csvfile, 'w')
             csvfile.write("idx,pc,lrpc,numops,numbytes,substage,fn,lr,note,nudge\n")
         try:
-            rs = rangetable.read_sorted('index')
+            rs = pytable_utils.get_sorted(rangetable, 'index')
         except ValueError:
             rangetable.cols.index.create_index(kind='full')
             rangetable.cols.index.reindex()
@@ -559,76 +597,52 @@ class TraceTable():
                 break
         if populated:
             self.writerangetable_consolidated.purge()
-        last = None
         sortindex = 'line' if framac else 'writepc'
-        intervals = intervaltree.IntervalTree()
-        r = None
         substagenums = substage.SubstagesInfo.substage_numbers(self.stage)
-        writepc = None
-        line = None
-        lvalue = None
-        dst_not_in_ram = True
+        last = None
         for n in substagenums:
             if n not in self.writerangetable_consolidated.tables.keys():
                 self.writerangetable_consolidated._init_table(n)
-            if n > 0:  # add last interval
-                self._add_intervals_to_table(self.writerangetable_consolidated.tables[n],
-                                             intervals,
-                                             writepc, line, lvalue, dst_not_in_ram,
-                                             n)
-            last = None
-            lvalue = None
-            dst_not_in_ram = True
-            writepc = None
-            line = None
-            count = 0
-            intervals = intervaltree.IntervalTree()  # clear intervals
-            print "writerange[%s] %s" % (n, self.writerangetable.tables[n].nrows)
-            for r in self.writerangetable.tables[n].read_sorted(sortindex):
-                count += 1
-                if not last == r[sortindex]:
-                    if last is not None:
-                        self._add_intervals_to_table(self.writerangetable_consolidated.tables[n],
-                                                     intervals,
-                                                     writepc,
-                                                     line,
-                                                     lvalue,
-                                                     dst_not_in_ram,
-                                                     n)
-                    intervals = intervaltree.IntervalTree()  # clear intervals
-                    writepc = r['writepc']
-                    line = r['line']
-                    lvalue = r['lvalue']
-                    dst_not_in_ram = r['dst_not_in_ram']
-                    last = r[sortindex]
-                if last is None:
-                    last = r[sortindex]
-                dst_not_in_ram = dst_not_in_ram and r['dst_not_in_ram']
-                intervals.addi(r['dstlo'], r['dsthi'])
-            if intervals:
-                self._add_intervals_to_table(self.writerangetable_consolidated.tables[n],
-                                             intervals,
-                                             writepc, line, lvalue, dst_not_in_ram, n)
+            table = self.writerangetable_consolidated.tables[n]
+            if last is not None:
+                # the last group of the previous substage goes in again
+                self._add_ranges_to_table(table, last, n)
+            t = self.writerangetable.tables[n]
+            rows = t.read()
+            print "writerange[%s] %s" % (n, len(rows))
+            # group by the lines themselves, not their ids, so the groups
+            # come out in line order
+            keys = pytable_utils.column_strings(t, sortindex, rows[sortindex])
+            (ranges, keys) = self.union_write_ranges(rows, keys)
+            self._add_ranges_to_table(table, ranges, n)
+            last = ranges[keys == keys[-1]] if len(ranges) else None
         self.writerangetable_consolidated.flush_table()
         for n in substagenums:
             print "write range consolidated "\
                 "stage %s nrows %s" % (n,
                                        self.writerangetable_consolidated.tables[n].nrows)
 
-    def _add_intervals_to_table(self, table, intervals, pc, line, lvalue, dst, substage):
-        intervals.merge_overlaps()
-        intervals.merge_equals()
-        intervals.merge_overlaps()
-        r = table.row
-        for i in intervals:
-            r['writepc'] = pc
-            r['line'] = line
-            r['lvalue'] = lvalue
-            r['dst_not_in_ram'] = dst
-            r['substage'] = substage
-            r['dstlo'] = i.begin
-            r['dsthi'] = i.end
-            r.append()
+    @classmethod
+    def union_write_ranges(cls, rows, keys):
+        # FramaCDstEntry rows with the dst ranges of the rows sharing a
+        # key merged, writepc, line and lvalue taken from the first of
+        # them, and the key of each. dst_not_in_ram is only true if it is
+        # for all of them
+        (uniq, inverse) = numpy.unique(keys, return_inverse=True)
+        notram = numpy.ones(len(uniq), dtype=bool)
+        numpy.logical_and.at(notram, inverse, rows['dst_not_in_ram'])
+        (firsts, starts, ends) = range_map.union_by(keys, rows['dstlo'], rows['dsthi'])
+        ranges = rows[firsts]
+        ranges['dstlo'] = starts
+        ranges['dsthi'] = ends
+        ranges['dst_not_in_ram'] = notram[inverse[firsts]]
+        return (ranges, keys[firsts])
+
+    def _add_ranges_to_table(self, table, ranges, substage):
+        ranges = ranges.copy()
+        ranges['substage'] = substage
+        ranges['origpc'] = 0
+        table.append(ranges)
 
     def has_histogram(self):
         return hasattr(self.get_group(), 'writerange')
@@ -639,155 +653,176 @@ class TraceTable():
         if hasattr(group, 'writerange'):
             # make the table again, just in case
             group.writerange.remove()
-        histotable = self.h5file.create_table(group, 'writerange',
-                                              TraceWriteRange, "qemu memory write ranges")
-        histotable.cols.index.create_index(kind='full')
-        srcdir = Main.raw.runtime.temp_target_src_dir
-        relocatedpc = 0
-        relocatedlr = 0
-        size = 0
-        byteswritten = 0
-        destlo = 0
-        currentrow = None
-        line = ''
-        index = 0
-        push = False
-        pc = -1
-        substage = -1
-        for writerow in self.writestable.read_sorted('index'):
-            if (writerow['relocatedpc'] == relocatedpc) and \
-               (writerow['relocatedlr'] == relocatedlr) and \
-               ((destlo + byteswritten) == writerow['dest']):
-                # append to current row
-                currentrow['byteswritten'] += size
-                byteswritten = currentrow['byteswritten']
-                if push:
-                    currentrow['destlo'] = currentrow['desthi'] - byteswritten
-                else:
-                    currentrow['desthi'] = currentrow['destlo'] + byteswritten
-                currentrow['numops'] += 1
-            else:
-                # create a new row
-                if currentrow is not None:
-                    if push:
-                        push = False
-                    currentrow.append()
-                # start a new row
-                currentrow = histotable.row
-                pc = writerow['pc']
-                relocatedpc = writerow['relocatedpc']
-                relocatedlr = writerow['relocatedlr']
-                currentrow['cpsr'] = writerow['cpsr']
-                currentrow['lr'] = writerow['lr']
-                lr = writerow['lr']
-                substage = writerow['substage']
-                currentrow['numops'] = 1
-                currentrow['pc'] = pc
-                currentrow['relocatedpc'] = relocatedpc
-                currentrow['relocatedlr'] = relocatedlr
-                currentrow['substage'] = substage
-                currentrow['index'] = index
-                index += 1
-                size = db_info.get(self.stage).pc_write_size(pc)
-                if size < 0:
-                    desthi = writerow['dest']
-                    currentrow['desthi'] = desthi
-                    currentrow['destlo'] = desthi - size
-                    size = -1*size
-                    push = True
-                else:
-                    push = False
-                    destlo = writerow['dest']
-                    currentrow['destlo'] = destlo
-                    currentrow['desthi'] = destlo + size
-                byteswritten = size
-                currentrow['byteswritten'] = size
-
-                lrilength = 0
-                lrthumb = False
-                lrdisasm = ''
-                lrfunc = ''
-
-                # check if lr information is in src table
-                if not self.thumbranges.overlaps_point(lr) or self.dataranges.overlaps_point(lr):
-                    # lr not code!
-                    continue
-                if db_info.get(self.stage).addr_in_srcs_table(lr):
-                    #  do nothing, already in table
-                    continue
+        histotable = pytable_utils.create_table(self.h5file, group, 'writerange',
+                                                TraceWriteRange, "qemu memory write ranges",
+                                                "scan", 1000000)
+        info = db_info.get(self.stage)
+        writes = self.writestable
+        pytable_utils.build_indexes(writes)
+        nranges = 0
+        last = None
+        lrs = []
+        # a batch of writes at a time, holding back each batch's last range
+        # in case the next batch carries on with it
+        for start in xrange(0, writes.nrows, self.write_batch_size):
+            rows = writes.read_sorted('index', start=start,
+                                      stop=start + self.write_batch_size)
+            (ranges, nextdest, push) = self.write_ranges(rows,
+                                                         info.pc_write_size_array(rows['pc']))
+            if last is not None:
+                if self._continues_range(last, rows[0]):
+                    ranges[0] = self._merge_ranges(last, ranges[0])
                 else:
-                    lrthumb = self.thumbranges.overlaps_point(lr)
-                    lrilength = 4
-                    if lrthumb:
-                        lrilength = 2
-                    (lrvalue, lrdisasm, lrfunc) = \
-                        utils.addr2disasmobjdump(lr, lrilength,
-                                                 self.stage, lrthumb)
-                    db_info.get(self.stage).add_source_code_info_row(lrthumb,
-                                                                     lr,
-                                                                     lrvalue,
-                                                                     lrdisasm)
-                # now try to add to func table
-                if len(lrfunc) > 0:
-                    if db_info.get(self.stage).addr_in_funcs_table(lr):
-                        # do nothing
-                        continue
-                    else:
-                        cmd = "%sgdb -ex 'dir %s' -ex 'disassemble/r %s' --batch --nh --nx  %s" \
-                              % (self.cc, srcdir, lrfunc, self.stage.elf)
-                        output = Main.shell.run_multiline_cmd(cmd)
-                        try:
-                            start = output[1].split('\t')
-                        except IndexError:
-                            continue
-                        startaddr = int(start[0].split()[0], 16)
-                        end = output[-3].split('\t')
-                        endaddr = int(end[0].split()[0], 16)
-                        db_info.get(self.stage).add_funcs_table_row(lrfunc, startaddr, endaddr)
-
-        if currentrow is not None:
-            currentrow.append()  # append last row
+                    ranges = numpy.concatenate([last[0], ranges])
+            ranges['index'] = numpy.arange(nranges, nranges + len(ranges))
+            histotable.append(ranges[:-1])
+            nranges += len(ranges) - 1
+            last = (ranges[-1:], nextdest, push)
+            lrs.append(numpy.unique(ranges['lr']))
+        if last is not None:
+            histotable.append(last[0])  # append last row
+
+        # add the callers that are code to the src table if not there yet
+        lrs = numpy.unique(numpy.concatenate(lrs)) if lrs else numpy.array([], dtype=numpy.int64)
+        lrs = lrs[self.thumbranges.contains_points(lrs) &
+                  ~self.dataranges.contains_points(lrs)]
+        lrs = lrs[~info.addr_in_srcs_table_array(lrs)]
+        if len(lrs):
+            info.add_source_code_info_rows(lrs.tolist(), True)
+
         self.writerangetable.flush_table()
-        histotable.flush()
-        histotable.reindex()
-        histotable.flush()
+        pytable_utils.build_indexes(histotable)
         self.h5file.flush()
 
+    @classmethod
+    def write_ranges(cls, writes, sizes):
+        # writes (sorted by index) grouped into runs of writes by the same
+        # instruction from the same caller, each one right after the last
+        # (or right before it, for a push). sizes is the static write size
+        # of each write's pc. Returns a TraceWriteRange row for each run,
+        # where the run's next write would go and whether the last run is
+        # a push
+        step = numpy.abs(sizes).astype(numpy.int64)
+        push = sizes < 0
+        dest = writes['dest'].astype(numpy.int64)
+        nextdest = numpy.where(push, dest - step, dest + step)
+        same = (writes['relocatedpc'][1:] == writes['relocatedpc'][:-1]) & \
+            (writes['relocatedlr'][1:] == writes['relocatedlr'][:-1]) & \
+            (dest[1:] == nextdest[:-1])
+        starts = numpy.flatnonzero(numpy.concatenate([[True], ~same]))
+        ranges = numpy.zeros(len(starts), dtype=tables.description.dtype_from_descr(TraceWriteRange))
+        for f in ['pc', 'relocatedpc', 'lr', 'relocatedlr', 'cpsr', 'substage']:
+            ranges[f] = writes[f][starts]
+        ranges['numops'] = numpy.diff(numpy.append(starts, len(writes)))
+        byteswritten = numpy.add.reduceat(step, starts)
+        first = dest[starts]
+        ranges['byteswritten'] = byteswritten
+        ranges['destlo'] = numpy.where(push[starts], first - byteswritten, first)
+        ranges['desthi'] = numpy.where(push[starts], first, first + byteswritten)
+        return (ranges, nextdest[-1], push[-1])
+
+    @classmethod
+    def _continues_range(cls, last, write):
+        (r, nextdest, push) = last
+        r = r[0]
+        return (r['relocatedpc'] == write['relocatedpc']) and \
+            (r['relocatedlr'] == write['relocatedlr']) and \
+            (nextdest == write['dest'])
+
+    @classmethod
+    def _merge_ranges(cls, last, r):
+        (m, nextdest, push) = last
+        m = m[0].copy()
+        m['numops'] += r['numops']
+        m['byteswritten'] += r['byteswritten']
+        if push:
+            m['destlo'] = m['desthi'] - m['byteswritten']
+        else:
+            m['desthi'] = m['destlo'] + m['byteswritten']
+        return m
+
     def index_write_table(self):
         self.h5file.flush()
 
     def add_write_entry(self, time, pid, size,
                         dest, pc, lr, cpsr, index=0, num=None):
-        #if self.pcmin > self.pcmax:
-        #    print "PC not in range %x %x (%x)" % (self.pcmin, self.pcmax, pc)
-            # traceback.print_stack()
-        #if (pc <= self.pcmax) and (pc >= self.pcmin):
-            # get relocation info from writesearch database
-        r = self.writestable.row
-        r['pid'] = pid
-        r['dest'] = dest
-        r['relocatedpc'] = pc
-        r['relocatedlr'] = lr
-        r['time'] = time
-        r['reportedsize'] = size
-        if index > 0:
-            r['index'] = index
+        # kept until there are write_batch_size writes to add at once
+        self._rows.append((time, pid, size, dest, pc, lr, cpsr, index,
+                           0 if num is None else num))
+        if (len(self._rows) + self._npending) >= self.write_batch_size:
+            self.flush_writes()
+
+    def add_write_entries(self, writes, index=None, num=None):
+        # add a batch of writes, either a structured array or a dict of
+        # columns, with time, pid, size, dest, pc, lr and cpsr fields.
+        # index and num (the substage) are a value or a column each, an
+        # index of 0 means the write's position in the table
+        self._buffer_rows()
+        n = len(writes['pc'])
+        if n == 0:
+            return
+        a = numpy.zeros(n, dtype=self._writestable.dtype)
+        pc = numpy.asarray(writes['pc'], dtype=numpy.int64)
+        lr = numpy.asarray(writes['lr'], dtype=numpy.int64)
+        a['pid'] = writes['pid']
+        a['dest'] = writes['dest']
+        a['time'] = writes['time']
+        a['reportedsize'] = writes['size']
+        a['cpsr'] = writes['cpsr']
+        a['relocatedpc'] = pc
+        a['relocatedlr'] = lr
+        (a['pc'], a['lr']) = self._unrelocate(pc, lr)
+        positions = self._writestable.nrows + self._npending + numpy.arange(n)
+        if index is None:
+            a['index'] = positions
         else:
-            r['index'] = self.writestable.nrows
-        r['cpsr'] = cpsr
-        r['pc'] = pc
-        r['lr'] = lr
+            index = numpy.asarray(index)
+            a['index'] = numpy.where(index > 0, index, positions)
         if num is not None:
-            r['substage'] = num
+            a['substage'] = num
+        self._pending.append(a)
+        self._npending += n
+        if self._npending >= self.write_batch_size:
+            self.flush_writes()
+
+    def _buffer_rows(self):
+        # move writes added one at a time into the pending batches
+        if not self._rows:
+            return
+        rows = self._rows
+        self._rows = []
+        cols = zip(*rows)
+        writes = dict(zip(['time', 'pid', 'size', 'dest', 'pc', 'lr', 'cpsr'], cols[:7]))
+        self.add_write_entries(writes, cols[7], cols[8])
+
+    def _unrelocate(self, pc, lr):
+        # pc and lr as they were before relocation, using the first
+        # relocated range each pc is in (for now we assume no overlap)
+        pc = pc.copy()
+        lr = lr.copy()
+        todo = numpy.ones(len(pc), dtype=bool)
         for rinfo in self.rinfos:
             offset = rinfo['reloffset']
             start = (rinfo['startaddr']+offset)
             end = start + rinfo['size'] + offset
-            # if pc is in a relocated dest range  (for now we assume no overlap)
-            if (start <= pc) and (pc <= end):
-                r['pc'] = pc - offset
-                r['lr'] = lr - offset
-                break
-        r.append()
+            inside = todo & (start <= pc) & (pc <= end)
+            pc[inside] -= offset
+            lr[inside] -= offset
+            todo &= ~inside
+        return (pc, lr)
+
+    def flush_writes(self):
+        # write out every batch still in memory with a single append, and
+        # flush the file too unless write_flush is "close"
+        self._buffer_rows()
+        if not self._pending:
+            return
+        batch = numpy.concatenate(self._pending) if len(self._pending) > 1 \
+            else self._pending[0]
+        self._pending = []
+        self._npending = 0
+        self._writestable.append(batch)
+        if self.write_flush == "batch":
+            self._writestable.flush()
 
         
@@ -30,6 +30,8 @@ import substage
 import database
 import re
 import intervaltree
+import numpy
+import static_snapshot
 
 _singletons = {}
 _mmapdb = None
@@ -184,11 +186,20 @@ class TraceDB(DBObj):
             self._db.close(True)
 
 
+def _table_profiles():
+    # storage profile by table name, see pytable_utils.profiles
+    try:
+        return dict(Main.get_runtime_config("table_profiles"))
+    except AttributeError:
+        return {}
+
+
 class DBInfo():
     def __init__(self, *args, **kwargs):
         global _mmapdb
         self.key = args[0]
         self.stage = args[0]
+        pytable_utils.table_profiles.update(_table_profiles())
         # single _mmapdb is shared by all stages
         if _mmapdb is None:
             _mmapdb = MMapDB("all")
@@ -264,10 +275,22 @@ class DBInfo():
         return [smcs_dict(r)
                 for r in self._sdb.db.smcstable.iterrows()]
 
+    def _snapshot(self):
+        return self._sdb.db.snapshot()
+
     def is_smc(self, pc):
+        s = self._snapshot()
+        if s:
+            return s.is_smc(pc)
         query = "pc == 0x%x" % pc
         return pytable_utils.has_results(self._sdb.db.smcstable, query)
 
+    def is_smc_array(self, pcs):
+        s = self._snapshot()
+        if s:
+            return s.are_smcs(pcs)
+        return numpy.array([self.is_smc(pc) for pc in pcs], dtype=bool)
+
     def longwrites_calculate_dest_addrs(self, row, rangetype, regs,
                                         sregs=None, eregs=None, string=None):
         calculator = staticanalysis.LongWriteRangeType.range_calculator(rangetype)
@@ -278,13 +301,23 @@ class DBInfo():
             or (rangetype == (staticanalysis.LongWriteRangeType.enum().sourcestr))
 
     def pc_writes_info(self, pc):
-        fields = ['pc', 'thumb', 'reg0', 'reg1', 'reg2',
-                  'reg3', 'reg4', 'writesize', 'halt']
+        s = self._snapshot()
+        if s:
+            return s.write_info(pc)
+        fields = static_snapshot.write_fields
 
         return {f: r[f] for f in fields
                 for r in
                 pytable_utils.query(self._sdb.db.writestable, "pc == 0x%x" % pc)}
 
+    def write_recipes(self):
+        # pc -> (basereg, indexreg, lshift, disp, writesize, cc) for every
+        # write, read in one go
+        rows = self._sdb.db.writestable.read()
+        return {int(r['pc']): (int(r['basereg']), int(r['indexreg']), int(r['lshift']),
+                               int(r['disp']), int(r['writesize']), int(r['cc']))
+                for r in rows}
+
     def stage_exits(self):
         return [(r['addr'], r['line'], r['success'])
                 for r in self._sdb.db.stageexits.iterrows()]
@@ -293,9 +326,18 @@ class DBInfo():
         return self._sdb.db.writestable.nrows
 
     def skip_pc(self, pc):
+        s = self._snapshot()
+        if s:
+            return s.is_skipped(pc)
         query = "(pc <= 0x%x) & (0x%x < resumepc)" % (pc, pc)
         return pytable_utils.has_results(self._sdb.db.skipstable, query)
 
+    def skip_pc_array(self, pcs):
+        s = self._snapshot()
+        if s:
+            return s.are_skipped(pcs)
+        return numpy.array([self.skip_pc(pc) for pc in pcs], dtype=bool)
+
     def skip_info(self, pc):
         query = "pc == 0x%x" % (pc)
         return [{"resumepc": r["resumepc"],
@@ -303,9 +345,18 @@ class DBInfo():
                 for r in pytable_utils.query(self._sdb.db.skipstable, query)]
 
     def is_pc_longwrite(self, pc):
+        s = self._snapshot()
+        if s:
+            return s.is_longwrite(pc)
         query = "0x%x == writeaddr" % pc
         return pytable_utils.has_results(self._sdb.db.longwritestable, query)
 
+    def is_pc_longwrite_array(self, pcs):
+        s = self._snapshot()
+        if s:
+            return s.are_longwrites(pcs)
+        return numpy.array([self.is_pc_longwrite(pc) for pc in pcs], dtype=bool)
+
     def write_info(self):
         return [(r['pc'], r['halt']) for r in self._sdb.db.writestable.iterrows()]
 
@@ -321,27 +372,30 @@ class DBInfo():
         return [writes_dict(r) for r in pytable_utils.query(self._sdb.db.writestable, query)]
 
     def src_write_info(self, pc):
-        fields = self._sdb.db.srcstable.colnames
-        def srcss_dict(r):
-            d = {}
-            for f in fields:
-                d[f] = r[f]
-            return d
-
+        t = self._sdb.db.srcstable
         query = "addr == 0x%x" % pc
-        return [srcs_dict(r) for r in pytable_utils.query(self._sdb.db.srcstable, query)]
+        return [pytable_utils.row_dict(t, r) for r in pytable_utils.query(t, query)]
 
     def add_trace_write_entry(self, time, pid, size,
                               dest, pc, lr, cpsr, index=0, num=None):
         self._tdb.db.add_write_entry(time, pid, size, dest, pc,
                                      lr, cpsr, index, num)
 
+    def add_trace_write_entries(self, writes, index=None, num=None):
+        self._tdb.db.add_write_entries(writes, index, num)
+
+    def flush_trace_writes(self):
+        self._tdb.db.flush_writes()
+
     def get_write_pc_or_zero_from_dstinfo(self, dstinfo):
         return self._sdb.db._get_write_pc_or_zero(dstinfo)
 
     def add_range_dsts_entry(self, dstinfo):
         self._tdb.db.writerangetable.add_dsts_entry(dstinfo)
 
+    def add_range_dsts_entries(self, dstinfos):
+        self._tdb.db.writerangetable.add_dsts_entries(dstinfos)
+
     def print_range_dsts_info(self):
         self._tdb.db.writerangetable.print_dsts_info()
 
@@ -381,6 +435,14 @@ class DBInfo():
         if self._sdb:
             self._sdb.flush()
 
+    def thumb_ranges(self):
+        sdb = self._sdb.db
+        return (sdb.thumbranges, sdb.armranges, sdb.dataranges)
+
+    def close_staticdb(self):
+        if self._sdb:
+            self._sdb.close()
+
     def allowed_substage_writes(self, substage):
         return self._pdb.db.allowed_writes(substage)
 
@@ -397,10 +459,15 @@ class DBInfo():
         return self._tdb.db.writerangetable_consolidated
 
     def function_locations(self, name):
+        t = self._sdb.db.funcstable
         return [(r['startaddr'], r['endaddr'])
-                for r in pytable_utils.get_rows(self._sdb.db.funcstable, 'fname == b"%s"' % name)]
+                for r in t.where('fname == name',
+                                 {'name': pytable_utils.string_id(t, 'fname', name)})]
 
     def pc_write_size(self, pc):
+        s = self._snapshot()
+        if s:
+            return s.write_size(pc)
         res = pytable_utils.query(self._sdb.db.writestable,
                                   "pc == 0x%x" % pc)
         try:
@@ -409,41 +476,48 @@ class DBInfo():
         except:
             return 0
 
+    def pc_write_size_array(self, pcs):
+        s = self._snapshot()
+        if s:
+            return s.write_sizes(pcs)
+        return numpy.array([self.pc_write_size(pc) for pc in pcs])
+
     def addr_in_srcs_table(self, pc):
+        s = self._snapshot()
+        if s:
+            return s.in_srcs(pc)
         return pytable_utils.has_results(self._sdb.db.srcstable, "addr == 0x%x" % pc)
 
+    def addr_in_srcs_table_array(self, pcs):
+        s = self._snapshot()
+        if s:
+            return s.are_in_srcs(pcs)
+        return numpy.array([self.addr_in_srcs_table(pc) for pc in pcs], dtype=bool)
+
     def addr_in_funcs_table(self, pc):
-        return pytable_utils.has_results(self._sdb.db.funcstable,
-                                         "(startaddr <= 0x%x) & (0x%x < endaddr)" % (pc, pc))
+        return len(self._sdb.db.func_at_addr(pc)) > 0
 
     def func_at_addr(self, pc):
-        for r in pytable_utils.query(self._sdb.db.funcstable,
-                                     "(startaddr <= 0x%x) & (0x%x < endaddr)" % (pc, pc)):
-            yield r['fname']
-
-    def add_funcs_table_row(self, name, startaddr, endaddr):
-        r = self._sdb.db.funcstable.row
-        r['fname'] = name
-        r['startaddr'] = startaddr
-        r['endaddr'] = endaddr
-        r.append()
-        self._sdb.db.funcstable.flush()
+        for (fname, start, end) in self._sdb.db.func_at_addr(pc):
+            yield fname
+
+    def func_at_addr_array(self, pcs):
+        # name of the function holding each pc, "" if there is none
+        return [next(self.func_at_addr(pc), "") for pc in pcs]
 
     def disasm_and_src_from_pc(self, pc):
-        r = pytable_utils.query(self._sdb.db.srcstable, "addr == 0x%x" % pc)
-        r = next(r)
+        t = self._sdb.db.srcstable
+        r = pytable_utils.row_dict(t, next(pytable_utils.query(t, "addr == 0x%x" % pc)))
         return (r["disasm"], r["src"])
 
-    def add_source_code_info_row(self, thumb, addr, ivalue, disasm):
-        r = self._sdb.db.srcstable.row
-        r['thumb'] = thumb
-        r['addr'] = addr
-        r['ivalue'] = ivalue
-        r['ilength'] = len(ivalue)
-        r['mne'] = (disasm.split())[0]
-        r['disasm'] = disasm
-        r.append()
+    def add_source_code_info_rows(self, addrs, thumb=True):
+        # srcs rows for the instructions at addrs, in a single append
+        if self._sdb.db.readonly:
+            self._sdb._reopen(append=True)
+        rows = self._sdb.db.code_src_rows(addrs, thumb)
+        pytable_utils.append_rows(self._sdb.db.srcstable, rows)
         self._sdb.db.srcstable.flush()
+        self._sdb.db.drop_snapshot()
 
     def write_info_by_index(self):
         fields = self._sdb.db.writestable.colnames
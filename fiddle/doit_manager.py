@@ -52,7 +52,9 @@ class TaskManager():
     def __init__(self, command, instance, trace, host=None,
                  trace_list=[], stages=[], 
                  policies={}, post_trace_processes=[],
-                 rm_dir=True, quick=False, args=None, verbose=False):
+                 rm_dir=True, quick=False, args=None, verbose=False,
+                 static_jobs=1, static_cache=True, static_base=None,
+                 static_verify=False):
         self.verbose = verbose
         if command == cmds.list_instances:
             print "Test instances"
@@ -122,7 +124,11 @@ class TaskManager():
                                                                             self,
                                                                             command == cmds.create,
                                                                             gitinfo,
-                                                                            rm_dir)
+                                                                            rm_dir,
+                                                                            static_jobs=static_jobs,
+                                                                            static_cache=static_cache,
+                                                                            static_base=static_base,
+                                                                            static_verify=static_verify)
 
         if command == cmds.create:
             self.pt = instrumentation_results_manager.PolicyTaskLoader(False, policies)
@@ -0,0 +1,249 @@
+# MIT License
+
+# Copyright (c) 2017 Rebecca ".bx" Shapiro
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import bisect
+import hashlib
+import cPickle
+import tempfile
+from elftools.elf.elffile import ELFFile
+from elftools.elf.constants import SH_FLAGS
+
+# where parsed models are saved by elf md5 so other processes can
+# skip parsing, not saved anywhere if None
+cache_dir = None
+models = {}
+
+
+def _md5(elf):
+    m = hashlib.md5()
+    with open(elf, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            m.update(block)
+    return m.hexdigest()
+
+
+def get(elf):
+    # one model per elf, reparsed when the file changes
+    st = os.stat(elf)
+    stamp = (st.st_mtime, st.st_size)
+    if (elf not in models.iterkeys()) or (models[elf][0] != stamp):
+        models[elf] = (stamp, ElfModel.load(elf))
+    return models[elf][1]
+
+
+class Symbol():
+    def __init__(self, name, value, addr, size, typ, bind, shndx, kind):
+        self.name = name
+        self.value = value  # as in the symbol table, keeps the thumb bit
+        self.addr = addr  # value without the thumb bit, like nm and r2 give
+        self.size = size
+        self.typ = typ  # FUNC, OBJECT, ...
+        self.bind = bind  # LOCAL, GLOBAL, WEAK
+        self.shndx = shndx
+        self.kind = kind  # nm's symbol type letter
+
+
+# everything the tools need from an elf's headers and symbol tables,
+# read once with pyelftools
+class ElfModel():
+    version = 1
+
+    def __init__(self, md5, machine, entry, sections, symbols):
+        self.md5 = md5
+        self.machine = machine
+        self.entry = entry
+        self.sections = sections
+        self.symbols = symbols
+        self._setup()
+
+    def _setup(self):
+        self.byname = {}
+        for s in self.symbols:
+            if s.name and s.name not in self.byname:
+                self.byname[s.name] = s
+        self.sectionsbyname = {}
+        for s in self.sections:
+            if s['name'] not in self.sectionsbyname:
+                self.sectionsbyname[s['name']] = s
+        fns = sorted([s for s in self.symbols
+                      if (s.typ == "FUNC") and (s.shndx != "SHN_UNDEF") and s.name],
+                     key=lambda s: (s.addr, -s.size))
+        self._fnstarts = [s.addr for s in fns]
+        self._fns = fns
+
+    @property
+    def is_arm(self):
+        return self.machine == "EM_ARM"
+
+    def section(self, name):
+        return self.sectionsbyname.get(name, None)
+
+    def symbol(self, name):
+        return self.byname.get(name, None)
+
+    def function_at(self, addr):
+        # smallest function symbol starting at the closest address at or
+        # below addr that still holds addr, a symbol without a size
+        # reaches up to the next function
+        i = bisect.bisect_right(self._fnstarts, addr) - 1
+        if i < 0:
+            return None
+        start = self._fnstarts[i]
+        lo = bisect.bisect_left(self._fnstarts, start)
+        for f in reversed(self._fns[lo:i + 1]):
+            if f.size > 0:
+                end = f.addr + f.size
+            elif i + 1 < len(self._fns):
+                end = self._fnstarts[i + 1]
+            else:
+                end = addr + 1
+            if addr < end:
+                return f
+        return None
+
+    def functions(self):
+        return [s for s in self.symbols if s.typ == "FUNC"]
+
+    def function_ranges(self):
+        # (name, start, end) of every defined function by start address.
+        # A function without a size reaches up to the next function, the
+        # next $d mapping symbol or the end of its section, whichever
+        # comes first
+        starts = sorted(set(self._fnstarts))
+        datas = sorted([s.addr for s in self.symbols if s.name == "$d"])
+        sections = sorted([(s['address'], s['address'] + s['size']) for s in self.sections
+                           if (s['flags'][1] == "r") and (s['size'] > 0)])
+        secstarts = [lo for (lo, hi) in sections]
+        ranges = []
+        for f in self._fns:
+            if f.size > 0:
+                end = f.addr + f.size
+            else:
+                ends = []
+                i = bisect.bisect_right(starts, f.addr)
+                if i < len(starts):
+                    ends.append(starts[i])
+                i = bisect.bisect_right(datas, f.addr)
+                if i < len(datas):
+                    ends.append(datas[i])
+                i = bisect.bisect_right(secstarts, f.addr) - 1
+                if (i >= 0) and (f.addr < sections[i][1]):
+                    ends.append(sections[i][1])
+                if not ends:
+                    continue
+                end = min(ends)
+            ranges.append((f.name, f.addr, end))
+        return ranges
+
+    def sized_symbols(self):
+        # what nm -n -S lists: defined, sized symbols by address
+        return sorted([s for s in self.symbols
+                       if s.name and (s.size > 0) and (s.shndx != "SHN_UNDEF")
+                       and (s.typ not in ["FILE", "SECTION"])],
+                      key=lambda s: (s.addr, s.name))
+
+    @classmethod
+    def load(cls, elf):
+        md5 = _md5(elf)
+        path = os.path.join(cache_dir, "%s.pickle" % md5) if cache_dir else None
+        if path and os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    (version, args) = cPickle.load(f)
+                if version == cls.version:
+                    return cls(*args)
+            except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+                pass
+        args = cls._parse(elf, md5)
+        if path:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            (fd, tmp) = tempfile.mkstemp(prefix=".tmp", dir=cache_dir)
+            with os.fdopen(fd, "wb") as f:
+                cPickle.dump((cls.version, args), f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        return cls(*args)
+
+    @classmethod
+    def _parse(cls, elf, md5):
+        with open(elf, "rb") as f:
+            e = ELFFile(f)
+            sections = []
+            for s in e.iter_sections():
+                if s['sh_type'] == "SHT_NULL":
+                    continue
+                flags = s['sh_flags']
+                sections.append({
+                    "number": len(sections),
+                    "name": str(s.name),
+                    "address": s['sh_addr'],
+                    "offset": s['sh_offset'],
+                    "size": s['sh_size'],
+                    "filesize": 0 if s['sh_type'] == "SHT_NOBITS" else s['sh_size'],
+                    "flags": "-%s%s%s" % ("r" if flags & SH_FLAGS.SHF_ALLOC else "-",
+                                          "w" if flags & SH_FLAGS.SHF_WRITE else "-",
+                                          "x" if flags & SH_FLAGS.SHF_EXECINSTR else "-"),
+                    "type": s['sh_type'],
+                })
+            headers = [s.header for s in e.iter_sections()]
+            symbols = []
+            for t in e.iter_sections():
+                if t['sh_type'] not in ["SHT_SYMTAB", "SHT_DYNSYM"]:
+                    continue
+                for s in t.iter_symbols():
+                    info = s['st_info']
+                    shndx = s['st_shndx']
+                    typ = info['type'][4:]  # strip STT_
+                    bind = info['bind'][4:]  # strip STB_
+                    value = s['st_value']
+                    addr = value
+                    if (e['e_machine'] == "EM_ARM") and (typ == "FUNC"):
+                        addr = value & ~1
+                    symbols.append(Symbol(str(s.name), value, addr, s['st_size'], typ,
+                                          bind, shndx,
+                                          cls._nm_kind(bind, typ, shndx, headers)))
+            return (md5, e['e_machine'], e['e_entry'], sections, symbols)
+
+    @classmethod
+    def _nm_kind(cls, bind, typ, shndx, headers):
+        if shndx == "SHN_UNDEF":
+            return "w" if bind == "WEAK" else "U"
+        elif bind == "WEAK":
+            return "V" if typ == "OBJECT" else "W"
+        elif shndx == "SHN_ABS":
+            k = "a"
+        elif shndx == "SHN_COMMON":
+            return "C"
+        else:
+            h = headers[shndx]
+            if h['sh_flags'] & SH_FLAGS.SHF_EXECINSTR:
+                k = "t"
+            elif h['sh_type'] == "SHT_NOBITS":
+                k = "b"
+            elif h['sh_flags'] & SH_FLAGS.SHF_WRITE:
+                k = "d"
+            elif h['sh_flags'] & SH_FLAGS.SHF_ALLOC:
+                k = "r"
+            else:
+                k = "n"
+        return k.upper() if bind == "GLOBAL" else k
@@ -52,6 +52,7 @@ from doit.tools import LongRunning, Interactive, PythonInteractiveAction
 import inspect
 import string
 import pure_utils
+import elf_model
 import external_source_manager
 from doit.tools import create_folder
 import tempfile
@@ -1023,7 +1024,11 @@ class InstrumentationTaskLoader(ResultsLoader):
                  create=False,
                  gitinfo={"local": "n/a", "sha1": "none"},
                  rm_tmp=True,
-                 testonly=False):
+                 testonly=False,
+                 static_jobs=1,
+                 static_cache=True,
+                 static_base=None,
+                 static_verify=False):
         super(InstrumentationTaskLoader, self).__init__(instance_id, "instance", True)
         self.testonly = testonly
         self.create = create
@@ -1041,6 +1046,16 @@ class InstrumentationTaskLoader(ResultsLoader):
         hdir = os.path.join(hw.hw_info_path, hwname)
         Main.test_instance_id = self.instance_id
         self._update_runtime_config("instance_id", self.instance_id)
+        self._update_runtime_config("static_analysis_jobs", static_jobs)
+        self._update_runtime_config("static_analysis_cache", static_cache)
+        elf_model.cache_dir = os.path.join(Main.root, "cache", "elf")
+        labeltool.cache_dir = os.path.join(Main.root, "cache", "labels")
+        if static_base:
+            static_base = os.path.join(Main.test_data_path, static_base)
+        else:
+            static_base = ""
+        self._update_runtime_config("static_analysis_base", static_base)
+        self._update_runtime_config("static_analysis_verify", static_verify)
 
         self._update_runtime_config("hardware_data_target_dir",  os.path.join(hdir, targetname))
 
@@ -1140,12 +1155,18 @@ class InstrumentationTaskLoader(ResultsLoader):
             # calculate thumb ranges on demand
             class get_thumb_ranges():
                 def __init__(self, stage):
-                    self.stage = stage                
+                    self.stage = stage
+                    self.v = None
 
-                def __call__(self):                
-                    v = staticanalysis.ThumbRanges.find_thumb_ranges(self.stage)      
-                    Main.set_runtime_config("thumb_ranges.%s" % self.stage.stagename, v)
-                    return v
+                def __call__(self):
+                    if self.v is None:
+                        done = Main.get_static_analysis_config("db_done", self.stage)
+                        if os.path.exists(done):
+                            # saved in the static analysis db
+                            self.v = db_info.get(self.stage).thumb_ranges()
+                        else:
+                            self.v = staticanalysis.ThumbRanges.find_thumb_ranges(self.stage)
+                    return self.v
             self._update_config("runtime.thumb_ranges.%s" % n, get_thumb_ranges(s))
 
         # calculate labels on demand
@@ -1175,7 +1196,26 @@ class InstrumentationTaskLoader(ResultsLoader):
                             # if done doesnt existb but target does, probably means
                             # target db was not sucessfully created
                             os.remove(target)
-                        db_info.create(self.stage, "staticdb")
+                        use_cache = Main.get_runtime_config("static_analysis_cache")
+                        if use_cache:
+                            cache = staticanalysis.WriteSearch.cache()
+                            key = staticanalysis.WriteSearch.cache_key(self.stage)
+                        if use_cache and cache.fetch(key, target):
+                            print "using cached static analysis for %s" % self.stage.stagename
+                        else:
+                            db_info.create(self.stage, "staticdb")
+                            if Main.get_runtime_config("static_analysis_verify"):
+                                bad = db_info.get(self.stage)._sdb.db.check_writes_table()
+                                if bad:
+                                    db_info.get(self.stage).close_staticdb()
+                                    os.remove(target)
+                                    raise Exception("static analysis of %s does not match "
+                                                    "a full analysis:\n%s" %
+                                                    (self.stage.stagename,
+                                                     "\n".join(bad[:20])))
+                            if use_cache:
+                                db_info.get(self.stage).close_staticdb()
+                                cache.store(key, target)
                     return os.system("touch %s" % done_target) == 0
             n = s.stagename
             target = Main.get_static_analysis_config("db", s)
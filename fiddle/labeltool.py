@@ -39,13 +39,30 @@ import sys
 import re
 import testsuite_utils as utils
 import os
+import mmap
+import numpy
+import cPickle
+import tempfile
+import multiprocessing
+import src_cache
+import content_cache
 from sortedcontainers import SortedList
 from config import Main
 label_classes = {}
 
+# where per-file label scan results are saved, not saved anywhere if
+# None. Least recently used results go once there are more than
+# cache_max_size bytes of them
+cache_dir = None
+cache_max_size = 256 * 1024 * 1024
+label_marker = "#define ___"
+_label_re = None
+
 
 class LabelRegistrar(type):
     def __new__(cls, clsname, bases, attrs):
+        # labels only carry the fields Label sets
+        attrs.setdefault("__slots__", ())
         newcls = type.__new__(cls, clsname, bases, attrs)
         global label_classes
         # register subclasses of Label
@@ -128,6 +145,8 @@ class FileLabels():
 class Label():
     reqs = {}
     __metaclass__ = LabelRegistrar
+    __slots__ = ("filename", "lineno", "isasm", "stagename", "value", "name",
+                 "raw", "path", "reference_lineno", "reference_line")
 
     def __init__(self, filename, lineno, isasm, name, stage, value, raw, path):
         self.filename = filename
@@ -155,10 +174,15 @@ class Label():
                 hash(self.stagename) ^ hash(self.value) ^
                 hash(self.path) ^ hash(self.__class__) ^ hash(self.reference_line))
 
+    @classmethod
+    def labelre(cls):
+        if "_labelre" not in cls.__dict__:
+            cls._labelre = re.compile(cls.labelformat)
+        return cls._labelre
+
     @classmethod
     def parse_label(cls, line):
-        labelre = re.compile(cls.labelformat)
-        matches = labelre.match(line)
+        matches = cls.labelre().match(line)
         if matches:
             stage = matches.group(2)
             value = matches.group(3)
@@ -304,44 +328,62 @@ class SrcLabelTool():
             if not root:
                 raise Exception("dont have temp soruce files yet")
             #root = Main.get_target_root()
+        paths = []
         for (dirpath, dirs, files) in os.walk(root):
             for filename in fnmatch.filter(files, "*.[chsS]"):
                 fullpath = os.path.join(dirpath, filename)
-                filepath = fullpath[len(root)+1:]
                 if os.path.isfile(fullpath):  # just in case
-                    filelabels = cls._get_labels(filepath, root, name="",
-                                                 stage="", checkreqs=False, ltype=label)
-                if len(filelabels) > 0:
-                    labels.extend(filelabels)
+                    paths.append(fullpath[len(root)+1:])
+        found = scan_tree(root, paths)
+        for filepath in paths:
+            for row in found[filepath]:
+                l = cls._new_label(filepath, root, row)
+                if (label is None) or (l.__class__ is label):
+                    labels.append(l)
         return labels
 
     @classmethod
-    def get_next_non_label(cls, lineno, srcfile):
-        with open(srcfile, 'r') as src:
-            lines = src.readlines()[(lineno):]
-            i = lineno
-            for l in lines:
+    def _new_label(cls, srcfile, path, row):
+        (lineno, clsname, lname, lstage, lvalue, raw) = row
+        return label_classes[clsname](srcfile, lineno, srcfile[-2:] == ".S",
+                                      lname, lstage, lvalue, raw, path)
+
+    @classmethod
+    def _non_label_lines(cls, srcfile, minlen):
+        # sorted numbers of the lines in srcfile that are longer than
+        # minlen once stripped and are not labels
+        src = src_cache.get(srcfile)
+
+        def find():
+            found = []
+            for (i, l) in enumerate(src.lines(), 1):
                 l = l.strip()
-                i = i + 1
-                if (len(l) > 0) and cls.is_any_label(l) is None:
-                    return i
+                if (len(l) > minlen) and cls.is_any_label(l) is None:
+                    found.append(i)
+            return numpy.array(found, dtype=numpy.int64)
+        return src.derived(("non_label_lines", minlen), find)
+
+    @classmethod
+    def get_next_non_label(cls, lineno, srcfile):
+        lines = cls._non_label_lines(srcfile, 0)
+        i = numpy.searchsorted(lines, lineno, "right")
+        if i < len(lines):
+            return int(lines[i])
 
     @classmethod
     def get_prev_non_label(cls, lineno, srcfile):
-        with open(srcfile, 'r') as src:
-            lines = src.readlines()[:(lineno-1)][::-1]
-            i = lineno
-            for l in lines:
-                i = i - 1
-                l = l.strip()
-                if (len(l) > 1) and cls.is_any_label(l) is None:
-                    # print "label at %s:%s found %s %s" % (srcfile, lineno, i, l)
-                    return i
+        lines = cls._non_label_lines(srcfile, 1)
+        i = numpy.searchsorted(lines, lineno, "left") - 1
+        if i >= 0:
+            # print "label at %s:%s found %s" % (srcfile, lineno, lines[i])
+            return int(lines[i])
 
     @classmethod
     def lineno_is_a_label(cls, lineno, srcfile):
-        with open(srcfile, 'r') as src:
-            return Label.is_any_label(src.readlines()[lineno])
+        line = src_cache.get(srcfile).line(lineno + 1)
+        if line is None:
+            raise IndexError("%s has no line %d" % (srcfile, lineno + 1))
+        return cls.is_any_label(line)
 
     def get_labels(self, labelcls, name="", stage="", checkreqs=False, alltypes=False):
         if alltypes:
@@ -353,32 +395,20 @@ class SrcLabelTool():
     @classmethod
     def _get_labels(cls, srcfile, path, name,
                     stage, checkreqs=False, ltype=None):
-        resultclass = ltype
-        with open(os.path.join(path, srcfile), 'r') as src:
-            labels = []
-            alllabels = []
-            i = 0
-            isasm = False
-            if srcfile[-3:] == ".S":
-                isasm = True
-            for l in src.readlines():
-                i = i + 1
-                resultclass = None
-                if ltype is not None:
-                    resultclass = SrcLabelTool.is_a_label(ltype, l)
-                else:
-                    resultclass = cls.is_any_label(l)
-                if resultclass is not None:
-                    (lname, lvalue, lstage, raw) = resultclass.parse_label(l)
-                    newlabel = resultclass(srcfile, i, isasm, lname, lstage, lvalue, raw, path)
-                    alllabels.append(newlabel)
-                    append = True
-                    if len(name) > 0 and (not name == newlabel.name):
-                        append = False
-                    if (len(stage) > 0) and (not stage == newlabel.stagename):
-                        append = False
-                    if append:
-                        labels.append(newlabel)
+        labels = []
+        alllabels = []
+        for row in scan_file(os.path.join(path, srcfile)):
+            newlabel = cls._new_label(srcfile, path, row)
+            if (ltype is not None) and (newlabel.__class__ is not ltype):
+                continue
+            alllabels.append(newlabel)
+            append = True
+            if len(name) > 0 and (not name == newlabel.name):
+                append = False
+            if (len(stage) > 0) and (not stage == newlabel.stagename):
+                append = False
+            if append:
+                labels.append(newlabel)
         if checkreqs and ltype:
             if not ltype.check_requirements(alllabels):
                 raise Exception("Labels don't meet requirements in %s (%s)" %
@@ -387,8 +417,7 @@ class SrcLabelTool():
 
     @classmethod
     def is_a_label(cls, labelcls, line):
-        labelre = re.compile(labelcls.labelformat)
-        matches = labelre.match(line)
+        matches = labelcls.labelre().match(line)
         if matches is not None:
             return labelcls
         else:
@@ -396,12 +425,9 @@ class SrcLabelTool():
 
     @classmethod
     def is_any_label(cls, line):
-        global label_classes
-        for c in label_classes.itervalues():
-            labelre = re.compile(c.labelformat)
-            matches = labelre.match(line)
-            if matches:
-                return c
+        matches = label_re().match(line)
+        if matches:
+            return label_classes[matches.lastgroup]
         return None
 
     def new_label(self, labelclass, name, value, raw):
@@ -439,8 +465,185 @@ class SrcLabelTool():
         return self.get_labels_of_type(LongwriteLabel)
 
 
+def label_re():
+    # one regex for every label class, the outermost group of each
+    # alternative is named after its class
+    global _label_re
+    if _label_re is None:
+        _label_re = re.compile("|".join(["(?P<%s>%s)" % (n, c.labelformat)
+                                         for (n, c) in sorted(label_classes.iteritems())]))
+    return _label_re
+
+
+def scan_file(path):
+    # (lineno, class name, name, stage, value, raw) of each label in
+    # path. Files without the label marker are never split into lines
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return []
+    try:
+        if mm.find(label_marker) < 0:
+            return []
+        data = mm[:]
+    finally:
+        mm.close()
+    rows = []
+    lre = label_re()
+    (lineno, counted) = (1, 0)
+    pos = 0 if data.startswith(label_marker) else _next_marker(data, 0)
+    while pos >= 0:
+        lineno += data.count("\n", counted, pos)
+        counted = pos
+        m = lre.match(data, pos)
+        if m:
+            i = m.lastindex
+            rows.append((lineno, m.lastgroup, m.group(i + 1), m.group(i + 2),
+                         m.group(i + 3), m.group(0)))
+        pos = _next_marker(data, pos)
+    return rows
+
+
+def _next_marker(data, pos):
+    # start of the next line after pos that begins with the marker, -1
+    # if there is none
+    i = data.find("\n" + label_marker, pos)
+    return i + 1 if i >= 0 else -1
+
+
+def _scan_jobs():
+    try:
+        return int(Main.get_runtime_config("static_analysis_jobs"))
+    except AttributeError:
+        return 1
+
+
+def _scan_cache():
+    if not cache_dir:
+        return None
+    return content_cache.ContentCache(cache_dir, cache_max_size)
+
+
+def _scan_cache_key():
+    # one entry per target software rather than per root, as each run
+    # archives the tree into a fresh temporary directory. Files in it
+    # are by path relative to root and (mtime, size), which both git
+    # archive and cp -a keep from one run to the next
+    try:
+        name = Main.target_software.name
+    except AttributeError:
+        name = ""
+    return content_cache.ContentCache.key("labels", name)
+
+
+def scan_tree(root, paths):
+    # {path: scan_file rows} for each path under root, only rescanning
+    # files whose mtime or size changed since the saved results
+    scancache = _scan_cache()
+    key = _scan_cache_key()
+    cachepath = scancache.lookup(key) if scancache else None
+    cache = {}
+    if cachepath:
+        try:
+            with open(cachepath, "rb") as f:
+                cache = cPickle.load(f)
+        except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+            cache = {}
+    results = {}
+    todo = []
+    for p in paths:
+        st = os.stat(os.path.join(root, p))
+        stamp = (st.st_mtime, st.st_size)
+        if (p in cache) and (cache[p][0] == stamp):
+            results[p] = cache[p][1]
+        else:
+            todo.append((p, stamp))
+    if not todo:
+        return results
+    full = [os.path.join(root, p) for (p, stamp) in todo]
+    jobs = _scan_jobs()
+    if (jobs > 1) and (len(full) > jobs):
+        pool = multiprocessing.Pool(jobs)
+        try:
+            rows = pool.map(scan_file, full, max(len(full) / (jobs * 4), 1))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        rows = map(scan_file, full)
+    for ((p, stamp), r) in zip(todo, rows):
+        results[p] = r
+    if scancache:
+        # only the files in the tree now, so the entry does not grow
+        # with every file that ever existed
+        saved = {p: (stamp, results[p]) for (p, stamp) in todo}
+        for p in paths:
+            if p not in saved:
+                saved[p] = cache[p]
+        (fd, tmp) = tempfile.mkstemp(prefix=".tmp", dir=scancache.root)
+        with os.fdopen(fd, "wb") as f:
+            cPickle.dump(saved, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, scancache.entry(key))
+        scancache.evict(keep=key)
+    return results
+
+
+# every label under a root, indexed by (label class, stage, name, value)
+# and by (file, line). Also reads like the {label class: [labels]} dict
+# get_all_labels used to return
+class LabelStore():
+    def __init__(self, labels):
+        self.labels = sorted(labels, key=lambda l: (l.__class__.__name__, l.path,
+                                                    l.filename, l.lineno))
+        self._byclass = {}
+        self._bykey = {}
+        self._byline = {}
+        self._byfile = {}
+        for l in self.labels:
+            self._byclass.setdefault(l.__class__, []).append(l)
+            for stage in [l.stagename, None]:
+                for name in [l.name, None]:
+                    for value in [l.value, None]:
+                        k = (l.__class__, stage, name, value)
+                        self._bykey.setdefault(k, []).append(l)
+            self._byline.setdefault((l.filename, l.lineno), []).append(l)
+            self._byfile.setdefault(l.filename, []).append(l)
+
+    def find(self, lclass, stagename=None, name=None, value=None):
+        # labels of class lclass, None matches any stage, name or value
+        return self._bykey.get((lclass, stagename, name, value), [])
+
+    def at(self, filename, lineno):
+        return self._byline.get((filename, lineno), [])
+
+    def in_file(self, filename):
+        return self._byfile.get(filename, [])
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, lclass):
+        return self._byclass.get(lclass, [])
+
+    def __contains__(self, lclass):
+        return lclass in self._byclass
+
+    def keys(self):
+        return self._byclass.keys()
+
+    def iterkeys(self):
+        return self._byclass.iterkeys()
+
+    def iteritems(self):
+        return self._byclass.iteritems()
+
+
 all_labels_root = ""
-all_labels = {}
+all_labels = LabelStore([])
 
 
 def get_all_labels(root):
@@ -448,13 +651,7 @@ def get_all_labels(root):
     global all_labels_root
     if not all_labels_root == root:
         all_labels_root = root
-        labels = SrcLabelTool.label_search(None, root)
-        for l in labels:
-            name = l.__class__
-            if name in all_labels.keys():
-                all_labels[name].append(l)
-            else:
-                all_labels[name] = [l]
+        all_labels = LabelStore(SrcLabelTool.label_search(None, root))
     return all_labels
 
 
@@ -0,0 +1,214 @@
+# MIT License
+
+# Copyright (c) 2017 Rebecca ".bx" Shapiro
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import tempfile
+import numpy
+from elftools.elf.elffile import ELFFile
+import pure_utils
+
+indexes = {}
+
+
+def get(elf, path=None):
+    # one index per elf, loaded from path if it was saved there for
+    # this exact elf, otherwise built and saved to path
+    if elf not in indexes.iterkeys():
+        i = None
+        if path and os.path.exists(path):
+            i = LineIndex.load(path, elf)
+        if i is None:
+            i = LineIndex.build(elf)
+            if path and os.path.isdir(os.path.dirname(path)):
+                i.save(path)
+        indexes[elf] = i
+    return indexes[elf]
+
+
+# the rows of an elf's .debug_line tables, sorted by address. Source
+# file names are kept as they are in the dwarf info, relative to the
+# compilation directory where possible, so a saved index stays valid
+# when the source tree gets copied somewhere else
+class LineIndex():
+    version = 2
+    NOFILE = -1  # marks the end of a sequence
+
+    def __init__(self, addrs, files, lines, names, md5):
+        self.addrs = addrs
+        self.files = files
+        self.lines = lines
+        self.names = names
+        self.md5 = md5
+        self._byname = {}
+        # rows with code sorted by file, line then address for line lookups
+        rows = numpy.nonzero(files != self.NOFILE)[0]
+        order = numpy.lexsort((addrs[rows], lines[rows], files[rows]))
+        self._lrows = rows[order]
+        self._lfiles = files[self._lrows]
+        self._llines = lines[self._lrows]
+
+    @classmethod
+    def build(cls, elf):
+        names = []
+        nameids = {}
+        rows = []
+        with open(elf, "rb") as f:
+            e = ELFFile(f)
+            if e.has_dwarf_info():
+                dwarf = e.get_dwarf_info()
+                for cu in dwarf.iter_CUs():
+                    lp = dwarf.line_program_for_CU(cu)
+                    if lp is None:
+                        continue
+                    top = cu.get_top_DIE()
+                    compdir = ""
+                    if "DW_AT_comp_dir" in top.attributes:
+                        compdir = top.attributes["DW_AT_comp_dir"].value
+                    dirs = lp.header["include_directory"]
+                    ids = []
+                    for fe in lp.header["file_entry"]:
+                        if fe.dir_index > 0:
+                            d = os.path.join(compdir, dirs[fe.dir_index - 1])
+                        else:
+                            d = compdir
+                        name = cls._relative(os.path.join(d, fe.name), compdir)
+                        if name not in nameids:
+                            nameids[name] = len(names)
+                            names.append(name)
+                        ids.append(nameids[name])
+                    for entry in lp.get_entries():
+                        s = entry.state
+                        if s is None:
+                            continue
+                        if s.end_sequence:
+                            rows.append((s.address, 0, cls.NOFILE, 0))
+                        elif 0 < s.file <= len(ids):
+                            rows.append((s.address, 1, ids[s.file - 1], s.line))
+        # at a shared address the end of one sequence sorts before the
+        # start of the next. The sort is stable and leaves file and line
+        # out of the key, so rows sharing an address otherwise stay in the
+        # order .debug_line has them and lookups get the last one emitted,
+        # as addr2line does
+        rows.sort(key=lambda r: (r[0], r[1]))
+        a = numpy.array(rows, dtype=numpy.int64).reshape(len(rows), 4)
+        return cls(a[:, 0].astype(numpy.uint32), a[:, 2].astype(numpy.int32),
+                   a[:, 3].astype(numpy.int32), names, pure_utils.file_md5(elf))
+
+    @classmethod
+    def _relative(cls, path, compdir):
+        path = os.path.normpath(path)
+        if compdir:
+            compdir = os.path.normpath(compdir)
+            if path.startswith(compdir + os.sep):
+                return path[len(compdir) + 1:]
+        return path
+
+    @classmethod
+    def load(cls, path, elf):
+        # None if path holds an index for some other elf or version
+        try:
+            d = numpy.load(path)
+            if (int(d["version"]) != cls.version) or \
+               (str(d["md5"]) != pure_utils.file_md5(elf)):
+                return None
+            return cls(d["addrs"], d["files"], d["lines"],
+                       [str(n) for n in d["names"]], str(d["md5"]))
+        except (IOError, KeyError, ValueError):
+            return None
+
+    def save(self, path):
+        (fd, tmp) = tempfile.mkstemp(prefix=".tmp", dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            numpy.savez(f, version=self.version, md5=self.md5, addrs=self.addrs,
+                        files=self.files, lines=self.lines,
+                        names=numpy.array(self.names, dtype=str))
+        os.rename(tmp, path)
+
+    def _fullname(self, i, srcdir):
+        n = self.names[i]
+        if srcdir and not os.path.isabs(n):
+            n = os.path.join(srcdir, n)
+        return n
+
+    def addr2line(self, addr, srcdir=""):
+        # "file:lineno" of the code at addr, or "" if there is none
+        i = numpy.searchsorted(self.addrs, addr, "right") - 1
+        if (i < 0) or (self.files[i] == self.NOFILE):
+            return ""
+        return "%s:%d" % (self._fullname(self.files[i], srcdir), self.lines[i])
+
+    def addr2lines(self, addrs, srcdir=""):
+        # addr2line of each of addrs, looked up together
+        if len(self.addrs) == 0:
+            return [""] * len(addrs)
+        i = numpy.searchsorted(self.addrs, numpy.asarray(addrs, dtype=numpy.int64),
+                               "right") - 1
+        files = numpy.where(i >= 0, self.files[i], self.NOFILE)
+        names = {}
+        res = []
+        for (f, n) in zip(files.tolist(), self.lines[i].tolist()):
+            if f == self.NOFILE:
+                res.append("")
+                continue
+            if f not in names:
+                names[f] = self._fullname(f, srcdir)
+            res.append("%s:%d" % (names[f], n))
+        return res
+
+    def _file_ids(self, name, srcdir):
+        # ids of every file that name could refer to, matching on whole
+        # path components like gdb does
+        if srcdir and name.startswith(os.path.normpath(srcdir) + os.sep):
+            name = name[len(os.path.normpath(srcdir)) + 1:]
+        name = os.path.normpath(name)
+        if name not in self._byname:
+            self._byname[name] = [i for (i, n) in enumerate(self.names)
+                                  if (n == name) or n.endswith(os.sep + name)]
+        return self._byname[name]
+
+    def line_range(self, line, srcdir=""):
+        # (start, end, exact) for "file:lineno" like gdb's info line. When
+        # the line has no code exact is False and start is where the next
+        # line with code in that file begins. None if nothing matches
+        try:
+            (name, lineno) = line.rsplit(":", 1)
+            lineno = int(lineno)
+        except ValueError:
+            return None
+        best = None
+        for f in self._file_ids(name, srcdir):
+            lo = numpy.searchsorted(self._lfiles, f, "left")
+            hi = numpy.searchsorted(self._lfiles, f, "right")
+            j = lo + numpy.searchsorted(self._llines[lo:hi], lineno, "left")
+            if j >= hi:
+                continue
+            exact = self._llines[j] == lineno
+            start = self.addrs[self._lrows[j]]
+            key = (not exact, self._llines[j], start)
+            if (best is None) or (key < best[0]):
+                best = (key, start, exact)
+        if best is None:
+            return None
+        (key, start, exact) = best
+        k = numpy.searchsorted(self.addrs, start, "right")
+        end = self.addrs[k] if k < len(self.addrs) else start
+        return (int(start), int(end), bool(exact))
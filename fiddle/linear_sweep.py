@@ -0,0 +1,319 @@
+# MIT License
+
+# Copyright (c) 2017 Rebecca ".bx" Shapiro
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import numpy
+from capstone import *
+from capstone.arm import *
+
+# (mask, value) encodings of the instructions static analysis looks
+# for: the stores (str*, stl*, stm*, push) and smc. They are matched
+# against every ARM word and against the first halfword of every Thumb
+# instruction, and match more than they need to, capstone has the
+# final say on each candidate
+arm_store_encodings = [
+    (0x0C100000, 0x04000000),  # str, strb, strt, strbt
+    (0x0E100090, 0x00000090),  # strh, strd, strex*, stl*
+    (0x0E100000, 0x08000000),  # stm*, push
+]
+arm_smc_encodings = [(0x0FFFFFF0, 0x01600070)]
+thumb_store_encodings = [
+    (0xF800, 0x5000),  # str, strh, strb (register)
+    (0xF800, 0x6000),  # str (immediate)
+    (0xF800, 0x7000),  # strb (immediate)
+    (0xF800, 0x8000),  # strh (immediate)
+    (0xF800, 0x9000),  # str (sp relative)
+    (0xF800, 0xC000),  # stm
+    (0xFE00, 0xB400),  # push
+    (0xFE10, 0xE800),  # stm.w, push.w, strd, strex*, stl*
+    (0xFF10, 0xF800),  # str.w, strb.w, strh.w, strt
+]
+thumb_smc_encodings = [(0xFFF0, 0xF7F0)]
+
+
+def _matches(words, encodings):
+    hit = numpy.zeros(len(words), dtype=bool)
+    for (mask, value) in encodings:
+        hit |= (words & mask) == value
+    return hit
+
+
+def thumb_starts(halves):
+    # which halfwords start an instruction when decoding from the first
+    # one. After a halfword that is not the first half of a 32 bit
+    # instruction comes a start whatever it was, so a halfword starts
+    # an instruction when an even number of 32 bit prefixes run up to it
+    idx = numpy.arange(len(halves))
+    wide = (halves >> 11) >= 0x1D
+    last = numpy.maximum.accumulate(numpy.where(wide, -1, idx))
+    run = numpy.zeros(len(halves), dtype=numpy.int64)
+    run[1:] = idx[:-1] - last[:-1]
+    return (run % 2) == 0
+
+
+# walks the instructions of an ELF's executable sections in a single
+# pass, switching between ARM and Thumb decoding at the boundaries
+# given by the $a/$t/$d mapping symbols (see ThumbRanges)
+class LinearSweep():
+    ARM = "arm"
+    THUMB = "thumb"
+    DATA = "data"
+
+    def __init__(self, elf, sections, thumbranges, armranges, dataranges, code=None):
+        self.elf = elf
+        self.sections = [s for s in sections
+                         if (s['size'] > 0) and (s['flags'][-1] == 'x')]
+        self.thumbranges = thumbranges
+        self.armranges = armranges
+        self.dataranges = dataranges
+        self.thumb = Cs(CS_ARCH_ARM, CS_MODE_THUMB)
+        self.thumb.skipdata = True
+        self.arm = Cs(CS_ARCH_ARM, CS_MODE_ARM)
+        self.arm.skipdata = True
+        # candidates are decoded one at a time in detail mode
+        self.thumbdetail = Cs(CS_ARCH_ARM, CS_MODE_THUMB)
+        self.thumbdetail.detail = True
+        self.armdetail = Cs(CS_ARCH_ARM, CS_MODE_ARM)
+        self.armdetail.detail = True
+        self._code = dict(code) if code else {}  # section address -> bytes
+
+    def section_bytes(self, s):
+        if s['address'] not in self._code:
+            with open(self.elf, "rb") as f:
+                f.seek(s['offset'])
+                self._code[s['address']] = f.read(s['filesize'])
+        return self._code[s['address']]
+
+    def code(self):
+        # {section address: bytes} of every section
+        return {s['address']: self.section_bytes(s) for s in self.sections}
+
+    def _boundaries(self, lo, hi):
+        points = set([lo, hi])
+        for t in [self.thumbranges, self.dataranges]:
+            for i in t.overlap(lo, hi):
+                if lo < i.begin < hi:
+                    points.add(i.begin)
+                if lo < i.end < hi:
+                    points.add(i.end)
+        return sorted(points)
+
+    def kind_at(self, addr):
+        if self.dataranges.overlaps_point(addr):
+            return self.DATA
+        elif self.thumbranges.overlaps_point(addr):
+            return self.THUMB
+        else:
+            return self.ARM
+
+    def runs(self, lo, hi):
+        # split [lo, hi) into (start, end, kind) runs of a single decoding mode
+        points = self._boundaries(lo, hi)
+        prev = None
+        for (start, end) in zip(points[:-1], points[1:]):
+            kind = self.kind_at(start)
+            if prev and (prev[2] == kind) and (prev[1] == start):
+                prev = (prev[0], end, kind)
+            else:
+                if prev:
+                    yield prev
+                prev = (start, end, kind)
+        if prev:
+            yield prev
+
+    def section_ranges(self):
+        return [(s['address'], s['address'] + s['size']) for s in self.sections]
+
+    def section_index(self, addr):
+        # position of the section holding addr, the order a full sweep
+        # visits it in
+        for (i, s) in enumerate(self.sections):
+            if s['address'] <= addr < (s['address'] + s['size']):
+                return i
+        return len(self.sections)
+
+    def instructions(self, start=None, stop=None):
+        # yields (instruction, kind) in address order. Data runs are
+        # decoded as ARM so that callers can still spot smc
+        # instructions stored in them
+        for s in self.sections:
+            lo = s['address']
+            hi = lo + s['size']
+            if start is not None:
+                lo = max(lo, start)
+            if stop is not None:
+                hi = min(hi, stop)
+            if lo >= hi:
+                continue
+            code = self.section_bytes(s)
+            for (rstart, rend, kind) in self.runs(lo, hi):
+                md = self.thumb if kind == self.THUMB else self.arm
+                offset = rstart - s['address']
+                chunk = code[offset:offset + (rend - rstart)]
+                for ins in md.disasm(chunk, rstart):
+                    if ins.id == 0:  # skipped data
+                        continue
+                    yield (ins, kind)
+
+    @classmethod
+    def candidate_offsets(cls, chunk, kind):
+        # offsets into chunk, a run of kind, of the instructions that
+        # might be stores. Stores in data runs are of no interest
+        if kind == cls.THUMB:
+            halves = cls._halves(chunk)
+            hit = _matches(halves, thumb_store_encodings)
+            return numpy.nonzero(hit & thumb_starts(halves))[0] * 2
+        elif kind == cls.ARM:
+            return numpy.nonzero(_matches(cls._words(chunk), arm_store_encodings))[0] * 4
+        return []
+
+    @classmethod
+    def smc_offsets(cls, chunk, kind):
+        # offsets into chunk, a run of kind, of the instructions that
+        # might be smcs, data runs included
+        if kind == cls.THUMB:
+            halves = cls._halves(chunk)
+            hit = _matches(halves, thumb_smc_encodings)
+            hit[:-1] &= (halves[1:] & 0xF000) == 0x8000
+            hit[-1:] = False
+            return numpy.nonzero(hit & thumb_starts(halves))[0] * 2
+        return numpy.nonzero(_matches(cls._words(chunk), arm_smc_encodings))[0] * 4
+
+    @classmethod
+    def _halves(cls, chunk):
+        n = len(chunk) // 2
+        return numpy.frombuffer(chunk, dtype="<u2", count=n) if n \
+            else numpy.zeros(0, dtype=numpy.uint16)
+
+    @classmethod
+    def _words(cls, chunk):
+        n = len(chunk) // 4
+        return numpy.frombuffer(chunk, dtype="<u4", count=n) if n \
+            else numpy.zeros(0, dtype=numpy.uint32)
+
+    def _decode_at(self, offsets, start=None, stop=None):
+        # decodes, in detail mode, the instructions at the offsets that
+        # offsets(chunk, kind) picks out of each run, in address order
+        for s in self.sections:
+            lo = s['address']
+            hi = lo + s['size']
+            if start is not None:
+                lo = max(lo, start)
+            if stop is not None:
+                hi = min(hi, stop)
+            if lo >= hi:
+                continue
+            code = self.section_bytes(s)
+            for (rstart, rend, kind) in self.runs(lo, hi):
+                md = self.thumbdetail if kind == self.THUMB else self.armdetail
+                offset = rstart - s['address']
+                chunk = code[offset:offset + (rend - rstart)]
+                for o in offsets(chunk, kind):
+                    o = int(o)
+                    for ins in md.disasm(chunk[o:o + 4], rstart + o, 1):
+                        yield (ins, kind)
+
+    def candidates(self, start=None, stop=None):
+        # what instructions yields for the instructions that might be
+        # stores, decoded in detail mode, without decoding any of the
+        # others
+        return self._decode_at(self.candidate_offsets, start, stop)
+
+    def smcs(self, start=None, stop=None):
+        # the same for smc instructions
+        return self._decode_at(self.smc_offsets, start, stop)
+
+    def missed(self, wanted, start=None, stop=None):
+        # addresses of the instructions that a full decode finds and
+        # wanted(mnemonic, kind) accepts but neither candidates nor smcs
+        # yields, empty as long as the encodings above cover everything
+        found = set(ins.address for (ins, kind) in self.candidates(start, stop))
+        found.update(ins.address for (ins, kind) in self.smcs(start, stop))
+        return [ins.address for (ins, kind) in self.instructions(start, stop)
+                if wanted(ins.mnemonic, kind) and (ins.address not in found)]
+
+
+# detail mode decodings of one section's bytes in a single mode, filled
+# in a run at a time (normally a whole function) the first time an
+# address in that run is asked for
+class DisasmWindow():
+    def __init__(self, md, lo, code, run_end):
+        self.md = md
+        self.lo = lo
+        self.hi = lo + len(code)
+        self.code = code
+        self.run_end = run_end  # address -> where to stop decoding
+        self._ins = {}
+
+    def at(self, addr):
+        # instruction at addr, None if nothing decodes there
+        if addr not in self._ins:
+            if not (self.lo <= addr < self.hi):
+                return None
+            end = min(max(self.run_end(addr), addr + 4), self.hi)
+            for ins in self.md.disasm(self.code[addr - self.lo:end - self.lo], addr):
+                self._ins[ins.address] = ins
+        return self._ins.get(addr, None)
+
+    def after(self, addr):
+        # instructions from addr onwards
+        ins = self.at(addr)
+        while ins is not None:
+            yield ins
+            ins = self.at(ins.address + ins.size)
+
+
+def read_ranges(elf, sections, ranges):
+    # {start: bytes} for each (start, size) in ranges that lies within
+    # the file image of one of sections, reading each section once
+    results = {}
+    with open(elf, "rb") as f:
+        for s in sections:
+            lo = s['address']
+            hi = lo + s['filesize']
+            inside = [(start, size) for (start, size) in ranges
+                      if (lo <= start) and (start + size <= hi)]
+            if not inside:
+                continue
+            f.seek(s['offset'])
+            code = f.read(s['filesize'])
+            for (start, size) in inside:
+                results[start] = code[start - lo:start - lo + size]
+    return results
+
+
+def split_range(lo, hi, cuts, nshards):
+    # split [lo, hi) into at most nshards pieces of similar size, only
+    # cutting at addresses in cuts (function entry points)
+    size = (hi - lo) / nshards
+    if size <= 0:
+        return [(lo, hi)]
+    shards = []
+    start = lo
+    for c in sorted(set(cuts)):
+        if (c <= start) or (c >= hi):
+            continue
+        if (c - start) >= size:
+            shards.append((start, c))
+            start = c
+    shards.append((start, hi))
+    return shards
@@ -143,6 +143,16 @@ def go():
     parser.add_argument('-q', '--quick',
                         help='Try to skip some steps to be faster',
                         action='store_true', default=False)
+    parser.add_argument('-j', '--static_jobs', type=int, default=1,
+                        help='Number of processes to use for static analysis')
+    parser.add_argument('--no_static_cache', action='store_true', default=False,
+                        help='Always redo static analysis instead of reusing results '
+                        'for an identical build')
+    parser.add_argument('--static_base', action='store', default=None,
+                        help='Earlier test instance of the same target, only '
+                        'functions that changed since it get analyzed again')
+    parser.add_argument('--static_verify', action='store_true', default=False,
+                        help='Check an incremental static analysis against a full one')
 
     args = parser.parse_args()
     args.hook = ""
@@ -174,7 +184,11 @@ def go():
                                         not args.keep_temp_files,
                                         args.quick,
                                         other,
-                                        args.verbose)
+                                        args.verbose,
+                                        static_jobs=args.static_jobs,
+                                        static_cache=not args.no_static_cache,
+                                        static_base=args.static_base,
+                                        static_verify=args.static_verify)
 
 
     # task_mgr = doit_manager.TaskManager(args.print_build_commands,
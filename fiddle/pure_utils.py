@@ -23,7 +23,7 @@
 import hashlib
 import run_cmd
 import re
-import r2_keeper as r2
+import elf_model
 shell = run_cmd.Cmd()
 
 
@@ -36,7 +36,9 @@ def file_md5(filename):
 
 
 def get_entrypoint(elf):
-    return r2.entrypoint(elf)
+    # without the thumb bit, as r2 gave it
+    e = elf_model.get(elf)
+    return (e.entry & ~1) if e.is_arm else e.entry
     # cmd = "%sreadelf -W -h %s" % (cc, elf)
     # output = shell.run_multiline_cmd(cmd)
     # ere = re.compile("Entry point address:[\s]+(0x[a-fA-F0-9]{1,16})")
@@ -71,42 +73,20 @@ def get_min_max_pcs(elf):
     return (lo, hi)
 
 def get_section_headers(elf):
-    ds = r2.get(elf, "iSj")
-    index = 0
-    headers = []
-    for d in ds:
-        h = {
-            "number": index,
-            "name": d["name"],
-            "address": d["vaddr"],
-            "offset": d["paddr"],
-            "size": d['vsize'],
-            "filesize": d['size'], 
-            "flags": d['flags']
-        }
-        headers.append(h)
-        index += 1
-    return headers
+    return [dict(h) for h in elf_model.get(elf).sections]
 
 
 def get_section_location(elf, name):
-    start = 0
-    end = 0
-
-    headers = get_section_headers(elf)
-    for h in headers:
-        if h['name'] == name:
-            start = h['address']
-            end = start+h['size']
-            return (start, end)
-    return (-1, -1)
+    h = elf_model.get(elf).section(name)
+    if h is None:
+        return (-1, -1)
+    return (h['address'], h['address'] + h['size'])
 
 
 def get_symbol_location(elf, name, debug=False):
-    s = r2.get(elf, "isj")    
-    for i in s:
-        if i["name"] == name:
-            if debug:
-                print i
-            return i["vaddr"]
-    return -1
+    s = elf_model.get(elf).symbol(name)
+    if s is None:
+        return -1
+    if debug:
+        print s.__dict__
+    return s.addr
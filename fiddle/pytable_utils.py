@@ -20,6 +20,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import numpy
+import tables
+import weakref
+
 
 def get_rows(table, query):
     indices = table.where(query)  # [r for r in rows]
@@ -44,6 +48,7 @@ def has_results(table, query):
 
 
 def get_sorted(table, col):
+    build_indexes(table)
     return table.read_sorted(col)
 
 
@@ -56,3 +61,269 @@ def get_unique_result(table, query):
         return None
     else:
         return res[0]
+
+
+def rows_array(table, rows, add=True):
+    # a list of {column: value} dicts as a record array shaped like
+    # table, missing columns get the column's default value. Interned
+    # strings are swapped for their ids, see encode_row
+    rows = [encode_row(table, r, add) for r in rows]
+    flush_strings(table)
+    a = numpy.zeros(len(rows), dtype=table.dtype)
+    for name in table.colnames:
+        dflt = table.coldflts[name]
+        a[name] = [r.get(name, dflt) for r in rows]
+    return a
+
+
+def append_rows(table, rows):
+    # write a list of {column: value} dicts with a single append
+    if len(rows) == 0:
+        return
+    table.append(rows_array(table, rows))
+
+
+# columns each table description wants a full index on, see indexes
+_indexes = {}
+
+
+def indexes(*cols):
+    # class decorator for a table description, declaring the columns
+    # build_indexes indexes once the table has been loaded
+    def declare(desc):
+        _indexes[desc] = list(cols)
+        return desc
+    return declare
+
+
+# how a table is stored, its compression and how many bytes go in each
+# chunk. "scan" suits long tables mostly read start to end, "lookup"
+# tables mostly queried a few rows at a time and "plain" is what PyTables
+# does by default
+profiles = {
+    "scan": {"complib": "blosc:zstd", "complevel": 3, "shuffle": True,
+             "chunkbytes": 1 << 20},
+    "lookup": {"complib": "blosc:lz4", "complevel": 1, "shuffle": True,
+               "chunkbytes": 16 << 10},
+    "plain": {"complib": None, "complevel": 0, "shuffle": False,
+              "chunkbytes": None},
+}
+
+# profile names by table name that win over the profile create_table is
+# given, "*" applies to every table. Filled in from the table_profiles
+# runtime config
+table_profiles = {}
+
+
+def storage_options(name, desc, profile):
+    # create_table keyword arguments for storing table name the way its
+    # profile says to
+    p = profiles[table_profiles.get(name, table_profiles.get("*", profile))]
+    opts = {}
+    if p["complevel"]:
+        complib = p["complib"]
+        if not tables.which_lib_version(complib.split(":")[0]):
+            complib = "zlib"
+        opts["filters"] = tables.Filters(complevel=p["complevel"], complib=complib,
+                                         shuffle=p["shuffle"])
+    if p["chunkbytes"]:
+        rowsize = tables.description.dtype_from_descr(desc).itemsize
+        opts["chunkshape"] = (max(1, p["chunkbytes"] // rowsize),)
+    return opts
+
+
+def create_table(h5file, where, name, desc, title="", profile="lookup",
+                 expectedrows=10000):
+    # a table without any indexes, so loading it does not keep them up to
+    # date. The indexes desc declares get built by build_indexes, and
+    # after that, rows appended leave them dirty until the next one
+    table = h5file.create_table(where, name, desc, title, expectedrows=expectedrows,
+                                **storage_options(name, desc, profile))
+    table.autoindex = False
+    table.attrs.indexes = _indexes.get(desc, [])
+    table.attrs.interned = _interned.get(desc, [])
+    return table
+
+
+def pending_indexes(table):
+    # declared indexes that are missing or out of date
+    cols = getattr(table.attrs, 'indexes', [])
+    return [c for c in cols
+            if (not table.colindexed[c]) or table.colinstances[c].index.dirty]
+
+
+def build_indexes(table):
+    if table._v_file.mode == "r":
+        return
+    # done with once its indexes are built, so strings added one row at
+    # a time (see encode_row) get stored now as well
+    flush_strings(table)
+    for c in pending_indexes(table):
+        col = table.colinstances[c]
+        if table.colindexed[c]:
+            col.reindex_dirty()
+        else:
+            col.create_index(kind='full')
+    table.flush()
+
+
+def build_file_indexes(h5file):
+    # build_indexes for every table in h5file
+    if (h5file is None) or (not h5file.isopen) or (h5file.mode == "r"):
+        return
+    for table in h5file.walk_nodes("/", "Table"):
+        build_indexes(table)
+
+
+# columns each table description stores as StringPool ids, see interned
+_interned = {}
+
+
+def interned(*cols):
+    # class decorator for a table description, declaring the (UInt32Col)
+    # columns that hold the ids of strings in the group's StringPool
+    def declare(desc):
+        _interned[desc] = list(cols)
+        return desc
+    return declare
+
+
+# every distinct string the interned columns of a group's tables hold,
+# stored once each and referred to by its position. The group keeps the
+# strings' bytes back to back in one node and where each one ends in
+# another, so a batch of new strings takes one append to each
+class StringPool():
+    nodename = "strings"
+    endsname = "string_ends"
+    missing = 0xFFFFFFFF  # id of a string that is not in the pool
+
+    def __init__(self, group):
+        self.group = group
+        self.values = []
+        if self.nodename in group:
+            data = group._f_get_child(self.nodename).read().tostring()
+            ends = group._f_get_child(self.endsname).read().tolist()
+            self.values = [data[s:e] for (s, e) in zip([0] + ends[:-1], ends)]
+        self.ids = {v: i for (i, v) in enumerate(self.values)}
+        self._unwritten = 0  # strings at the end of values not stored yet
+        self._array = None
+        self._columns = {}
+
+    def id(self, value, add=True):
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        i = self.ids.get(value)
+        if i is not None:
+            return i
+        if not add:
+            return self.missing
+        i = len(self.values)
+        self.values.append(value)
+        self.ids[value] = i
+        self._unwritten += 1
+        self._array = None
+        return i
+
+    def flush(self):
+        # store the strings added since the last flush
+        if not self._unwritten:
+            return
+        new = self.values[-self._unwritten:]
+        if self.nodename not in self.group:
+            h5file = self.group._v_file
+            h5file.create_earray(self.group, self.nodename, tables.UInt8Atom(), (0,),
+                                 "interned strings")
+            h5file.create_earray(self.group, self.endsname, tables.Int64Atom(), (0,),
+                                 "end of each interned string")
+        data = self.group._f_get_child(self.nodename)
+        ends = self.group._f_get_child(self.endsname)
+        lengths = numpy.cumsum([len(v) for v in new], dtype=numpy.int64)
+        if lengths[-1] > 0:
+            data.append(numpy.frombuffer("".join(new), dtype=numpy.uint8))
+        ends.append(lengths + data.nrows - lengths[-1])
+        self._unwritten = 0
+
+    def value(self, i):
+        return self.values[i] if i < len(self.values) else ""
+
+    def values_of(self, ids):
+        # value for each id in the array ids
+        if self._array is None:
+            self._array = numpy.array(self.values + [""], dtype=object)
+        ids = numpy.minimum(numpy.asarray(ids, dtype=numpy.int64), len(self.values))
+        return self._array[ids]
+
+    def columns(self, table):
+        # table's interned columns
+        if table.name not in self._columns:
+            self._columns[table.name] = list(getattr(table.attrs, 'interned', []))
+        return self._columns[table.name]
+
+
+# {h5file: {group path: StringPool}}
+_pools = weakref.WeakKeyDictionary()
+
+
+def string_pool(table):
+    group = table._v_parent
+    pools = _pools.setdefault(table._v_file, {})
+    if group._v_pathname not in pools:
+        pools[group._v_pathname] = StringPool(group)
+    return pools[group._v_pathname]
+
+
+def flush_strings(table):
+    # store the new strings of table's group, if anything added some
+    pool = _pools.get(table._v_file, {}).get(table._v_parent._v_pathname)
+    if pool is not None:
+        pool.flush()
+
+
+def encode_row(table, row, add=True):
+    # row, a {column: value} dict, with the strings of table's interned
+    # columns swapped for their ids. Strings not in the pool yet get
+    # added, to be stored by the next flush_strings, or become
+    # StringPool.missing unless add
+    pool = string_pool(table)
+    cols = [c for c in pool.columns(table) if c in row]
+    if not cols:
+        return row
+    row = dict(row)
+    for c in cols:
+        row[c] = pool.id(row[c], add)
+    return row
+
+
+def decode_row(table, row):
+    # encode_row undone
+    pool = string_pool(table)
+    cols = [c for c in pool.columns(table) if c in row]
+    if not cols:
+        return row
+    row = dict(row)
+    for c in cols:
+        row[c] = pool.value(row[c])
+    return row
+
+
+def row_dict(table, r):
+    # row r of table (a Row or a record) as a {column: value} dict with
+    # interned strings resolved
+    return decode_row(table, {f: r[f] for f in table.colnames})
+
+
+def column_strings(table, col, ids):
+    # the strings the ids in column col of table stand for, col as it is
+    # if table does not intern it
+    pool = string_pool(table)
+    if col not in pool.columns(table):
+        return numpy.asarray(ids)
+    return pool.values_of(ids)
+
+
+def string_id(table, col, value):
+    # what to compare column col of table with in a query to find value
+    pool = string_pool(table)
+    if col not in pool.columns(table):
+        return value
+    return pool.id(value, False)
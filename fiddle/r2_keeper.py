@@ -1,30 +1,49 @@
 import r2pipe
 import json
+import atexit
 
 files = {}
 entry = {}
-    
+
+
+def _quit(handle):
+    try:
+        handle.quit()
+    except IOError:
+        pass
+
+
+def _open(f):
+    # only done the first time something asks r2 about f
+    handle = r2pipe.open(f, ['-2'])
+    files[f] = handle
+    atexit.register(_quit, handle)
+    entry[f] = handle.cmd("s")
+    handle.cmd('aas')
+    return handle
+
 
 def gets(f, cmd):
     if f in files.keys():
         handle = files[f]
     else:
-        handle = r2pipe.open(f, ['-2'])
-        files[f] = handle
-        entry[f] = handle.cmd("s")
-        handle.cmd('aas')
+        handle = _open(f)
     out = handle.cmd(cmd)
     return out
 
+
 def get(f, cmd):
     out = gets(f, cmd)
-    try:        
+    try:
         return json.loads(out)
     except ValueError:
         return {}
 
+
 def entrypoint(f):
+    if f not in files.keys():
+        _open(f)
     return entry[f]
-    
+
 def cd(f, dst):
     gets(f, "cd %s" % dst)
@@ -0,0 +1,162 @@
+# MIT License
+
+# Copyright (c) 2017 Rebecca ".bx" Shapiro
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import bisect
+import numpy
+import intervaltree
+
+
+# sorted, non-overlapping [start, end) address ranges each tagged with
+# the kind of contents the $a/$t/$d mapping symbols say they hold
+class RangeMap():
+    NONE = -1
+    ARM = 0
+    THUMB = 1
+    DATA = 2
+    symbol_kinds = {'a': ARM, 't': THUMB, 'd': DATA}
+
+    def __init__(self, starts, ends, kinds):
+        self.starts = numpy.asarray(starts, dtype=numpy.int64)
+        self.ends = numpy.asarray(ends, dtype=numpy.int64)
+        self.kinds = numpy.asarray(kinds, dtype=numpy.int8)
+        self._starts = self.starts.tolist()  # for scalar bisects
+
+    @classmethod
+    def from_mapping_symbols(cls, symbols):
+        # symbols is a list of (addr, letter), each mapping symbol's
+        # range runs up to the next one. Adjacent ranges of the same kind
+        # get merged
+        (starts, ends, kinds) = ([], [], [])
+        prev = None
+        lo = 0
+        for (hi, letter) in sorted(symbols):
+            if (prev is not None) and (not lo == hi):
+                k = cls.symbol_kinds[prev]
+                if kinds and (kinds[-1] == k) and (ends[-1] == lo):
+                    ends[-1] = hi
+                else:
+                    starts.append(lo)
+                    ends.append(hi)
+                    kinds.append(k)
+            lo = hi
+            prev = letter
+        return cls(starts, ends, kinds)
+
+    @classmethod
+    def from_rows(cls, rows):
+        rows = numpy.sort(rows, order='startaddr')
+        return cls(rows['startaddr'], rows['endaddr'], rows['kind'])
+
+    def rows(self):
+        return [{'startaddr': int(s), 'endaddr': int(e), 'kind': int(k)}
+                for (s, e, k) in zip(self.starts, self.ends, self.kinds)]
+
+    def kind_at(self, addr):
+        i = bisect.bisect_right(self._starts, addr) - 1
+        if (i >= 0) and (addr < self.ends[i]):
+            return self.kinds[i]
+        return self.NONE
+
+    def kind_of(self, pcs):
+        # kind_at for each address in the array pcs
+        pcs = numpy.asarray(pcs, dtype=numpy.int64)
+        i = numpy.searchsorted(self.starts, pcs, "right") - 1
+        res = numpy.full(pcs.shape, self.NONE, dtype=numpy.int8)
+        ok = i >= 0
+        ok[ok] = pcs[ok] < self.ends[i[ok]]
+        res[ok] = self.kinds[i[ok]]
+        return res
+
+    def overlap(self, lo, hi, kind=None):
+        # (start, end, kind) of the ranges that overlap [lo, hi)
+        i = max(bisect.bisect_right(self._starts, lo) - 1, 0)
+        j = bisect.bisect_left(self._starts, hi)
+        return [(int(self.starts[n]), int(self.ends[n]), int(self.kinds[n]))
+                for n in range(i, j)
+                if (self.ends[n] > lo) and ((kind is None) or (self.kinds[n] == kind))]
+
+    def views(self):
+        # (thumb, arm, data), what find_thumb_ranges has always returned
+        return (KindRanges(self, self.THUMB), KindRanges(self, self.ARM),
+                KindRanges(self, self.DATA))
+
+
+# the ranges of a RangeMap holding one kind, answering the queries the
+# intervaltrees used here to answer
+class KindRanges():
+    def __init__(self, rmap, kind):
+        self.rmap = rmap
+        self.kind = kind
+
+    def overlaps_point(self, addr):
+        return self.rmap.kind_at(addr) == self.kind
+
+    def contains_points(self, pcs):
+        return self.rmap.kind_of(pcs) == self.kind
+
+    def search(self, addr):
+        return self.overlap(addr, addr + 1)
+
+    def overlap(self, lo, hi):
+        return [intervaltree.Interval(s, e)
+                for (s, e, k) in self.rmap.overlap(lo, hi, self.kind)]
+
+    def __iter__(self):
+        return iter(self.overlap(0, numpy.iinfo(numpy.int64).max))
+
+    def __len__(self):
+        return int(numpy.count_nonzero(self.rmap.kinds == self.kind))
+
+
+def union(starts, ends):
+    # union of the [start, end) ranges as sorted, non-overlapping
+    # (starts, ends). Like IntervalTree.merge_overlaps, ranges that only
+    # touch stay apart, and empty ranges are dropped
+    (firsts, starts, ends) = union_by(numpy.zeros(len(starts), dtype=numpy.int8),
+                                      starts, ends)
+    return (starts, ends)
+
+
+def union_by(keys, starts, ends):
+    # union of the ranges sharing each key, sorted by key then start.
+    # Returns, for each merged range, the position in keys of the first
+    # range with its key, along with the merged starts and ends
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    ends = numpy.asarray(ends, dtype=numpy.int64)
+    rows = numpy.flatnonzero(starts < ends)
+    if len(rows) == 0:
+        empty = numpy.array([], dtype=numpy.int64)
+        return (empty, empty, empty)
+    (u, firsts, ranks) = numpy.unique(numpy.asarray(keys)[rows],
+                                      return_index=True, return_inverse=True)
+    order = numpy.lexsort((starts[rows], ranks))
+    ranks = ranks[order].astype(numpy.int64)
+    s = starts[rows][order]
+    e = ends[rows][order]
+    # largest end so far within each key, the offsets keep keys apart
+    lo = s.min()
+    base = ranks * (e.max() - lo + 1) - lo
+    reach = numpy.maximum.accumulate(e + base) - base
+    new = numpy.ones(len(s), dtype=bool)
+    new[1:] = (ranks[1:] != ranks[:-1]) | (s[1:] >= reach[:-1])
+    heads = numpy.flatnonzero(new)
+    return (rows[firsts[ranks[heads]]], s[heads], numpy.maximum.reduceat(e, heads))
@@ -0,0 +1,101 @@
+# MIT License
+
+# Copyright (c) 2017 Rebecca ".bx" Shapiro
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import mmap
+import numpy
+import collections
+
+max_files = 256
+files = collections.OrderedDict()
+
+
+def get(path):
+    # the SrcFile for path, reopened if the file changed since it was
+    # last read. Only the max_files most recently used stay open
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime, st.st_size)
+    f = files.pop(path, None)
+    if (f is None) or (f.stamp != stamp):
+        if f is not None:
+            f.close()
+        f = SrcFile(path, stamp)
+    files[path] = f
+    while len(files) > max_files:
+        (p, old) = files.popitem(last=False)
+        old.close()
+    return f
+
+
+# a source file mapped into memory along with the offset of every line
+class SrcFile():
+    def __init__(self, path, stamp):
+        self.path = path
+        self.stamp = stamp
+        self.size = stamp[1]
+        self._derived = {}
+        if self.size > 0:
+            with open(path, "rb") as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            nl = numpy.flatnonzero(numpy.frombuffer(self.mm, dtype=numpy.uint8) == 10)
+        else:
+            self.mm = ""
+            nl = numpy.zeros(0, dtype=numpy.int64)
+        self.starts = numpy.concatenate(([0], nl + 1))
+        self.ends = numpy.concatenate((nl, [self.size]))
+        if (len(nl) > 0) and (nl[-1] == self.size - 1):
+            # nothing after the last newline
+            self.starts = self.starts[:-1]
+            self.ends = self.ends[:-1]
+        elif self.size == 0:
+            self.starts = self.starts[:0]
+            self.ends = self.ends[:0]
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.mm = ""
+        self._derived = {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def line(self, lineno):
+        # text of line lineno (counting from 1) without its newline, None
+        # past either end of the file
+        if (lineno < 1) or (lineno > len(self.starts)):
+            return None
+        return self.mm[self.starts[lineno - 1]:self.ends[lineno - 1]]
+
+    def lines(self, start=1, end=None):
+        # text of lines [start, end)
+        if end is None:
+            end = len(self.starts) + 1
+        return [self.line(i) for i in range(max(start, 1),
+                                            min(end, len(self.starts) + 1))]
+
+    def derived(self, key, fn):
+        # fn(), computed once while this version of the file is cached
+        if key not in self._derived:
+            self._derived[key] = fn()
+        return self._derived[key]
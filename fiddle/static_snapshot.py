@@ -0,0 +1,238 @@
+# MIT License
+
+# Copyright (c) 2017 Rebecca ".bx" Shapiro
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import mmap
+import json
+import struct
+import tempfile
+import numpy
+
+write_fields = ['pc', 'thumb', 'reg0', 'reg1', 'reg2',
+                'reg3', 'reg4', 'writesize', 'halt']
+
+# sidecar layout: magic, format version and header length, then a json
+# header naming each array's offset, dtype and length. Every array
+# starts on a page boundary so it can be mapped straight from the file
+magic = "FIDDLEIX"
+sidecar_version = 1
+prefix = struct.Struct("<8sII")
+
+
+def _stamp(dbpath, cache_version):
+    # what the sidecar was made from, it is stale once the db changes
+    st = os.stat(dbpath)
+    return [cache_version, st.st_mtime, st.st_size]
+
+
+def _align(n):
+    return (n + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+
+
+def _descr(dtype):
+    return [[n, dtype.fields[n][0].str] for n in dtype.names] \
+        if dtype.names else dtype.str
+
+
+def _dtype(descr):
+    if isinstance(descr, list):
+        return numpy.dtype([(str(n), str(t)) for (n, t) in descr])
+    return numpy.dtype(str(descr))
+
+
+def export(arrays, path, stamp):
+    # write arrays, a dict of 1-d numpy arrays, to path in one go
+    entries = {}
+    offset = 0
+    for name in sorted(arrays.iterkeys()):
+        a = numpy.ascontiguousarray(arrays[name])
+        entries[name] = {'offset': offset, 'dtype': _descr(a.dtype), 'length': len(a)}
+        offset = _align(offset + a.nbytes)
+    header = json.dumps({'stamp': stamp, 'arrays': entries})
+    start = _align(prefix.size + len(header))
+    d = os.path.dirname(path)
+    (fd, tmp) = tempfile.mkstemp(prefix=".tmp", dir=d if d else ".")
+    with os.fdopen(fd, "wb") as f:
+        f.write(prefix.pack(magic, sidecar_version, len(header)))
+        f.write(header)
+        for name in sorted(arrays.iterkeys()):
+            f.seek(start + entries[name]['offset'])
+            f.write(numpy.ascontiguousarray(arrays[name]).tobytes())
+        f.truncate(start + offset)
+    os.rename(tmp, path)
+
+
+def load(path, stamp):
+    # dict of read only memmaps of the arrays in the sidecar at path,
+    # None if it is missing or was made from something other than stamp
+    try:
+        with open(path, "rb") as f:
+            (m, version, n) = prefix.unpack(f.read(prefix.size))
+            header = json.loads(f.read(n))
+    except (IOError, struct.error, ValueError):
+        return None
+    if (m != magic) or (version != sidecar_version) or (header['stamp'] != stamp):
+        return None
+    start = _align(prefix.size + n)
+    arrays = {}
+    for (name, e) in header['arrays'].iteritems():
+        dtype = _dtype(e['dtype'])
+        if e['length'] == 0:
+            arrays[str(name)] = numpy.zeros(0, dtype=dtype)
+        else:
+            arrays[str(name)] = numpy.memmap(path, dtype=dtype, mode="r",
+                                             offset=start + e['offset'],
+                                             shape=(e['length'],))
+    return arrays
+
+
+# sorted copies of the static db columns that pc lookups use. They come
+# from a page aligned sidecar next to the db that every process maps, so
+# concurrent readers share one copy in the page cache. When there is no
+# sidecar they get read from the db the first time they are needed.
+# Lookups take either one pc or an array of them
+class StaticSnapshot():
+    def __init__(self, ws, arrays=None):
+        self.ws = ws
+        self._cols = dict(arrays) if arrays else {}
+
+    @classmethod
+    def open(cls, ws, path, stamp):
+        # map the sidecar at path, (re)exporting it first if it is stale
+        arrays = load(path, stamp)
+        if arrays is None:
+            s = cls(ws)
+            try:
+                export(s.arrays(), path, stamp)
+            except (IOError, OSError):
+                return s
+            arrays = load(path, stamp)
+        return cls(ws, arrays)
+
+    loaders = {
+        'writes': '_load_writes',
+        'writes.pc': '_load_writes',
+        'smcs.pc': '_load_smcs',
+        'srcs.addr': '_load_srcs',
+        'longwrites.writeaddr': '_load_longwrites',
+        'skips.pc': '_load_skips',
+        'skips.maxresumepc': '_load_skips',
+    }
+
+    def arrays(self):
+        return {name: self._get(name) for name in self.loaders.iterkeys()}
+
+    def _get(self, name):
+        if name not in self._cols:
+            self._cols.update(getattr(self, self.loaders[name])())
+        return self._cols[name]
+
+    @classmethod
+    def _sorted(cls, table, col):
+        return numpy.sort(table.col(col).astype(numpy.int64))
+
+    def _load_writes(self):
+        w = self.ws.writestable.read()
+        w = w[numpy.argsort(w['pc'], kind='mergesort')]
+        return {'writes': w, 'writes.pc': w['pc'].astype(numpy.int64)}
+
+    def _load_smcs(self):
+        return {'smcs.pc': self._sorted(self.ws.smcstable, 'pc')}
+
+    def _load_srcs(self):
+        return {'srcs.addr': self._sorted(self.ws.srcstable, 'addr')}
+
+    def _load_longwrites(self):
+        return {'longwrites.writeaddr': self._sorted(self.ws.longwritestable, 'writeaddr')}
+
+    def _load_skips(self):
+        # skip range starts with the largest resumepc of any range
+        # starting at or before each one, a pc is skipped when that is
+        # past it
+        s = self.ws.skipstable.read()
+        s = s[numpy.argsort(s['pc'], kind='mergesort')]
+        maxends = numpy.maximum.accumulate(s['resumepc'].astype(numpy.int64)) \
+            if len(s) else numpy.zeros(0, dtype=numpy.int64)
+        return {'skips.pc': s['pc'].astype(numpy.int64), 'skips.maxresumepc': maxends}
+
+    @classmethod
+    def _positions(cls, arr, pcs):
+        # (index in arr, whether it is there) of each pc
+        pcs = numpy.asarray(pcs, dtype=numpy.int64)
+        i = numpy.searchsorted(arr, pcs)
+        found = i < len(arr)
+        found[found] = arr[i[found]] == pcs[found]
+        return (i, found)
+
+    @classmethod
+    def _position(cls, arr, pc):
+        # index of pc in arr, -1 if it is not there
+        i = int(numpy.searchsorted(arr, pc))
+        return i if (i < len(arr)) and (arr[i] == pc) else -1
+
+    def write_info(self, pc):
+        i = self._position(self._get('writes.pc'), pc)
+        if i < 0:
+            return {}
+        r = self._get('writes')[i]
+        return {f: r[f] for f in write_fields}
+
+    def write_size(self, pc):
+        i = self._position(self._get('writes.pc'), pc)
+        return self._get('writes')['writesize'][i] if i >= 0 else 0
+
+    def write_sizes(self, pcs):
+        w = self._get('writes')
+        (i, found) = self._positions(self._get('writes.pc'), pcs)
+        sizes = numpy.zeros(len(i), dtype=w['writesize'].dtype)
+        sizes[found] = w['writesize'][i[found]]
+        return sizes
+
+    def is_smc(self, pc):
+        return self._position(self._get('smcs.pc'), pc) >= 0
+
+    def are_smcs(self, pcs):
+        return self._positions(self._get('smcs.pc'), pcs)[1]
+
+    def in_srcs(self, pc):
+        return self._position(self._get('srcs.addr'), pc) >= 0
+
+    def are_in_srcs(self, pcs):
+        return self._positions(self._get('srcs.addr'), pcs)[1]
+
+    def is_longwrite(self, pc):
+        return self._position(self._get('longwrites.writeaddr'), pc) >= 0
+
+    def are_longwrites(self, pcs):
+        return self._positions(self._get('longwrites.writeaddr'), pcs)[1]
+
+    def is_skipped(self, pc):
+        i = int(numpy.searchsorted(self._get('skips.pc'), pc, "right")) - 1
+        return (i >= 0) and bool(self._get('skips.maxresumepc')[i] > pc)
+
+    def are_skipped(self, pcs):
+        maxends = self._get('skips.maxresumepc')
+        pcs = numpy.asarray(pcs, dtype=numpy.int64)
+        i = numpy.searchsorted(self._get('skips.pc'), pcs, "right") - 1
+        res = i >= 0
+        res[res] = maxends[i[res]] > pcs[res]
+        return res
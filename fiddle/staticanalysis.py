@@ -21,12 +21,11 @@
 # SOFTWARE.
 
 import tables
-import atexit
-import subprocess
 import re
 import sys
 import os
 import intervaltree
+import bisect
 from capstone import *
 from capstone.arm import *
 import testsuite_utils as utils
@@ -35,7 +34,15 @@ import pytable_utils
 from config import Main
 import numpy
 import importlib
-import r2_keeper as r2
+import multiprocessing
+import pure_utils
+import linear_sweep
+import content_cache
+import elf_model
+import range_map
+import static_snapshot
+
+
 def int_repr(self):
     return "({0:08X}, {1:08X})".format(self.begin, self.end)
 
@@ -235,6 +242,33 @@ class InstructionAnalyzer():
             regs.append('cpsr')
         return regs
 
+    def store_recipe(self, ins):
+        # what calculate_store_offset needs from a decoded store, as
+        # writes table columns. Registers are capstone ids, 0 if unused
+        recipe = {'basereg': 0, 'indexreg': 0, 'lshift': 0, 'disp': 0,
+                  'cc': ins.cc}
+        if ins.mnemonic.startswith("push"):
+            recipe['basereg'] = ARM_REG_SP
+        elif ins.mnemonic.startswith("stl") or ins.mnemonic.startswith("stm"):
+            recipe['basereg'] = ins.operands[0].reg
+        for i in ins.operands:
+            if i.type == ARM_OP_MEM:
+                recipe['basereg'] = i.mem.base
+                recipe['indexreg'] = i.mem.index
+                recipe['lshift'] = i.mem.lshift
+                recipe['disp'] = i.mem.disp
+        return recipe
+
+    def reg_name(self, reg):
+        return self.arm.reg_name(reg).encode('ascii') if reg else None
+
+    @classmethod
+    def recipe_store_offset(cls, lshift, disp, base, index=0):
+        # calculate_store_offset given the base and index register values
+        if lshift > 0:
+            index = (index << lshift) % (0xFFFFFFFF)
+        return (base + index + disp) % (0xFFFFFFFF)
+
     @classmethod
     def _is_mne_memstore(cls, mne):
         return InstructionAnalyzer.writemnere.match(mne) is not None
@@ -243,6 +277,7 @@ class InstructionAnalyzer():
         return self._is_mne_memstore(mne)
 
 
+@pytable_utils.indexes('pc')
 class WriteEntry(tables.IsDescription):
     pc = tables.UInt32Col()
     thumb = tables.BoolCol()
@@ -253,19 +288,28 @@ class WriteEntry(tables.IsDescription):
     reg4 = tables.StringCol(4)
     writesize = tables.Int32Col()
     halt = tables.BoolCol()  # whether to insert a breakpoint here
+    # store recipe, see InstructionAnalyzer.store_recipe
+    basereg = tables.UInt16Col()
+    indexreg = tables.UInt16Col()
+    lshift = tables.UInt8Col()
+    disp = tables.Int32Col()
+    cc = tables.UInt8Col()
 
 
+@pytable_utils.indexes('addr', 'line')
+@pytable_utils.interned('line', 'src', 'disasm')
 class SrcEntry(tables.IsDescription):
     addr = tables.UInt32Col()
-    line = tables.StringCol(512)  # file/lineno
-    src = tables.StringCol(512)  # contents of source code at this location
+    line = tables.UInt32Col()  # file/lineno
+    src = tables.UInt32Col()  # contents of source code at this location
     ivalue = tables.StringCol(12)
     ilength = tables.UInt8Col()
     thumb = tables.BoolCol()
     mne = tables.StringCol(10)
-    disasm = tables.StringCol(256)
+    disasm = tables.UInt32Col()
 
 
+@pytable_utils.indexes('startaddr', 'relocpc', 'cardinal')
 class RelocInfo(tables.IsDescription):
     startaddr = tables.UInt32Col()  # first address in relocation block
     size = tables.UInt32Col()  # number of relocated bytes
@@ -285,17 +329,33 @@ class StageExitInfo(tables.IsDescription):
     line = tables.StringCol(512)  # file/lineno
 
 
+@pytable_utils.indexes('pc')
 class SmcEntry(tables.IsDescription):
     pc = tables.UInt32Col()
     thumb = tables.BoolCol()
 
 
+@pytable_utils.indexes('startaddr', 'endaddr', 'fname')
+@pytable_utils.interned('fname')
 class FuncEntry(tables.IsDescription):
-    fname = tables.StringCol(40)  # name of function pc is located
+    fname = tables.UInt32Col()  # name of function pc is located
     startaddr = tables.UInt32Col()  # first address in relocation block
     endaddr = tables.UInt32Col()  # first address in relocation block
 
 
+class RangeEntry(tables.IsDescription):
+    startaddr = tables.UInt32Col()
+    endaddr = tables.UInt32Col()
+    kind = tables.Int8Col()  # range_map.RangeMap.ARM/THUMB/DATA
+
+
+class ProvenanceEntry(tables.IsDescription):
+    fname = tables.StringCol(128)  # function carried over from an earlier build
+    startaddr = tables.UInt32Col()  # first address in this build
+    endaddr = tables.UInt32Col()
+    oldstartaddr = tables.UInt32Col()  # first address in the earlier build
+
+
 class LongWriteRangeType():
     @staticmethod
     def get_reg_lists(row):
@@ -381,6 +441,7 @@ LongWriteRangeType.rangetypes = {
     }
 
 
+@pytable_utils.indexes('breakaddr')
 class LongWrites(tables.IsDescription):
     breakaddr = tables.UInt32Col()  # where write loop starts
     writeaddr = tables.UInt32Col()  # where write loop starts
@@ -473,15 +534,10 @@ class LongWriteDescriptor():
         # find first write after breakpoint or write addr
         checkaddr = writestart
         self.thumb = self.table.thumbranges.overlaps_point(self.breakaddr)
-        sz = 4
-        if self.thumb:
-            sz = 2
 
         # resume after first conditional branch after write instruction
         while self.writeaddr is None:
-            (checkvalue, disasm, funname) = \
-                utils.addr2disasmobjdump(checkaddr, sz, self.stage, self.thumb)
-            checkinstr = self.table.ia.disasm(checkvalue, self.thumb, checkaddr)
+            checkinstr = self.table.disasm_at(checkaddr, self.thumb)
             if not self.table.ia.is_instr_memstore(checkinstr):
                 checkaddr = checkaddr + len(checkinstr.bytes)
             self.writeaddr = checkaddr
@@ -497,8 +553,11 @@ class LongWriteDescriptor():
         self.writesize = write['writesize']
         write['halt'] = False
         write.update()
-        (self.value, self.disasm, self.funname) = \
-            utils.addr2disasmobjdump(self.writeaddr, sz, self.stage, self.thumb)
+        self.instr = self.table.disasm_at(self.writeaddr, self.thumb)
+        self.value = bytes(self.instr.bytes)
+        self.disasm = "%s %s" % (self.instr.mnemonic, self.instr.op_str)
+        f = self.table.func_at_addr(self.writeaddr)
+        self.funname = f[0][0] if f else ""
 
         try:
             next(writes)
@@ -511,7 +570,6 @@ class LongWriteDescriptor():
         self.subreg = subreg
         self.destregs = destregs
         self.thumb = self.table.thumbranges.overlaps_point(self.breakaddr)
-        self.instr = self.table.ia.disasm(self.value, self.thumb, self.writeaddr)
 
         if len(self.destregs) == 0:  # lookup register that holds destination
             self.destregs = self.table.ia.needed_regs(self.instr)
@@ -524,9 +582,7 @@ class LongWriteDescriptor():
 
         # resume after first conditional branch after write instruction
         while self.resumeaddr is None:
-            (checkvalue, disasm, funname) = utils.addr2disasmobjdump(checkaddr, sz,
-                                                                     self.stage, self.thumb)
-            checkinstr = self.table.ia.disasm(checkvalue, self.thumb, checkaddr)
+            checkinstr = self.table.disasm_at(checkaddr, self.thumb)
             if (checkinstr.mnemonic[0] == 'b') and \
                (1 in checkinstr.groups) and \
                (self.table.ia.has_condition_suffix(checkinstr)):  # its a conditional branch!
@@ -662,7 +718,6 @@ class SkipDescriptorGenerator():
         endaddr = -1
         start = ""
         end = ""
-        elf = self.stage.elf
         srcdir = Main.get_runtime_config("temp_target_src_dir")
         isfunc = False
         for l in labels:
@@ -683,25 +738,13 @@ class SkipDescriptorGenerator():
                     startaddr = startaddr - 1
                 
                 #print "lineaddr %s" % startaddr
-                f = pytable_utils.get_unique_result(self.table.funcstable, ("(startaddr <= 0x%x) & (0x%x < endaddr)" % (startaddr, startaddr)))
+                f = self.table.func_at_addr(startaddr)
                 #print "functable lookup for %x %s" % (startaddr, f)
                 if f:
-                    (startaddr, endaddr) = (f['startaddr'], f['endaddr'])
-                else:
-                    fn = utils.addr2functionname(startaddr, self.stage)
-                    #print "functable lookup for %x %s" % (startaddr, fn)                    
-                    (startaddr, endaddr) = utils.get_symbol_location_start_end(fn, self.stage)
-                #print "disasm %x" % (startaddr)                    
-                r2.get(elf, "s 0x%x" % startaddr)
-                disasm = r2.get(elf, "pdj 2")
-                #print "disasm %x: %s" % (startaddr, disasm)
-                #if "disasm" not in disasm[0]:
-                    
-                if disasm[0]["disasm"].startswith("push"):
-                    firstins = disasm[1]
+                    (startaddr, endaddr) = f[0][1:]
                 else:
-                    firstins = disasm[0]
-                startaddr = firstins["offset"]
+                    (startaddr, endaddr) = (-1, -1)
+                startaddr = self._skip_push(startaddr)
                 #print "start %s,%x" % (startaddr, endaddr) 
             elif l.value == "NEXT":
                 lineno = self.table._get_real_lineno(l, False)
@@ -715,23 +758,8 @@ class SkipDescriptorGenerator():
             endaddr = self.table._get_line_addr(end, False)
             if (startaddr % 2) == 1:
                 startaddr = startaddr - 1
-            #old = r2.gets(elf, "s")
-            r2.get(elf, "s 0x%x" % startaddr)
-            #r2.get(elf, "s 0x%x" % old)
-            disasm = r2.get(elf, "pdj 2")
-            if "disasm" in disasm[0]:
-                if (disasm[0][u"disasm"].startswith("push")):
-                    # don't include push instruction                
-                    startins = disasm[1]
-                else:
-                    startins = disasm[0]
-                startaddr = startins["offset"]
-            else:
-                #print "disasm %x: %s" % (startaddr, disasm)                               
-                #print "ZERO %s" % disasm[0]
-                #print disasm[1]
-                pass
-                
+            startaddr = self._skip_push(startaddr)
+
         s = startaddr + self.adjuststart
         e = endaddr + self.adjustend
         if e < s:
@@ -744,48 +772,77 @@ class SkipDescriptorGenerator():
         row['thumb'] = self.table.thumbranges.overlaps_point(row['pc'])
         return row
 
+    def _skip_push(self, addr):
+        # don't include push instruction
+        ins = self.table.disasm_at(addr, self.table.thumbranges.overlaps_point(addr))
+        if (ins is not None) and ins.mnemonic.startswith("push"):
+            return addr + ins.size
+        return addr
+
 
 class ThumbRanges():
+    @staticmethod
+    def range_map(stage):
+        # from the $a/$t/$d mapping symbols
+        symbols = [(s.addr, s.name[1]) for s in elf_model.get(stage.elf).symbols
+                   if s.name in ["$a", "$t", "$d"]]
+        return range_map.RangeMap.from_mapping_symbols(symbols)
+
     @staticmethod
     def find_thumb_ranges(stage):
-        cc = Main.cc
-        elf = stage.elf
-        thumb = intervaltree.IntervalTree()
-        arm = intervaltree.IntervalTree()
-        data = intervaltree.IntervalTree()
-        cmd = "%snm -S -n --special-syms %s 2>/dev/null" % (cc, elf)
-        output = subprocess.check_output(cmd, shell=True).split('\n')
-        prev = None
-        lo = 0
-        dta = re.compile('\$[tad]$')
-        for o in output:
-            o = o.strip()
-            if dta.search(o):
-                hi = int(o[:8], 16)
-                if (prev is not None) and (not lo == hi):
-                    i = intervaltree.Interval(lo, hi)
-                    if prev == 't':
-                        thumb.add(i)
-                    elif prev == 'a':
-                        arm.add(i)
-                    else:
-                        # if o == "80100020 t $d":  # it's actually arm, so continue
-                        #     print "HACK"
-                        #     continue
-                        # else:  # normal
-                        data.add(i)
-                lo = hi
-                prev = o[-1]
-            else:
-                continue
-        res = (thumb, arm, data)
-        for r in res:
-            r.merge_overlaps()
-            r.merge_equals()
+        return ThumbRanges.range_map(stage).views()
+
+
+# the funcs table sorted by start address
+class FuncIndex():
+    def __init__(self, table):
+        rows = numpy.sort(table.read(), order=['startaddr', 'endaddr'])
+        self.names = pytable_utils.column_strings(table, 'fname', rows['fname']).tolist()
+        self.starts = rows['startaddr'].tolist()
+        self.ends = rows['endaddr'].tolist()
+        # largest end address of any function starting at or before each one
+        self.maxends = numpy.maximum.accumulate(rows['endaddr']).tolist() \
+            if len(rows) else []
+
+    def at(self, addr):
+        # (fname, startaddr, endaddr) of every function holding addr, the
+        # one starting closest to addr first
+        res = []
+        i = bisect.bisect_right(self.starts, addr) - 1
+        while (i >= 0) and (self.maxends[i] > addr):
+            if addr < self.ends[i]:
+                res.append((self.names[i], self.starts[i], self.ends[i]))
+            i -= 1
         return res
 
+    def names_at(self, addrs):
+        # name of the function holding each of addrs that starts closest
+        # to it (as at gives first), "" where none does
+        if not self.starts:
+            return [""] * len(addrs)
+        addrs = numpy.asarray(addrs, dtype=numpy.int64)
+        i = numpy.searchsorted(numpy.array(self.starts, dtype=numpy.int64), addrs, "right") - 1
+        j = numpy.maximum(i, 0)
+        held = (i >= 0) & (addrs < numpy.array(self.ends, dtype=numpy.int64)[j])
+        # past the end of the closest function but maybe inside one that
+        # starts earlier and reaches further
+        outer = (i >= 0) & ~held & (addrs < numpy.array(self.maxends, dtype=numpy.int64)[j])
+        names = []
+        for (k, a, h, o) in zip(j.tolist(), addrs.tolist(), held.tolist(), outer.tolist()):
+            if h:
+                names.append(self.names[k])
+            elif o:
+                f = self.at(a)
+                names.append(f[0][0] if f else "")
+            else:
+                names.append("")
+        return names
+
 
 class WriteSearch():
+    # bump whenever the contents of the static analysis db change
+    cache_version = 8
+
     def __init__(self, createdb, stage, verbose=False, readonly=False):
         self.verbose = verbose
         outfile = Main.get_static_analysis_config("db", stage)
@@ -798,10 +855,18 @@ class WriteSearch():
         self.smcstable = None
         self.srcstable = None
         self.funcstable = None
+        self.provenancetable = None
+        self.rangestable = None
         self.longwritestable = None
         self.skipstable = None
         self.verbose = verbose
         (self._thumbranges, self._armranges, self._dataranges) = (None, None, None)
+        self._funcindex = None
+        self._windowsweep = None
+        self._windows = {}
+        self.readonly = readonly
+        self._snapshot = None
+        self.dbpath = outfile
         
         if createdb:
             m = "w"
@@ -812,18 +877,12 @@ class WriteSearch():
                                                   "%s target static analysis"
                                                   % stage.stagename)
         else:
-            mo = "a"
+            # read only handles let any number of processes share the db
+            mo = "r" if readonly else "a"
             self.h5file = tables.open_file(outfile, mode=mo,
                                            title="uboot %s target static analysis"
                                            % stage.stagename)
             self.group = self.h5file.get_node("/staticanalysis")
-        r2.cd(self.stage.elf, Main.get_runtime_config("temp_target_src_dir"))
-        def q():
-            try:
-                r2.files[self.stage.elf].quit()
-            except IOError:
-                pass
-        atexit.register(q)
 
     @classmethod
     def _get_src_labels(cls):
@@ -839,6 +898,15 @@ class WriteSearch():
         self.longwritestable = self.group.longwrites
 
         self.skipstable = self.group.skips
+        # not in dbs made before these tables existed
+        try:
+            self.provenancetable = self.group.provenance
+        except tables.exceptions.NoSuchNodeError:
+            pass
+        try:
+            self.rangestable = self.group.ranges
+        except tables.exceptions.NoSuchNodeError:
+            pass
 
     def print_relocs_table(self):
         for r in self.relocstable.iterrows():
@@ -857,11 +925,16 @@ class WriteSearch():
             self.relocstable = self.group.relocs
         except tables.exceptions.NoSuchNodeError:
             self.create_relocs_table()
+        try:
+            self.rangestable = self.group.ranges
+        except tables.exceptions.NoSuchNodeError:
+            self.create_ranges_table()
         try:
             self.writestable = self.group.writes
             self.smcstable = self.group.smcs
             self.srcstable = self.group.srcs
             self.funcstable = self.group.funcs
+            self.provenancetable = self.group.provenance
         except tables.exceptions.NoSuchNodeError:
             self.create_writes_table()
         try:
@@ -875,25 +948,37 @@ class WriteSearch():
             self.create_skip_table()
 
     def _setthumbranges(self):
-        (self._thumbranges, self._armranges, self._dataranges) = Main.get_runtime_config("thumb_ranges", self.stage)()
+        if self.rangestable is not None:
+            ranges = range_map.RangeMap.from_rows(self.rangestable.read()).views()
+        else:
+            ranges = ThumbRanges.find_thumb_ranges(self.stage)
+        (self._thumbranges, self._armranges, self._dataranges) = ranges
+
+    def create_ranges_table(self):
+        self.rangestable = pytable_utils.create_table(self.h5file, self.group, 'ranges',
+                                                      RangeEntry,
+                                                      "arm, thumb and data ranges")
+        ranges = ThumbRanges.range_map(self.stage)
+        pytable_utils.append_rows(self.rangestable, ranges.rows())
+        self.rangestable.flush()
 
                                                                                          
 
     @property
     def thumbranges(self):
-        if not self._thumbranges:
+        if self._thumbranges is None:
             self._setthumbranges()
         return self._thumbranges
 
     @property
     def armranges(self):
-        if not self._armranges:
+        if self._armranges is None:
             self._setthumbranges()
         return self._armranges
 
     @property
     def dataranges(self):
-        if not self._dataranges:
+        if self._dataranges is None:
             self._setthumbranges()
         return self._dataranges
 
@@ -915,9 +1000,9 @@ class WriteSearch():
             return 0
 
     def create_skip_table(self):
-        self.skipstable = self.h5file.create_table(self.group, 'skips',
-                                                   SkipEntry,
-                                                   "other instructions to skip (besides smc)")
+        self.skipstable = pytable_utils.create_table(self.h5file, self.group, 'skips',
+                                                     SkipEntry,
+                                                     "other instructions to skip (besides smc)")
 
         # TODO: REPLACE ALL OF THIS WITH CODE THAT GENERATES THIS FROM LABELS
         # get all instructions for sdelay
@@ -1036,8 +1121,8 @@ class WriteSearch():
                                        srcdir=Main.get_runtime_config("temp_target_src_dir"))
 
     def create_longwrites_table(self):
-        self.longwritestable = self.h5file.create_table(self.group, 'longwrites',
-                                                        LongWrites, "long writes to precompute")
+        self.longwritestable = pytable_utils.create_table(self.h5file, self.group, 'longwrites',
+                                                          LongWrites, "long writes to precompute")
         skips = []
         #print "LONGWRITES--"
         if not self.is_arm():
@@ -1115,8 +1200,6 @@ class WriteSearch():
             r.append()
             self.longwritestable.flush()
         self.longwritestable.flush()
-        self.longwritestable.cols.breakaddr.create_index(kind='full')
-        self.longwritestable.flush()
         self.writestable.flush()
         self.h5file.flush()
 
@@ -1130,17 +1213,32 @@ class WriteSearch():
 
     @classmethod
     def find_labels(cls, lclass, value, stage, name):
-        all_labels = cls._get_src_labels()
-        results = []
-        if lclass not in all_labels.iterkeys():
-            return []
-        labels = all_labels[lclass]
-        for l in labels:
-            if ((stage is None) or (l.stagename == stage.stagename)) \
-               and ((len(name) == 0) or (l.name == name)) \
-               and ((len(value) == 0) or (l.value == value)):
-                results.append(l)
-        return results
+        return list(cls._get_src_labels().find(lclass,
+                                               stage.stagename if stage else None,
+                                               name if name else None,
+                                               value if value else None))
+
+    @classmethod
+    def cache(cls):
+        return content_cache.ContentCache(os.path.join(Main.root, "cache", "staticdb"))
+
+    @classmethod
+    def cache_key(cls, stage):
+        # everything a finished static analysis db depends on
+        labels = [(l.__class__.__name__, l.filename, l.lineno, l.name, l.value)
+                  for l in cls._get_src_labels() if l.stagename == stage.stagename]
+        longwrites = [(r.name, r.dregs, r.calcregs, r.subreg,
+                       r.writetype, r.interval, r.inplace)
+                      for r in stage.longwrites]
+        relocs = []
+        for r in stage.reloc_descrs:
+            path = Main.populate_from_config(r.path)
+            relocs.append((r.name, r.generator, pure_utils.file_md5(path)))
+        return content_cache.ContentCache.key(cls.cache_version,
+                                              pure_utils.file_md5(stage.elf),
+                                              sorted(labels),
+                                              sorted(longwrites),
+                                              sorted(relocs))
 
     @classmethod
     def get_relocation_information(cls, stage):
@@ -1161,8 +1259,8 @@ class WriteSearch():
 
 
     def create_stageexit_table(self):
-        self.stageexits = self.h5file.create_table(self.group, 'stageexits',
-                                                   StageExitInfo, "stage exit info")
+        self.stageexits = pytable_utils.create_table(self.h5file, self.group, 'stageexits',
+                                                     StageExitInfo, "stage exit info")
         sls = WriteSearch.find_labels(labeltool.StageinfoLabel, "EXIT", self.stage, "")
         r = self.stageexits.row
         for l in sls:
@@ -1181,8 +1279,8 @@ class WriteSearch():
         self.stageexits.flush()
 
     def create_relocs_table(self):
-        self.relocstable = self.h5file.create_table(self.group,
-                                                    'relocs', RelocInfo, "relocation information")
+        self.relocstable = pytable_utils.create_table(self.h5file, self.group,
+                                                      'relocs', RelocInfo, "relocation information")
         infos = WriteSearch.get_relocation_information(self.stage)
         i = 0
         for info in infos:
@@ -1198,40 +1296,30 @@ class WriteSearch():
                 print self.reloc_row_info(r)
             r.append()
         self.relocstable.flush()
-        self.relocstable.cols.startaddr.create_index(kind='full')
-        self.relocstable.cols.relocpc.create_index(kind='full')
-        self.relocstable.cols.cardinal.create_index(kind='full')
-        self.relocstable.flush()
         self.h5file.flush()
 
     def closedb(self, flushonly=True):
-        try:
-            self.writestable.reindex_dirty()
-        except AttributeError:
-            pass
-        try:
-            self.smcstable.reindex_dirty()
-        except AttributeError:
-            pass
-        try:
-            self.srcstable.reindex_dirty()
-        except AttributeError:
-            pass
-        try:
-            self.funcstable.reindex_dirty()
-        except AttributeError:
-            pass
+        if self.readonly:
+            if not flushonly:
+                self._closetables()
+            return
+        pytable_utils.build_file_indexes(self.h5file)
         if flushonly:
             self.h5file.flush()
         else:
-            self.h5file.close()
-            self.writestable = None
-            self.smcstable = None
-            self.srcstable = None
-            self.funcstable = None
-            self.relocstable = None
-            self.longwritestable = None
-            self.stageexits = None
+            self._closetables()
+
+    def _closetables(self):
+        self.h5file.close()
+        self.writestable = None
+        self.smcstable = None
+        self.srcstable = None
+        self.funcstable = None
+        self._funcindex = None
+        self._snapshot = None
+        self.relocstable = None
+        self.longwritestable = None
+        self.stageexits = None
 
     def _get_addr_info(self, addr):
         WriteSearch.get_addr_info(addr,
@@ -1257,11 +1345,13 @@ class WriteSearch():
 
         print "srcs --"
         rows = pytable_utils.get_rows(srcs, "addr == 0x%x" % addr)
+        rows = [pytable_utils.row_dict(srcs, r) for r in rows]
         map(lambda r: pytable_utils._print(cls.src_row_info(r)), rows)
 
         print "funcs --"
         rows = pytable_utils.get_rows(funcs,
                                       "(startaddr <= 0x%x) & (0x%x < endaddr)" % (addr, addr))
+        rows = [pytable_utils.row_dict(funcs, r) for r in rows]
         map(lambda r: pytable_utils._print(cls.func_row_info(r)), rows)
 
         print "longwrites --"
@@ -1326,161 +1416,422 @@ class WriteSearch():
                 r['writesize'], r['interval'], r['thumb'], r['inplace'], rangetype
             )
     def is_arm(self):
-        elf = self.stage.elf
-        o = Main.shell.run_cmd("%sreadelf -h %s| grep Machine" % (Main.cc, elf))
-        o = o.split()
-        return o[1] == "ARM"
+        return elf_model.get(self.stage.elf).is_arm
         
 
+    def _static_analysis_jobs(self):
+        try:
+            return int(Main.get_runtime_config("static_analysis_jobs"))
+        except AttributeError:
+            return 1
+
+    def _linear_sweep(self):
+        return linear_sweep.LinearSweep(self.stage.elf,
+                                        pure_utils.get_section_headers(self.stage.elf),
+                                        self.thumbranges, self.armranges,
+                                        self.dataranges)
+
+    def disasm_window(self, addr, thumb):
+        # decoded instructions of the section holding addr, shared by
+        # every descriptor that looks at code there. None outside of the
+        # executable sections
+        if self._windowsweep is None:
+            self._windowsweep = self._linear_sweep()
+        sweep = self._windowsweep
+        i = sweep.section_index(addr)
+        if i >= len(sweep.sections):
+            return None
+        s = sweep.sections[i]
+        key = (s['address'], thumb)
+        if key not in self._windows:
+            md = self.ia.thumb if thumb else self.ia.arm
+
+            def run_end(a):
+                f = self.func_at_addr(a)
+                return f[0][2] if f else a + 64
+            self._windows[key] = linear_sweep.DisasmWindow(md, s['address'],
+                                                           sweep.section_bytes(s),
+                                                           run_end)
+        return self._windows[key]
+
+    def disasm_at(self, addr, thumb):
+        w = self.disasm_window(addr, thumb)
+        return w.at(addr) if w else None
+
+    def code_src_rows(self, addrs, thumb):
+        # srcs rows of the instructions at addrs that lie inside a
+        # function, decoded from the elf's bytes
+        if self._funcindex is None:
+            self._funcindex = FuncIndex(self.funcstable)
+        hits = []
+        for (addr, fname) in zip(addrs, self._funcindex.names_at(addrs)):
+            ins = self.disasm_at(addr, thumb) if fname else None
+            if ins is not None:
+                hits.append((ins, thumb))
+            elif self.verbose:
+                print "no instruction at 0x%x" % addr
+        return add_src_lines(self.stage, src_rows(hits))
+
+    def _write_shards(self, sweep, jobs):
+        # cut each executable section along function boundaries, keeping
+        # the sections in header order so results merge in the same
+        # order as a serial sweep
+        fns = [addr & ~1 for (name, addr) in utils.get_c_function_names(self.stage)]
+        shards = []
+        for (lo, hi) in sweep.section_ranges():
+            shards.extend(linear_sweep.split_range(lo, hi, fns, jobs * 4))
+        return shards
+
+    def _full_shards(self, sweep, jobs):
+        if jobs > 1:
+            return self._write_shards(sweep, jobs)
+        else:
+            return [(None, None)]
+
+    def _sweep(self, sweep, shards, jobs):
+        # writes, smcs and srcs rows of every shard, in shard order
+        if (jobs > 1) and (len(shards) > 1):
+            pool = multiprocessing.Pool(jobs, _init_sweep_worker,
+                                        (sweep.elf, sweep.sections, sweep.code(),
+                                         sweep.thumbranges, sweep.armranges,
+                                         sweep.dataranges, self.verbose))
+            try:
+                results = pool.map(_sweep_worker, shards, 1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [sweep_range(sweep, self.ia, lo, hi, self.verbose)
+                       for (lo, hi) in shards]
+        (writes, smcs, srcs) = ([], [], [])
+        for (w, m, s) in results:
+            writes.extend(w)
+            smcs.extend(m)
+            srcs.extend(s)
+        # each shard's srcs come from the stores then the smcs
+        sort_by_section(sweep, srcs, 'addr')
+        return (writes, smcs, add_src_lines(self.stage, srcs))
+
+    def _incremental_base(self):
+        # elf and static analysis db of the earlier instance to carry
+        # unchanged functions over from, if there is one
+        try:
+            base = Main.get_runtime_config("static_analysis_base")
+        except AttributeError:
+            return None
+        if not base:
+            return None
+        elf = os.path.join(base, "images", os.path.basename(self.stage.elf))
+        db = os.path.join(base, "static_analysis", self.stage.stagename,
+                          "static-analysis.h5")
+        if not (os.path.exists(elf) and os.path.exists(db + "-completed")):
+            print "no static analysis of %s in %s, analyzing every function" % \
+                (self.stage.stagename, base)
+            return None
+        return (elf, db)
+
+    @classmethod
+    def _function_code(cls, elf):
+        # {name: (value, size, bytes)} for each function symbol with a
+        # unique name
+        fns = {}
+        dups = set()
+        for (name, value, size) in utils.get_function_symbols(elf):
+            if name in fns:
+                dups.add(name)
+            fns[name] = (value, size)
+        for name in dups:
+            del fns[name]
+        code = linear_sweep.read_ranges(elf, pure_utils.get_section_headers(elf),
+                                        [(value & ~1, size)
+                                         for (value, size) in fns.itervalues()])
+        return {name: (value, size, code.get(value & ~1))
+                for (name, (value, size)) in fns.iteritems()}
+
+    def _unchanged_functions(self, oldelf):
+        # (name, start, oldstart, size) of functions with the same
+        # symbol, mode and bytes in oldelf, they may have moved
+        old = self._function_code(oldelf)
+        same = []
+        for (name, (value, size, code)) in self._function_code(self.stage.elf).iteritems():
+            if (code is None) or (name not in old):
+                continue
+            (oldvalue, oldsize, oldcode) = old[name]
+            if ((value & 1) == (oldvalue & 1)) and (size == oldsize) and \
+               (code == oldcode):
+                same.append((name, value & ~1, oldvalue & ~1, size))
+        # aliases of one function are carried over once, functions that
+        # only partly overlap each other get analyzed again
+        same.sort(key=lambda f: (f[1], f[3]))
+        clusters = []
+        for f in same:
+            if clusters and (f[1] < clusters[-1][-1][1] + clusters[-1][-1][3]):
+                clusters[-1].append(f)
+            else:
+                clusters.append([f])
+        return [c[0] for c in clusters
+                if len(set([f[1:] for f in c])) == 1]
+
+    def _incremental_sweep(self, sweep, jobs, base):
+        # copy the rows of functions that did not change since the base
+        # build, shifted to their new addresses, and sweep everything else
+        (oldelf, olddb) = base
+        h5file = tables.open_file(olddb, mode="r")
+        try:
+            group = h5file.get_node("/staticanalysis")
+            if getattr(group._v_attrs, "cache_version", None) != self.cache_version:
+                print "static analysis in %s is from an older version, " \
+                    "analyzing every function" % olddb
+                return None
+            reused = self._unchanged_functions(oldelf)
+            (writes, smcs, srcs) = ([], [], [])
+            for (name, start, oldstart, size) in reused:
+                delta = start - oldstart
+                writes.extend(_shifted_rows(group.writes, "pc", [], oldstart, size, delta))
+                smcs.extend(_shifted_rows(group.smcs, "pc", [], oldstart, size, delta))
+                srcs.extend(_shifted_rows(group.srcs, "addr", [], oldstart, size, delta))
+        finally:
+            h5file.close()
+        # the code is the same but the lines it came from may not be
+        lines = utils.addr2lines([r['addr'] for r in srcs], self.stage)
+        for (r, line) in zip(srcs, lines):
+            if line != r['line']:
+                r['line'] = line
+                r['src'] = utils.line2src(line)
+        kept = sorted([(start, start + size) for (name, start, oldstart, size) in reused])
+        shards = []
+        for (lo, hi) in sweep.section_ranges():
+            cur = lo
+            for (start, end) in kept:
+                if (end <= cur) or (start >= hi):
+                    continue
+                if start > cur:
+                    shards.append((cur, start))
+                cur = end
+            if cur < hi:
+                shards.append((cur, hi))
+        print "%s: reusing %d functions from %s, analyzing %d ranges" % \
+            (self.stage.stagename, len(reused), olddb, len(shards))
+        (w, m, s) = self._sweep(sweep, shards, jobs)
+        writes.extend(w)
+        smcs.extend(m)
+        srcs.extend(s)
+        sort_by_section(sweep, writes, 'pc')
+        sort_by_section(sweep, smcs, 'pc')
+        sort_by_section(sweep, srcs, 'addr')
+        provenance = [{'fname': name, 'startaddr': start, 'endaddr': start + size,
+                       'oldstartaddr': oldstart}
+                      for (name, start, oldstart, size) in reused]
+        provenance.sort(key=lambda r: r['startaddr'])
+        return (writes, smcs, srcs, provenance)
+
     def create_writes_table(self, start=0, stop=0):
-        self.writestable = self.h5file.create_table(self.group, 'writes',
-                                                    WriteEntry,
-                                                    "statically determined pc \
-                                                    values for write instructions")
-        self.smcstable = self.h5file.create_table(self.group, 'smcs', SmcEntry,
-                                                  "statically determined pc values \
-                                                  for smc instructions")
-        self.srcstable = self.h5file.create_table(self.group, 'srcs',
-                                                  SrcEntry, "source code info")
-        self.funcstable = self.h5file.create_table(self.group, 'funcs',
-                                                   FuncEntry, "function info")        
+        self.writestable = pytable_utils.create_table(self.h5file, self.group, 'writes',
+                                                      WriteEntry,
+                                                      "statically determined pc \
+                                                      values for write instructions")
+        self.smcstable = pytable_utils.create_table(self.h5file, self.group, 'smcs', SmcEntry,
+                                                    "statically determined pc values \
+                                                    for smc instructions")
+        self.srcstable = pytable_utils.create_table(self.h5file, self.group, 'srcs',
+                                                    SrcEntry, "source code info")
+        self.funcstable = pytable_utils.create_table(self.h5file, self.group, 'funcs',
+                                                     FuncEntry, "function info")
+        self.provenancetable = pytable_utils.create_table(self.h5file, self.group, 'provenance',
+                                                          ProvenanceEntry,
+                                                          "functions carried over \
+                                                          from an earlier build")
+        self.group._v_attrs.cache_version = self.cache_version
+        self.group._v_attrs.base_elf_md5 = ""
+        self.create_funcs_table()
         # now look at instructions
         if not self.is_arm():
             return
-        srcdir = Main.get_runtime_config("temp_target_src_dir")
-        # objdump doesnt print 'stl', but search for it just in case
-        # writes = re.compile("(push)|(stm)|(str)|(stl)")
-        smcvals = ["e1600070", "e1600071"]
-        smcmne = 'smc'
-        r = self.writestable.row
-        smcr = self.smcstable.row
-        sections = r2.get(self.stage.elf, "iSj")
-        for s in sections:
-            for pc in range(s["vaddr"], s["vaddr"] + s["size"]):
-                insadded = False
-                mne = ''
-                dis = ''
-                ins = ''
-                fname = ''
-                thumb = False
-                if (start > 0) and (stop > 0):
-                    if (pc < start) or (stop <= pc):
-                        continue
-                r2.get(self.stage.elf, "s 0x%x" % pc)
-                ins_info = r2.get(self.stage.elf, "pdj 1")[0]
-                if not "disasm" in ins_info:
-                    #print ins_info
-                    mne = None
-                else:
-                    dis = ins_info['disasm']
-                    val = ins_info['bytes']
-                    mne = dis.split()[0]
-                # print mne
-                if mne and self.ia.is_mne_memstore(mne):
-                    if self.dataranges.overlaps_point(pc):
-                        continue  # test here because some of the smcs are in data ranges
-                    thumb = False
-                    if self.thumbranges.overlaps_point(pc):
-                        thumb = True
-                    r['thumb'] = thumb
-                    ins = val.decode('hex')
-                    if not thumb or (thumb and len(ins) <= 2):
-                        ins = b"%s" % ins #% ins[::-1]  # reverse bytes
-                    else:
-                        # # reverse words and then bytes within words
-                        # words = line[1].split()
-                        # words = [w.decode('hex')[::-1] for w in words]
-                        # # don't want it to wrip out any null bytes
-                        # ins = b"%s%s" % (words[0], words[1])
-                        ins = b"%s" % ins #% ins[::-1]
-
-                    inscheck = self.ia.disasm(ins, thumb, pc)
-                    r['pc'] = pc
-                    r['halt'] = True
-
-                    # double check capstone is ok with this assembly
-                    if not self.ia.is_mne_memstore(inscheck.mnemonic):
-                        print "fail %s %s" % (inscheck.mnemonic, inscheck.op_str)
-                        print "addr: %x" % pc
-                        print ins_info
-                        sys.exit(-1)
-                    else:
-                        regs = self.ia.needed_regs(inscheck)
-                        if len(regs) > 4:
-                            print "woops too many registers!"
-                            raise Exception("too many registers or sometin")
-                        for i in range(len(regs)):
-                            r['reg%d' % i] = regs[i]
-                        size = self.ia.calculate_store_size(inscheck)
-
-                        r['writesize'] = size
-                        insadded = True
-
-                    r.append()
-                elif (mne == smcmne) or (val in smcvals):  # add to smcs table
-                    ins = b"%s" % ins #% ins[::-1]
-                    # ins = (''.join(line[1].split())).decode('hex')[::-1]  # reverse bytes
-                    smcr['pc'] = pc
-                    mne = 'smc'
-                    thumb = False
-                    if self.thumbranges.overlaps_point(pc):
-                        thumb = True
-                    smcr['thumb'] = thumb
-                    insadded = True
-                    smcr.append()
-                    if self.verbose:
-                        print "smc at 0x%x" % pc
-                if insadded:
-                    s = self.srcstable.where("addr == 0x%x" % (pc))
-                    try:
-                        s = next(s)
-                        # do nothing
-                    except StopIteration:                        
-                        srcr = self.srcstable.row
-                        srcr['addr'] = pc
-                        srcr['line'] = utils.addr2line(pc, self.stage)
-                        srcr['src'] = utils.line2src(srcr['line'])
-                        srcr['ivalue'] = ins
-                        srcr['ilength'] = len(ins)
-                        srcr['thumb'] = thumb
-                        srcr['disasm'] = dis
-                        srcr['mne'] = mne
-                        srcr.append()
-                        self.srcstable.flush()
-                    f = self.funcstable.where("(startaddr <= 0x%x) & (0x%x < endaddr)" % (pc, pc))
-                    try:
-                        f = next(f)
-                        # do nothing
-                    except StopIteration:
-                        more = r2.get(self.stage.elf, "afij.")
-                        if not len(more) == 1:
-                            continue
-                        fnname = more['name']
-                        if fnname.stargswith("sym."):
-                            fnname = fnname[4:]
-                        if len(fname) > 0:
-                            size = more['size']
-                            funcsr = self.funcstable.row
-                            funcsr['fname'] = fname
-                            startaddr = startaddr
-                            endaddr = startaddr + size
-                            funcsr['startaddr'] = startaddr
-                            funcsr['endaddr'] = endaddr
-                            funcsr.append()
-                            self.funcstable.flush()
-
-                    insadded = False
-
-        self.writestable.flush()
-        self.writestable.cols.pc.create_index(kind='full')
+        sweep = self._linear_sweep()
+        jobs = self._static_analysis_jobs()
+        provenance = []
+        incremental = None
+        if (start > 0) and (stop > 0):
+            (writes, smcs, srcs) = self._sweep(sweep, [(start, stop)], jobs)
+        else:
+            base = self._incremental_base()
+            if base:
+                incremental = self._incremental_sweep(sweep, jobs, base)
+            if incremental:
+                (writes, smcs, srcs, provenance) = incremental
+                self.group._v_attrs.base_elf_md5 = pure_utils.file_md5(base[0])
+            else:
+                (writes, smcs, srcs) = self._sweep(sweep,
+                                                   self._full_shards(sweep, jobs),
+                                                   jobs)
+        pytable_utils.append_rows(self.writestable, writes)
+        pytable_utils.append_rows(self.smcstable, smcs)
+        pytable_utils.append_rows(self.srcstable, srcs)
+        pytable_utils.append_rows(self.provenancetable, provenance)
+        self.provenancetable.flush()
         self.writestable.flush()
         self.smcstable.flush()
-        self.smcstable.cols.pc.create_index(kind='full')
-        self.smcstable.flush()
-        self.srcstable.cols.addr.create_index(kind='full')
-        self.srcstable.cols.line.create_index(kind='full')
         self.srcstable.flush()
-        self.funcstable.cols.startaddr.create_index(kind='full')
-        self.funcstable.cols.endaddr.create_index(kind='full')
-        self.smcstable.flush()
         self.h5file.flush()
+
+    def create_funcs_table(self):
+        # every function symbol in one go
+        funcs = [{'fname': name, 'startaddr': start, 'endaddr': end}
+                 for (name, start, end) in elf_model.get(self.stage.elf).function_ranges()]
+        pytable_utils.append_rows(self.funcstable, funcs)
+        self.funcstable.flush()
+        self._funcindex = None
+
+    def func_at_addr(self, addr):
+        if self._funcindex is None:
+            self._funcindex = FuncIndex(self.funcstable)
+        return self._funcindex.at(addr)
+
+    def snapshot(self):
+        # None unless the db was opened read only
+        if not self.readonly:
+            return None
+        if self._snapshot is None:
+            self._snapshot = static_snapshot.StaticSnapshot.open(
+                self, self.sidecar_path(),
+                static_snapshot._stamp(self.dbpath, self.cache_version))
+        return self._snapshot
+
+    def sidecar_path(self):
+        return "%s.idx" % os.path.splitext(self.dbpath)[0]
+
+    def drop_snapshot(self):
+        # after rows get added
+        self._snapshot = None
+
+    def check_writes_table(self):
+        # redo a full sweep and compare it with the writes, smcs and
+        # srcs tables, and check that the store prefilter let every
+        # store and smc through. Returns a description of each difference
+        if not self.is_arm():
+            return []
+        sweep = self._linear_sweep()
+        jobs = self._static_analysis_jobs()
+        expected = self._sweep(sweep, self._full_shards(sweep, jobs), jobs)
+
+        def wanted(mne, kind):
+            if mne == 'smc':
+                return True
+            return self.ia.is_mne_memstore(mne) and (kind != linear_sweep.LinearSweep.DATA)
+        bad = ["instruction at 0x%x missed by the store prefilter" % pc
+               for pc in sweep.missed(wanted)]
+        for (table, rows, col) in zip([self.writestable, self.smcstable, self.srcstable],
+                                      expected, ["pc", "pc", "addr"]):
+            found = table.read()
+            rows = pytable_utils.rows_array(table, rows, False)
+            if len(found) != len(rows):
+                bad.append("%s has %d rows, a full analysis finds %d" %
+                           (table.name, len(found), len(rows)))
+                continue
+            for i in numpy.nonzero(found != rows)[0]:
+                bad.append("%s row for 0x%x differs" % (table.name, rows[i][col]))
+        return bad
+
+
+def sweep_range(sweep, ia, start, stop, verbose=False):
+    # returns the writes, smcs and srcs rows for instructions in [start,
+    # stop), the srcs rows without their lines (see add_src_lines)
+    writes = []
+    hits = []
+    # only instructions whose encoding might be a store get decoded,
+    # already in detail mode
+    for (ins, kind) in sweep.candidates(start, stop):
+        if not ia.is_mne_memstore(ins.mnemonic):
+            continue
+        pc = ins.address
+        thumb = kind == linear_sweep.LinearSweep.THUMB
+        regs = ia.needed_regs(ins)
+        if len(regs) > 4:
+            print "woops too many registers!"
+            raise Exception("too many registers or sometin")
+        row = {'pc': pc,
+               'thumb': thumb,
+               'halt': True,
+               'writesize': ia.calculate_store_size(ins)}
+        row.update(ia.store_recipe(ins))
+        for i in range(len(regs)):
+            row['reg%d' % i] = regs[i]
+        writes.append(row)
+        hits.append((ins, thumb))
+    smcs = find_smcs(sweep, start, stop, verbose)
+    hits.extend(smcs)
+    smcs = [{'pc': ins.address, 'thumb': thumb} for (ins, thumb) in smcs]
+    return (writes, smcs, src_rows(hits))
+
+
+def find_smcs(sweep, start, stop, verbose=False):
+    # (instruction, thumb) of each smc in [start, stop), data ranges
+    # included, found in a pass of its own
+    smcs = []
+    for (ins, kind) in sweep.smcs(start, stop):
+        if not ins.mnemonic == 'smc':
+            continue
+        smcs.append((ins, sweep.thumbranges.overlaps_point(ins.address)))
+        if verbose:
+            print "smc at 0x%x" % ins.address
+    return smcs
+
+
+def src_rows(hits):
+    # srcs rows of the (instruction, thumb) in hits, without their lines
+    return [{'addr': ins.address,
+             'ivalue': bytes(ins.bytes),
+             'ilength': ins.size,
+             'thumb': thumb,
+             'disasm': "%s %s" % (ins.mnemonic, ins.op_str),
+             'mne': ins.mnemonic}
+            for (ins, thumb) in hits]
+
+
+def add_src_lines(stage, srcs):
+    # srcs with the line and source of each one's addr, looking all of
+    # them up at once
+    lines = utils.addr2lines([r['addr'] for r in srcs], stage)
+    for (r, line) in zip(srcs, lines):
+        r['line'] = line
+        r['src'] = utils.line2src(line)
+    return srcs
+
+
+def sort_by_section(sweep, rows, col):
+    # in the order a full sweep visits addresses
+    rows.sort(key=lambda r: (sweep.section_index(r[col]), r[col]))
+
+
+def _shifted_rows(table, col, others, start, size, delta):
+    # rows of table with col in [start, start + size) as dicts, with col
+    # and others moved by delta
+    rows = []
+    found = table.read_where("(%s >= start) & (%s < end)" % (col, col),
+                             {'start': start, 'end': start + size})
+    for r in found:
+        d = pytable_utils.decode_row(table, dict(zip(found.dtype.names, r)))
+        for c in [col] + others:
+            d[c] = int(d[c]) + delta
+        rows.append(d)
+    return rows
+
+
+_sweep_worker_state = {}
+
+
+def _init_sweep_worker(elf, sections, code, thumbranges, armranges, dataranges, verbose):
+    # workers only decode, from the section bytes the parent already
+    # read, each with its own capstone handles rather than the ones
+    # inherited from the parent process. Lines get looked up in the
+    # parent afterwards
+    _sweep_worker_state['sweep'] = linear_sweep.LinearSweep(elf, sections, thumbranges,
+                                                            armranges, dataranges, code)
+    _sweep_worker_state['ia'] = InstructionAnalyzer()
+    _sweep_worker_state['verbose'] = verbose
+
+
+def _sweep_worker(shard):
+    (lo, hi) = shard
+    return sweep_range(_sweep_worker_state['sweep'], _sweep_worker_state['ia'], lo, hi,
+                       _sweep_worker_state['verbose'])
@@ -30,7 +30,6 @@ import tables
 import intervaltree
 import pytable_utils
 import run_cmd
-import StringIO
 import pickle
 from collections import Iterable
 from config import Main
@@ -41,6 +40,7 @@ import db_info
 import pymacs_request
 import testsuite_utils as utils
 import addr_space
+import elf_model
 def int_repr(self):
     return "({0:08X}, {1:08X})".format(self.begin, self.end)
 
@@ -59,6 +59,7 @@ vlist = ['rw', 'r', 'w', 'none', '?']
 perms = tables.Enum(vlist + ["rwx", "x", "rx"])
 
 
+@pytable_utils.indexes('short_name', 'parent_name')
 class MemoryRegionInfo(tables.IsDescription):
     short_name = tables.StringCol(255)
     parent_name = tables.StringCol(255)
@@ -69,17 +70,20 @@ class MemoryRegionInfo(tables.IsDescription):
     do_print = tables.BoolCol()
 
 
+@pytable_utils.indexes('short_name', 'startaddr', 'endaddr')
 class MemoryRegionAddrs(tables.IsDescription):
     short_name = tables.StringCol(255)
     startaddr = tables.UInt32Col()
     endaddr = tables.UInt32Col()
 
 
+@pytable_utils.indexes('reloc_name', 'substagenum')
 class SubstageRelocInfo(tables.IsDescription):
     substagenum = tables.UInt8Col()
     reloc_name = tables.StringCol(128)
 
 
+@pytable_utils.indexes('substagenum', 'short_name')
 class SubstageRegionPolicy(tables.IsDescription):
     default_perms = tables.EnumCol(perms,
                                    'rwx', base='uint8')
@@ -102,6 +106,7 @@ class SubstageContents(tables.IsDescription):
     functionname = tables.StringCol(255, pos=2)
 
 
+@pytable_utils.indexes('substagenum', 'functionname')
 class SubstageEntry(tables.IsDescription):
     substagenum = tables.UInt8Col(pos=1)
     functionname = tables.StringCol(255)
@@ -179,35 +184,23 @@ class SubstagesInfo():
             self.populate_write_interval_table()
 
     def _create_var_table(self, substage=-1):
-        fields = ["startaddr", "size", "kind", "name"]
         vtab = self.var_table
         if vtab.nrows > 0:
             return
-        cc = Main.cc
-        stage = self.stage
-        sname = stage.stagename
-        elf = stage.elf
-        cmd = "%snm -n -S %s" % (cc, elf)
-        f = StringIO.StringIO(Main.shell.run_cmd(cmd))
-        reader = csv.DictReader(f, fields, delimiter=" ",
-                                lineterminator="\n", skipinitialspace=True)
         row = vtab.row
-        for r in reader:
-            if r['name'] is None:
-                continue  # this means there is no listed size
+        for s in elf_model.get(self.stage.elf).sized_symbols():
+            row['name'] = s.name
+            row['startaddr'] = s.addr
+            row['endaddr'] = s.addr + s.size
+            row['rawkind'] = s.kind
+            k = row['rawkind'].lower()
+            if ('t' == k) or ('w' == k):
+                row['kind'] = getattr(addr_space.var_type, 'text')
             else:
-                row['name'] = r['name'].strip()
-                row['startaddr'] = int(r['startaddr'].strip(), 16)
-                row['endaddr'] = row['startaddr'] + int(r['size'].strip(), 16)
-                row['rawkind'] = r['kind'].strip()
-                k = row['rawkind'].lower()
-                if ('t' == k) or ('w' == k):
-                    row['kind'] = getattr(addr_space.var_type, 'text')
-                else:
-                    row['kind'] = getattr(addr_space.var_type, 'staticvar')
-                row['perms'] = getattr(addr_space.var_perms, 'rw')
-                row['substage'] = substage
-                row.append()
+                row['kind'] = getattr(addr_space.var_type, 'staticvar')
+            row['perms'] = getattr(addr_space.var_perms, 'rw')
+            row['substage'] = substage
+            row.append()
         vtab.flush()
 
     def print_var_table(self):
@@ -395,11 +388,12 @@ class SubstagesInfo():
                     row.append()
                 fopen.close()
         self.contents_table.flush()
-        self.contents_table.cols.substagenum.reindex()
 
     def close_dbs(self, flush_only=False):
         if self.h5mmap is None:
             return
+        pytable_utils.build_file_indexes(self.h5mmap)
+        pytable_utils.build_file_indexes(self.h5file)
         self.h5mmap.flush()
         if not flush_only:
             self.h5mmap.close()
@@ -493,7 +487,8 @@ class SubstagesInfo():
             longname = ' (%s)' % longname if longname else ''
             addrs = []
             numaddrs = - 0
-            for a in [r for r in addr.read_sorted('startaddr') if r['short_name'] == name]:
+            for a in [r for r in pytable_utils.get_sorted(addr, 'startaddr')
+                      if r['short_name'] == name]:
                 if numaddrs > 7:
                     addrs.append('...')
                     break
@@ -629,10 +624,6 @@ class SubstagesInfo():
                         raise Exception("could not find symbol named %s" % v)
         policy_table.flush()
 
-        policy_table.cols.substagenum.reindex()
-        policy_table.cols.short_name.reindex()
-        policy_table.flush()
-
 
     @classmethod
     def calculate_name_from_files(cls, f, f2):
@@ -658,8 +649,6 @@ class SubstagesInfo():
                 r['substagenum'] = n
                 r['reloc_name'] = relname
                 r.append()
-        reloc_table.cols.reloc_name.reindex()
-        reloc_table.cols.substagenum.reindex()
         reloc_table.flush()
 
     def populate_substage_info_table(self, ss_info, info_table):
@@ -675,9 +664,6 @@ class SubstagesInfo():
             info_row['substage_type'] = getattr(substage_types, s.substage_type)
             info_row.append()
         info_table.flush()
-        info_table.cols.substagenum.reindex()
-        info_table.cols.functionname.reindex()
-        info_table.flush()
 
     def populate_mmap_tables(self, mmap_info, info_table, addr_table):
         info_row = info_table.row
@@ -702,14 +688,6 @@ class SubstagesInfo():
                 addr_row['endaddr'] = a.end
                 addr_row.append()
         info_table.flush()
-
-        info_table.cols.short_name.reindex()
-        info_table.cols.parent_name.reindex()
-        info_table.flush()
-        addr_table.flush()
-        addr_table.cols.short_name.reindex()
-        addr_table.cols.startaddr.reindex()
-        addr_table.cols.endaddr.reindex()
         addr_table.flush()
 
     def print_intervals(self):
@@ -751,13 +729,14 @@ class SubstagesInfo():
                 self.h5group = self.h5file.get_node('/%s' % groupname)
 
             if not hasattr(self.h5group, 'substagecontents'):
-                self.contents_table = self.h5file.create_table(
-                    self.h5group, 'substagecontents', SubstageContents, "substage contents")
+                self.contents_table = pytable_utils.create_table(
+                    self.h5file, self.h5group, 'substagecontents', SubstageContents,
+                    "substage contents")
             else:
                 self.contents_table = self.h5group.substagecontents
             if not hasattr(self.h5group, 'writeintervals'):
-                self.trace_intervals_table = self.h5file.create_table(
-                    self.h5group, 'writeintervals', SubstageWriteIntervals, "")
+                self.trace_intervals_table = pytable_utils.create_table(
+                    self.h5file, self.h5group, 'writeintervals', SubstageWriteIntervals, "")
             else:
                 self.trace_intervals_table = self.h5group.writeintervals
         mmap_db_path = Main.get_policy_config("db", self.stage)
@@ -772,50 +751,39 @@ class SubstagesInfo():
             self.mmap_created = False
 
         if not hasattr(self.h5mmapgroup, self.mmap_info_table_name):
-            self.substage_mmap_info_table = self.h5mmap.create_table(
-                "/" + self.mmapgroupname(), self.mmap_info_table_name,
+            self.substage_mmap_info_table = pytable_utils.create_table(
+                self.h5mmap, "/" + self.mmapgroupname(), self.mmap_info_table_name,
                 MemoryRegionInfo, "")
-            self.substage_mmap_info_table.cols.short_name.create_index(kind="full")
-            self.substage_mmap_info_table.cols.parent_name.create_index(kind="full")
         else:
             self.substage_mmap_info_table = getattr(self.h5mmapgroup, self.mmap_info_table_name)
 
         if not hasattr(self.h5mmapgroup, self.mmap_addr_table_name):
-            self.substage_mmap_addr_table = self.h5mmap.create_table(
-                "/" + self.mmapgroupname(), self.mmap_addr_table_name,
+            self.substage_mmap_addr_table = pytable_utils.create_table(
+                self.h5mmap, "/" + self.mmapgroupname(), self.mmap_addr_table_name,
                 MemoryRegionAddrs, "")
-            self.substage_mmap_addr_table.cols.short_name.create_index(kind="full")
-            self.substage_mmap_addr_table.cols.startaddr.create_index(kind="full")
-            self.substage_mmap_addr_table.cols.endaddr.create_index(kind="full")
         else:
             self.substage_mmap_addr_table = getattr(self.h5mmapgroup, self.mmap_addr_table_name)
 
         if not hasattr(self.h5mmapgroup, self.info_table_name):
-            self.substage_info_table = self.h5mmap.create_table(
-                "/" + self.mmapgroupname(),
+            self.substage_info_table = pytable_utils.create_table(
+                self.h5mmap, "/" + self.mmapgroupname(),
                 self.info_table_name,
                 SubstageEntry, "")
-            self.substage_info_table.cols.substagenum.create_index(kind="full")
-            self.substage_info_table.cols.functionname.create_index(kind="full")
         else:
             self.substage_info_table = getattr(self.h5mmapgroup, self.info_table_name)
 
         if not hasattr(self.h5mmapgroup, self.region_policy_table_name):
-            self.substage_region_policy_table = self.h5mmap.create_table(
-                "/" + self.mmapgroupname(), self.region_policy_table_name,
+            self.substage_region_policy_table = pytable_utils.create_table(
+                self.h5mmap, "/" + self.mmapgroupname(), self.region_policy_table_name,
                 SubstageRegionPolicy, "")
-            self.substage_region_policy_table.cols.substagenum.create_index(kind="full")
-            self.substage_region_policy_table.cols.short_name.create_index(kind="full")
         else:
             self.substage_region_policy_table = getattr(self.h5mmapgroup,
                                                         self.region_policy_table_name)
 
         if not hasattr(self.h5mmapgroup, self.substage_reloc_table_name):
-            self.substage_reloc_info_table = self.h5mmap.create_table(
-                "/" + self.mmapgroupname(), self.substage_reloc_table_name,
+            self.substage_reloc_info_table = pytable_utils.create_table(
+                self.h5mmap, "/" + self.mmapgroupname(), self.substage_reloc_table_name,
                 SubstageRelocInfo, "")
-            self.substage_reloc_info_table.cols.reloc_name.create_index(kind="full")
-            self.substage_reloc_info_table.cols.substagenum.create_index(kind="full")
         else:
             self.substage_reloc_info_table = getattr(self.h5mmapgroup,
                                                      self.substage_reloc_table_name)
@@ -825,13 +793,9 @@ class SubstagesInfo():
             self.var_table = getattr(self.h5mmapgroup, self._var_tablename())
 
     def __create_var_table(self):
-            self.var_table = self.h5mmap.create_table(self.h5mmapgroup,
-                                                      self._var_tablename(),
-                                                      addr_space.VarEntry, "")
-            vtab = self.var_table
-            vtab.cols.startaddr.create_index(kind='full')
-            vtab.cols.endaddr.create_index(kind='full')
-            vtab.cols.substage.create_index(kind='full')
+            self.var_table = pytable_utils.create_table(self.h5mmap, self.h5mmapgroup,
+                                                        self._var_tablename(),
+                                                        addr_space.VarEntry, "")
 
     def allowed_writes(self, substage):
         n = substage
@@ -0,0 +1,323 @@
+# MIT License
+
+# Copyright (c) 2017 Rebecca ".bx" Shapiro
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import random
+import struct
+
+# instruction encodings the generated functions are made of, as
+# (encoding, number of bytes). Thumb 32 bit encodings are listed as
+# their two halfwords
+arm_stores = [0xE5801000, 0xE5C01004, 0xE1C010B2, 0xE8800006, 0xE7802103, 0xE1C020F8]
+arm_others = [0xE2800001, 0xE3A01007, 0xE5902004, 0xE3500003, 0xE2411001, 0xE1A03000]
+thumb_stores = [(0x6041,), (0x7081,), (0x8041,), (0x9101,), (0xF8C0, 0x1008)]
+thumb_others = [(0x3001,), (0x2107,), (0x6882,), (0x2803,), (0xBF00,), (0xF8D0, 0x1008)]
+arm_push = 0xE92D4010  # push {r4, lr}
+arm_pop = 0xE8BD8010  # pop {r4, pc}
+arm_smc = 0xE1600070
+thumb_push = (0xB510,)
+thumb_pop = (0xBD10,)
+thumb_nop = (0xBF00,)
+# str r1, [r0], #4; subs r2, r2, #1; bne back to the str
+arm_loop = [0xE4801004, 0xE2522001, 0x1AFFFFFC]
+# str r1, [r0]; adds r0, #4; subs r2, #1; bne back to the str
+thumb_loop = [(0x6001,), (0x3004,), (0x3A01,), (0xD1FB,)]
+
+EM_ARM = 40
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+
+
+def _uleb(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _sleb(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7f
+        n >>= 7
+        if ((n == 0) and not (b & 0x40)) or ((n == -1) and (b & 0x40)):
+            out.append(b)
+            return bytes(out)
+        out.append(b | 0x80)
+
+
+class _Strings():
+    # an elf string table
+    def __init__(self):
+        self.data = "\0"
+        self.offsets = {}
+
+    def add(self, s):
+        if s not in self.offsets:
+            self.offsets[s] = len(self.data)
+            self.data += s + "\0"
+        return self.offsets[s]
+
+
+# a bare metal ARM/Thumb ELF made up from scratch, with the C-like
+# source tree its line table points into and labels for the static
+# analysis to find in that source. Everything is decided by the
+# arguments, the same arguments always give the same files
+class SyntheticBuild():
+    stagename = "main"
+    compdir = "/synthetic"
+
+    def __init__(self, codesize=0x10000, store_density=0.2, thumb_fraction=0.5,
+                 nlabels=32, seed=0, base=0x40200000):
+        self.codesize = codesize
+        self.store_density = store_density
+        self.thumb_fraction = thumb_fraction
+        self.nlabels = nlabels
+        self.seed = seed
+        self.base = base
+        self.rand = random.Random(seed)
+        self.code = bytearray()
+        self.funcs = []  # (name, start, size, thumb)
+        self.mapping = []  # (addr, letter)
+        self.rows = []  # (start, end, [(addr, file, line)]) per function
+        self.files = []  # [lines] per source file
+        self.writes = []  # (pc, size) of each store
+        self.longwrites = []  # names of the functions with a store loop
+        self._generate()
+
+    def _emit(self, enc, thumb):
+        addr = self.base + len(self.code)
+        if thumb:
+            for h in enc:
+                self.code += struct.pack("<H", h)
+        else:
+            self.code += struct.pack("<I", enc)
+        return addr
+
+    def _align(self, thumb):
+        while len(self.code) % 4:
+            self._emit(thumb_nop, True)
+
+    def _label(self, typ, name, value):
+        return "#define ___%s_%s_%s_%s" % (typ, name, self.stagename, value)
+
+    def _labels_budget(self):
+        # one stage exit, a quarter of the rest on longwrites (two labels
+        # each), the others on skips, some of those whole functions
+        n = max(self.nlabels - 1, 0)
+        nlong = n // 8
+        n -= nlong * 2
+        nfunc = n // 9
+        nskip = (n - nfunc) // 2
+        return (nlong, nskip, nfunc)
+
+    def _generate(self):
+        r = self.rand
+        (nlong, nskip, nfunc) = self._labels_budget()
+        nfuncs = max(self.codesize // 128, 1)
+        kinds = ["long"] * nlong + ["skip"] * nskip + ["func"] * nfunc
+        kinds += [""] * max(nfuncs - len(kinds), 0)
+        r.shuffle(kinds)
+        kinds[0] = "exit" if kinds[0] == "" else kinds[0]
+        if "exit" not in kinds:
+            kinds.append("exit")
+        i = 0
+        while (len(self.code) < self.codesize) or (i < len(kinds)):
+            kind = kinds[i] if i < len(kinds) else ""
+            self._function(i, kind, r.random() < self.thumb_fraction)
+            i += 1
+
+    def _function(self, i, kind, thumb):
+        r = self.rand
+        name = "fn%d" % i
+        if i % 16 == 0:
+            self.files.append(["/* generated */"])
+        fileno = len(self.files)
+        lines = self.files[-1]
+        lines.append("void %s(void)" % name)
+        lines.append("{")
+        self._align(thumb)
+        start = self.base + len(self.code)
+        self.mapping.append((start, 't' if thumb else 'a'))
+        rows = []
+
+        def stmt(enc, text, labels=[]):
+            for l in labels:
+                lines.append(l)
+            lines.append("\t%s;" % text)
+            addr = self._emit(enc, thumb)
+            rows.append((addr, fileno, len(lines)))
+            return addr
+
+        labels = []
+        if kind == "func":
+            labels = [self._label("SKIP", name, "FUNC")]
+        elif kind == "exit":
+            labels = [self._label("STAGEINFO", "success", "EXIT")]
+        stmt(thumb_push if thumb else arm_push, "enter()", labels)
+        nbody = r.randint(6, 48)
+        (skiplo, skiphi) = sorted(r.sample(range(nbody), 2))
+        for j in range(nbody):
+            labels = []
+            if (kind == "skip") and (j == skiplo):
+                labels = [self._label("SKIP", name, "START")]
+            if (kind == "long") and (j == skiplo):
+                labels = [self._label("LONGWRITE", name, "BREAK")]
+                loop = thumb_loop if thumb else arm_loop
+                for (n, enc) in enumerate(loop):
+                    if n == len(loop) - 1:
+                        labels = [self._label("LONGWRITE", name, "CONT")]
+                    addr = stmt(enc, "loop%d()" % n, labels)
+                    labels = []
+                    if n == 0:
+                        self.writes.append((addr, 4))
+                self.longwrites.append(name)
+                continue
+            if r.random() < self.store_density:
+                enc = r.choice(thumb_stores if thumb else arm_stores)
+                addr = stmt(enc, "v[%d] = %d" % (j, j), labels)
+                self.writes.append((addr, 4))
+            elif (not thumb) and (r.random() < 0.002):
+                stmt(arm_smc, "smc()", labels)
+            else:
+                stmt(r.choice(thumb_others if thumb else arm_others), "x += %d" % j, labels)
+            if (kind == "skip") and (j == skiphi):
+                lines.append(self._label("SKIP", name, "END"))
+        stmt(thumb_pop if thumb else arm_pop, "leave()")
+        lines.append("}")
+        end = self.base + len(self.code)
+        self.funcs.append((name, start, end - start, thumb))
+        self.rows.append((start, end, rows))
+        if r.random() < 0.25:  # a literal pool
+            self._align(thumb)
+            self.mapping.append((self.base + len(self.code), 'd'))
+            for n in range(r.randint(1, 4)):
+                self.code += struct.pack("<I", r.getrandbits(32))
+
+    def source_paths(self):
+        # relative to the source root, in line table file number order
+        return [os.path.join("bench", "file%d.c" % n) for n in range(1, len(self.files) + 1)]
+
+    def source_files(self):
+        # {path relative to the source root: contents}
+        return {p: "\n".join(lines) + "\n"
+                for (p, lines) in zip(self.source_paths(), self.files)}
+
+    def write_source(self, root):
+        for (path, text) in self.source_files().iteritems():
+            path = os.path.join(root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as f:
+                f.write(text)
+
+    def _debug_line(self):
+        prog = ""
+        for (start, end, rows) in self.rows:
+            prog += "\x00" + _uleb(5) + "\x02" + struct.pack("<I", start)
+            (addr, fileno, line) = (start, 1, 1)
+            for (a, f, l) in rows:
+                if f != fileno:
+                    prog += "\x04" + _uleb(f)
+                if l != line:
+                    prog += "\x03" + _sleb(l - line)
+                if a != addr:
+                    prog += "\x02" + _uleb(a - addr)
+                prog += "\x01"
+                (addr, fileno, line) = (a, f, l)
+            prog += "\x02" + _uleb(end - addr) + "\x00" + _uleb(1) + "\x01"
+        files = "".join(["%s\0%s%s%s" % (p, _uleb(0), _uleb(0), _uleb(0))
+                         for p in self.source_paths()])
+        header = struct.pack("<BBbBB", 1, 1, -5, 14, 13) + \
+            struct.pack("<12B", 0, 1, 1, 1, 1, 0, 0, 0, 1, 0, 0, 1) + "\0" + files + "\0"
+        unit = struct.pack("<HI", 2, len(header)) + header + prog
+        return struct.pack("<I", len(unit)) + unit
+
+    def _debug_info(self):
+        abbrev = _uleb(1) + _uleb(0x11) + "\x00" + _uleb(0x10) + _uleb(0x06) + \
+            _uleb(0x1b) + _uleb(0x08) + _uleb(0x03) + _uleb(0x08) + "\x00\x00\x00"
+        die = _uleb(1) + struct.pack("<I", 0) + self.compdir + "\0" + "synthetic.c\0"
+        unit = struct.pack("<HIB", 2, 0, 4) + die
+        return (struct.pack("<I", len(unit)) + unit, abbrev)
+
+    def _symbols(self, strtab, textndx):
+        syms = [struct.pack("<IIIBBH", 0, 0, 0, 0, 0, 0)]
+        for (addr, letter) in self.mapping:
+            syms.append(struct.pack("<IIIBBH", strtab.add("$" + letter), addr, 0, 0, 0, textndx))
+        nlocal = len(syms)
+        for (name, start, size, thumb) in self.funcs:
+            syms.append(struct.pack("<IIIBBH", strtab.add(name), start | int(thumb), size,
+                                    (1 << 4) | 2, 0, textndx))
+        return ("".join(syms), nlocal)
+
+    def write_elf(self, path):
+        shstrtab = _Strings()
+        strtab = _Strings()
+        (info, abbrev) = self._debug_info()
+        (symtab, nlocal) = self._symbols(strtab, 1)
+        code = bytes(self.code)
+        # (name, type, flags, addr, data, link, info, align, entsize)
+        sections = [
+            (".text", SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR, self.base, code, 0, 0, 4, 0),
+            (".debug_abbrev", SHT_PROGBITS, 0, 0, abbrev, 0, 0, 1, 0),
+            (".debug_info", SHT_PROGBITS, 0, 0, info, 0, 0, 1, 0),
+            (".debug_line", SHT_PROGBITS, 0, 0, self._debug_line(), 0, 0, 1, 0),
+            (".symtab", SHT_SYMTAB, 0, 0, symtab, 6, nlocal, 4, 16),
+            (".strtab", SHT_STRTAB, 0, 0, None, 0, 0, 1, 0),
+            (".shstrtab", SHT_STRTAB, 0, 0, None, 0, 0, 1, 0),
+        ]
+        for s in sections:
+            shstrtab.add(s[0])
+        body = ""
+        offset = 0x1000
+        headers = [struct.pack("<10I", *([0] * 10))]
+        for (name, typ, flags, addr, data, link, sinfo, align, entsize) in sections:
+            if name == ".strtab":
+                data = strtab.data
+            elif name == ".shstrtab":
+                data = shstrtab.data
+            pad = (-(offset + len(body))) % align
+            body += "\0" * pad
+            headers.append(struct.pack("<10I", shstrtab.add(name), typ, flags, addr,
+                                       offset + len(body), len(data), link, sinfo,
+                                       align, entsize))
+            body += data
+        body += "\0" * ((-(offset + len(body))) % 4)
+        shoff = offset + len(body)
+        ident = "\x7fELF" + struct.pack("<BBBB", 1, 1, 1, 0) + "\0" * 8
+        ehdr = ident + struct.pack("<HHIIIIIHHHHHH", 2, EM_ARM, 1, self.base | int(self.funcs[0][3]),
+                                   52, shoff, 0x05000000, 52, 32, 1, 40, len(headers),
+                                   len(headers) - 1)
+        phdr = struct.pack("<8I", 1, offset, self.base, self.base, len(code), len(code), 5, 0x1000)
+        with open(path, "wb") as f:
+            f.write(ehdr + phdr)
+            f.write("\0" * (offset - len(ehdr) - len(phdr)))
+            f.write(body)
+            f.write("".join(headers))
@@ -25,78 +25,63 @@ from config import Main
 import re
 import os
 import pure_utils
-import r2_keeper as r2
 import json
+import elf_model
+import src_cache
+import line_index as line_index_module
 
 def addr2functionname(addr, stage, debug=False):
-    elf = stage.elf
-    old = r2.gets(elf, "s")
-    r2.get(elf, "s 0x%x" % addr)    
-    s = r2.get(elf, "afi")
-    r2.get(elf, "s %s" % old)    
-    def getname(i):
-        name = i["name"]
-        if i.name.startswith("sym."):
-            name = name[4:]
-    #print "addr2fn %x " % (addr)            
-    for i in s:
-        if len(i) > 1:
-            print s
-            print "%x addr func" % addr
-            raise Exception
-        name = getname(i)
-        
-        return name
-    return ""
+    f = elf_model.get(stage.elf).function_at(addr)
+    if debug:
+        print "addr2fn %x %s" % (addr, f.name if f else None)
+    return f.name if f else ""
 
 def get_symbol_location(name, stage, debug=False):
     elf = stage.elf
     return pure_utils.get_symbol_location(elf, name, debug)    
 
+def _srcdir(srcdir=None):
+    if srcdir:
+        return srcdir
+    try:
+        return Main.get_runtime_config("temp_target_src_dir")
+    except AttributeError:
+        return ""
+
+
+def line_index(stage):
+    # saved next to the stage's static analysis db when there is one
+    try:
+        d = os.path.dirname(Main.get_static_analysis_config("db", stage))
+        path = os.path.join(d, "line-index.npz")
+    except AttributeError:
+        path = None
+    return line_index_module.get(stage.elf, path)
+
+
 def addr2line(addr, stage, debug=False):
-    fn = addr2functionname(addr, stage)
-    addr = get_symbol_location(fn, stage)
-    elf = stage.elf
-    #print "addr2line 0x%x" % addr
-    old = r2.gets(elf, "s")                
-    r2.get(elf, "s 0x%x" % addr)    
-    s = r2.gets(elf, "CL")
-    r2.get(elf, "s %s" % old)    
-    res = s.split()
-    d = r2.gets(elf, "pwd")
+    res = line_index(stage).addr2line(addr, _srcdir())
     if debug and res:
-        print "addr2line %s%s:%s" % (d, res[1][2:], res[3])
-    if res:
-        return "%s%s:%s" % (d, res[1][2:], res[3])
-    else:
-        return ""
+        print "addr2line %s" % res
+    return res
 
-def line2addrs(line, stage):
-    output = infoline(line, stage)
-    startat = output[0]
-    assembly = False
-    isataddr = None
-    restart = None
-    reend = None
-    if ("but contains no code." in startat) and (".S\" is at address" in startat):
-        if (".S\" is at address" in startat):  # is assembly
-            assembly = True
-        isataddr = re.compile("is at address (0x[0-9a-fA-F]{0,8})")
 
-    else:
-        restart = re.compile("starts at address (0x[0-9a-fA-F]{0,8})")
-        reend = re.compile("and ends at (0x[0-9a-fA-F]{0,8})")
-
-    if isataddr:
-        if assembly:
-            startaddr = int((isataddr.search(startat)).group(1), 0)
-            return (startaddr, startaddr+4)
-        else:
-            return (-1, -1)
-    else:
-        startaddr = int((restart.search(startat)).group(1), 0)
-        endaddr = int((reend.search(startat)).group(1), 0)
+def addr2lines(addrs, stage):
+    # addr2line of each of addrs
+    return line_index(stage).addr2lines(addrs, _srcdir())
+
+
+def line2addrs(line, stage):
+    r = line_index(stage).line_range(line, _srcdir())
+    if r is None:
+        return (-1, -1)
+    (startaddr, endaddr, exact) = r
+    if exact:
         return (startaddr, endaddr)
+    elif line.split(":")[0].endswith(".S"):  # is assembly
+        return (startaddr, startaddr+4)
+    else:
+        return (-1, -1)
 
 
 def line2src(line):
@@ -104,12 +89,11 @@ def line2src(line):
         [path, lineno] = line.split(':')
     except ValueError:
         return ""
-    cmd = "sed -n '%s,%sp' %s 2>/dev/null" % (lineno, lineno, path)
     try:
-        output = Main.shell.run_cmd(cmd)
-        return output
-    except:
+        output = src_cache.get(path).line(int(lineno))
+    except (IOError, OSError, ValueError):
         return ''
+    return output.strip() if output is not None else ''
 
 
 def addr2disasmobjdump(addr, sz, stage, thumb=True, debug=False):
@@ -155,20 +139,14 @@ def addr2disasmobjdump(addr, sz, stage, thumb=True, debug=False):
 
 
 def get_c_function_names(stage):
-    cc = Main.cc
-    elf = stage.elf
-    cmd = '%sreadelf -W -s %s | grep FUNC 2>/dev/null' % (cc, elf)
-    output = Main.shell.run_multiline_cmd(cmd)
+    return [(f.name, f.value) for f in elf_model.get(stage.elf).functions() if f.name]
 
-    results = []
-    for l in output:
-        cols = l.split()
-        if len(cols) > 7:
-            addr = cols[1]
-            name = cols[7]     
-            results.append((name, int(addr, 16)))        
 
-    return results
+def get_function_symbols(elf):
+    # (name, value, size) of every sized FUNC symbol in elf, value keeps
+    # the thumb bit
+    return [(f.name, f.value, f.size) for f in elf_model.get(elf).functions()
+            if f.name and (f.size > 0)]
 
 
 def get_section_headers(stage):
@@ -182,50 +160,28 @@ def get_section_location(name, stage):
 
 
 def get_symbol_location_start_end(name, stage, debug=False):
-    elf = stage.elf
-    s = r2.get(elf, "isj")    
-    for i in s:
-        if i["name"] == name:
-            addr = i["vaddr"]
-            if debug:
-                print i            
-            return (addr, addr + i["size"])
-    return (-1, -1)
+    s = elf_model.get(stage.elf).symbol(name)
+    if s is None:
+        return (-1, -1)
+    if debug:
+        print s.__dict__
+    return (s.addr, s.addr + s.size)
 
 
 def get_line_addr(line, start, stage, debug=False, srcdir=None):
-    cc = Main.cc
-    elf = stage.elf
-    if srcdir:
-        srcdir = "--cd=%s " % (srcdir)
-    cmd = "%sgdb %s -ex 'info line %s' --batch --nh --nx  %s 2>/dev/null" % (cc,
-                                                                             srcdir,
-                                                                             line, elf)
-    if debug:
-        print cmd
-    output = Main.shell.run_multiline_cmd(cmd)
+    r = line_index(stage).line_range(line, _srcdir(srcdir))
     if debug:
-        print output
-    output = output[0]
-
-    assembly = False
-    if ("but contains no code." in output) and (".S\" is at address" in output):
-        if (".S\" is at address" in output):  # is assembly
-            assembly = True
-        readdr = re.compile("is at address (0x[0-9a-fA-F]{0,8})")
-    elif start:
-        readdr = re.compile("starts at address (0x[0-9a-fA-F]{0,8})")
-    else:
-        readdr = re.compile("and ends at (0x[0-9a-fA-F]{0,8})")
-    if not readdr:
+        print "info line %s: %s" % (line, r)
+    if r is None:
         return -1
-    addrg = readdr.search(output)
-    if not addrg:
+    (startaddr, endaddr, exact) = r
+    if exact:
+        return startaddr if start else endaddr
+    elif line.split(":")[0].endswith(".S"):  # is assembly
+        # give something larger for end endress for non-includive range
+        return startaddr if start else startaddr + 1
+    else:
         return -1
-    res = int(addrg.group(1), 0)
-    if assembly and (not start):
-        res += 1   # give something larger for end endress for non-includive range
-    return res
 
 
 def symbol_relocation_file(name, offset, stage, path=None, debug=False):
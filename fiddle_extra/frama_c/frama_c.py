@@ -528,8 +528,7 @@ class FramaCDstPluginManager():
             results = [r for r in self.results.itervalues()]
             print "have %d results" % len(results)
             print "adding dst entries"
-            for r in results:
-                db_info.get(self.stage).add_range_dsts_entry(r)
+            db_info.get(self.stage).add_range_dsts_entries(results)
             print '-----------'
             # db_info.get(self.stage).print_range_dsts_info()
             db_info.get(self.stage).consolidate_trace_write_table()
@@ -347,23 +347,28 @@ class GDBTargetController(object):
             return        
         i = 0
         n = db_info.get(stage).num_writes()
+        recipes = db_info.get(stage).write_recipes()
         self.gdb_print("%d write breakpoints\n" % n)
-        for (pc, halt) in db_info.get(stage).write_info():
+        writes = db_info.get(stage).write_info()
+        pcs = [pc for (pc, halt) in writes]
+        skipped = db_info.get(stage).skip_pc_array(pcs)
+        longwrite = db_info.get(stage).is_pc_longwrite_array(pcs)
+        for (j, (pc, halt)) in enumerate(writes):
             if halt is True:
                 if self.isbaremetal:
                     # check to see this address isn't in a skip range
-                    if db_info.get(stage).skip_pc(pc):
+                    if skipped[j]:
                         # don't insert WriteBreak
                         continue
 
                 # halt should be false for write entries that match a longwrite writepc,
                 # but check just in case
-                if db_info.get(stage).is_pc_longwrite(pc):
+                if longwrite[j]:
                     self.gdb_print("write pc 0x%x is part of a longwrite, not adding breakpoint.\n"
                                    % pc)
                     continue
                 i = i + 1
-                WriteBreak(pc, self, stage)
+                WriteBreak(pc, self, stage, recipes[pc])
         self.gdb_print("actually inserted %s of %s write breakpoints\n" % (i, n))
 
     def until(self, args):
@@ -708,7 +713,7 @@ class TargetFinishBreakpoint(gdb.FinishBreakpoint, TargetBreak):
             setattr(self, k, v)
         if controller.isbaremetal:
             pc = controller.get_reg_value("lr")
-            (ts, arms, ds) = getattr(Main.raw.runtime.thumbranges, stage.stagename)()
+            (ts, arms, ds) = getattr(Main.raw.runtime.thumb_ranges, stage.stagename)()
             if not (ts.search(pc) or arms.search(pc)):
                 self.breakpoint = None
                 return
@@ -737,17 +742,20 @@ class ReturnBreak(TargetBreak):
 
 
 class WriteBreak(TargetBreak):
-    def __init__(self, spec, controller, stage):
+    def __init__(self, spec, controller, stage, recipe):
         if not isinstance(spec, str):
             spec = "*(0x%x)" % spec
         self.emptywrite = {'start': None,
                            'end': None,
                            'cpsr': None,
                            'thumb': None,
-                           'i': None,
-                           'ins': None,
                            'pc': None}
         self.writeinfo = self.emptywrite
+        # everything needed to calculate the destination was decoded
+        # during static analysis, see InstructionAnalyzer.store_recipe
+        (basereg, indexreg, self.lshift, self.disp, self.size, self.cc) = recipe
+        self.basereg = controller.ia.reg_name(basereg)
+        self.indexreg = controller.ia.reg_name(indexreg)
         TargetBreak.__init__(self, spec, controller, True, stage)
 
     def _stop(self, bp, ret):
@@ -755,18 +763,12 @@ class WriteBreak(TargetBreak):
         if cont.calculate_write_dst:
             self.writeinfo = self.emptywrite
             pc = cont.get_reg_value('pc', True)
-            inspc = pc - self.relocated
             cpsr = cont.get_reg_value("cpsr", True)
             thumb = cont.ia.is_thumb(cpsr)
-            i = cont.get_instr_value(pc, thumb)
-            ins = cont.ia.disasm(i, thumb, inspc, True)
-            row = db_info.get(self.stage).pc_writes_info(inspc)
-            size = row['writesize']
-            needed_regs = [row['reg0'], row['reg1'], row['reg2'], row['reg3']]
-            regs = []
-            for r in filter(lambda x: len(x) > 0, needed_regs):
-                regs.append(cont.get_reg_value(r, True))
-            dst = cont.ia.calculate_store_offset(ins, regs)
+            base = cont.get_reg_value(self.basereg, True) if self.basereg else 0
+            index = cont.get_reg_value(self.indexreg, True) if self.indexreg else 0
+            dst = cont.ia.recipe_store_offset(self.lshift, self.disp, base, index)
+            size = self.size
             if size < 0:  # (ie. push instruction)
                 end = dst
                 start = dst + size
@@ -779,8 +781,6 @@ class WriteBreak(TargetBreak):
                 'end': end,
                 'cpsr': cpsr,
                 'thumb': thumb,
-                'i': i,
-                'ins': ins,
             }
         return False
 
@@ -54,6 +54,7 @@ setuptools.setup(
         'functools32',
         'toml.py',
         'r2pipe',
+        'pyelftools',
     ],
     cmdclass={'install': PkgInstall},
     package_data={